@@ -0,0 +1,285 @@
+import hashlib
+import json
+import struct
+import zlib
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable
+
+from google.protobuf.descriptor import Descriptor
+
+import parallel_gzip
+from backup_diff import digest, record_key
+from backup_stream import MANGA_FIELD, WIRE_LEN, decode_varint, encode_varint, iter_spans
+from lazy_backup import open_backup
+from schema_registry import SchemaNotCached, backup_class
+
+# A delta turns one backup into the next one. It is a list of operations over
+# the serialized fields of the newer backup, each one either copying a run of
+# fields from the base backup, spelling out a field, or patching a field of
+# the base with a nested list of operations. Manga are matched by
+# (source, url) and chapters and history entries by url, so a manga with one
+# newly read chapter costs the few bytes of that chapter's changed fields,
+# and a removed manga costs nothing.
+#
+# <delta.tbkdelta> is gzip compressed:
+#   header      magic, SHA-256 of the base and of the result payload, result size, metadata size
+#   metadata    JSON with counts and the removed manga keys, for people reading the delta
+#   operations  varint encoded, see COPY, LITERAL and PATCH
+#
+# The result is the exact payload (decompressed protobuf) of the newer backup
+# and is checked against its hash when the delta is written and applied.
+
+MAGIC = b'TBKDLT01'
+HEADER = struct.Struct('<8s32s32sQI')
+COPY = 0  # base field index, count: consecutive fields of the base
+LITERAL = 1  # size, bytes: fields written out
+PATCH = 2  # base field index, size, operations: a submessage of the base, patched
+
+# field number -> (key of a serialized entry, spec of the entry's own fields)
+Spec = dict[int, tuple[Callable, dict]]
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def patch_spec(message_type: Descriptor) -> Spec:
+    manga = message_type.fields_by_number[MANGA_FIELD].message_type
+    source, url = manga.fields_by_name['source'].number, manga.fields_by_name['url'].number
+    spec = {}
+    for name in ('chapters', 'history'):
+        entry_url = manga.fields_by_name[name].message_type.fields_by_name['url'].number
+        spec[manga.fields_by_name[name].number] = (
+            lambda data, start, end, number=entry_url: record_key(data, start, end, 0, number)[1],
+            {},
+        )
+    return {MANGA_FIELD: (lambda data, start, end: record_key(data, start, end, source, url), spec)}
+
+
+def field_spans(data, start: int, end: int) -> list[tuple[int, int, int, int, int]]:
+    # (number, wire type, start of the tag, start of the value, end) per field
+    fields = []
+    field_start = start
+    for number, wire_type, value_start, value_end in iter_spans(data, start, end):
+        fields.append((number, wire_type, field_start, value_start, value_end))
+        field_start = value_end
+    return fields
+
+
+def apply_patch(base, start: int, end: int, operations, out: bytearray) -> None:
+    base_fields = field_spans(base, start, end)
+    pos = 0
+    try:
+        while pos < len(operations):
+            op, pos = decode_varint(operations, pos)
+            if op == COPY:
+                index, pos = decode_varint(operations, pos)
+                count, pos = decode_varint(operations, pos)
+                out += base[base_fields[index][2] : base_fields[index + count - 1][4]]
+            elif op == LITERAL:
+                size, pos = decode_varint(operations, pos)
+                out += operations[pos : pos + size]
+                pos += size
+            elif op == PATCH:
+                index, pos = decode_varint(operations, pos)
+                size, pos = decode_varint(operations, pos)
+                number, _, _, value_start, value_end = base_fields[index]
+                value = bytearray()
+                apply_patch(base, value_start, value_end, operations[pos : pos + size], value)
+                out += encode_varint(number << 3 | WIRE_LEN) + encode_varint(len(value)) + value
+                pos += size
+            else:
+                raise DeltaError(f'Unknown delta operation {op}')
+    except (IndexError, EOFError) as e:
+        raise DeltaError('The delta does not fit this base backup') from e
+
+
+def encode_patch(base, base_range: tuple[int, int], target, target_range: tuple[int, int], spec: Spec) -> bytes:
+    base_fields = field_spans(base, *base_range)
+    by_digest: dict[bytes, int] = {}
+    by_key: dict[tuple, int] = {}
+    for index, (number, wire_type, field_start, value_start, end) in enumerate(base_fields):
+        by_digest.setdefault(digest(base[field_start:end]), index)
+        if number in spec and wire_type == WIRE_LEN:
+            by_key.setdefault((number, spec[number][0](base, value_start, end)), index)
+
+    operations = bytearray()
+    run: list[int] | None = None  # [first base index, count]
+
+    def flush() -> None:
+        nonlocal run
+        if run:
+            operations.extend(encode_varint(COPY) + encode_varint(run[0]) + encode_varint(run[1]))
+        run = None
+
+    for number, wire_type, field_start, value_start, end in field_spans(target, *target_range):
+        field = target[field_start:end]
+        index = by_digest.get(digest(field))
+        if index is not None:
+            if run and run[0] + run[1] == index:
+                run[1] += 1
+            else:
+                flush()
+                run = [index, 1]
+            continue
+        flush()
+        operation = None
+        if number in spec and wire_type == WIRE_LEN:
+            key, child_spec = spec[number]
+            index = by_key.get((number, key(target, value_start, end)))
+            if index is not None:
+                _, _, _, base_start, base_end = base_fields[index]
+                patch = encode_patch(base, (base_start, base_end), target, (value_start, end), child_spec)
+                operation = encode_varint(PATCH) + encode_varint(index) + encode_varint(len(patch)) + patch
+                rebuilt = bytearray()
+                apply_patch(base, base_start, base_end, patch, rebuilt)
+                # Fall back to the plain field when patching doesn't pay off, or
+                # when the original wasn't encoded the way protobuf encodes it
+                prefix = encode_varint(number << 3 | WIRE_LEN) + encode_varint(end - value_start)
+                if (
+                    len(operation) >= len(field)
+                    or rebuilt != target[value_start:end]
+                    or target[field_start:value_start] != prefix
+                ):
+                    operation = None
+        if operation is None:
+            operation = encode_varint(LITERAL) + encode_varint(len(field)) + field
+        operations += operation
+    flush()
+    return bytes(operations)
+
+
+def manga_keys(data, spec: Spec) -> list[tuple[int, str]]:
+    key = spec[MANGA_FIELD][0]
+    return [
+        key(data, start, end)
+        for number, wire_type, start, end in iter_spans(data)
+        if number == MANGA_FIELD and wire_type == WIRE_LEN
+    ]
+
+
+def create_delta(base, target, spec: Spec) -> tuple[bytes, dict]:
+    operations = encode_patch(base, (0, len(base)), target, (0, len(target)), spec)
+    rebuilt = bytearray()
+    apply_patch(base, 0, len(base), operations, rebuilt)
+    target_sha = hashlib.sha256(target).digest()
+    if hashlib.sha256(rebuilt).digest() != target_sha:
+        raise DeltaError('The delta does not reproduce the new backup')
+
+    base_keys, target_keys = set(manga_keys(base, spec)), manga_keys(target, spec)
+    metadata = {
+        'manga': len(target_keys),
+        'added': len(set(target_keys) - base_keys),
+        'removed': [[str(source), url] for source, url in sorted(base_keys - set(target_keys))],
+    }
+    encoded_metadata = json.dumps(metadata, ensure_ascii=False).encode()
+    header = HEADER.pack(
+        MAGIC, hashlib.sha256(base).digest(), target_sha, len(target), len(encoded_metadata)
+    )
+    return header + encoded_metadata + operations, metadata
+
+
+def read_delta(data: bytes) -> tuple[bytes, bytes, int, dict, memoryview]:
+    # (base SHA-256, result SHA-256, result size, metadata, operations)
+    if len(data) < HEADER.size:
+        raise DeltaError('Not a backup delta')
+    magic, base_sha, target_sha, target_size, metadata_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise DeltaError('Not a backup delta')
+    metadata_end = HEADER.size + metadata_size
+    metadata = json.loads(data[HEADER.size : metadata_end])
+    return base_sha, target_sha, target_size, metadata, memoryview(data)[metadata_end:]
+
+
+def apply_delta(base, delta: bytes) -> bytearray:
+    base_sha, target_sha, target_size, _, operations = read_delta(delta)
+    if hashlib.sha256(base).digest() != base_sha:
+        raise DeltaError('The delta was made from a different base backup')
+    result = bytearray()
+    apply_patch(base, 0, len(base), operations, result)
+    if len(result) != target_size or hashlib.sha256(result).digest() != target_sha:
+        raise DeltaError('The rebuilt backup does not match the hash stored in the delta')
+    return result
+
+
+def write_delta(path: Path, delta: bytes, level: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with parallel_gzip.open(path, 'wb', level) as file:
+        file.write(delta)
+
+
+def load_delta(path: Path) -> bytes:
+    try:
+        with parallel_gzip.open(path, 'rb') as file:
+            return file.read()
+    except (zlib.error, EOFError) as e:
+        raise DeltaError('Not a backup delta') from e
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith('.tachibk') or path.endswith('.proto.gz')
+
+
+def write_payload(path: Path, data, level: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if is_compressed(str(path)):
+        with parallel_gzip.open(path, 'wb', level) as file:
+            file.write(data)
+    else:
+        path.write_bytes(data)
+
+
+if __name__ == '__main__':
+    argp = ArgumentParser(description='Store a backup as the difference to an older one, and rebuild it')
+    argp.add_argument('--fork', default='mihon', metavar='<fork>', help='Fork for the backup schema. Default: mihon')
+    commands = argp.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='Write the delta from <base> to <new>')
+    create.add_argument('base', metavar='<base_backup.tachibk>', type=Path)
+    create.add_argument('new', metavar='<new_backup.tachibk>', type=Path)
+    create.add_argument('--output', '-o', required=True, metavar='<delta.tbkdelta>', type=Path)
+    apply = commands.add_parser('apply', help='Rebuild a backup from <base> and a delta')
+    apply.add_argument('base', metavar='<base_backup.tachibk>', type=Path)
+    apply.add_argument('delta', metavar='<delta.tbkdelta>', type=Path)
+    apply.add_argument(
+        '--output',
+        '-o',
+        required=True,
+        metavar='<restored.tachibk | restored.proto>',
+        help='TACHIBK or PROTO.GZ get compressed',
+        type=Path,
+    )
+    for command in (create, apply):
+        command.add_argument(
+            '--compression-level',
+            default=parallel_gzip.DEFAULT_LEVEL,
+            type=int,
+            choices=range(10),
+            metavar='<0-9>',
+            help='Gzip level of the output. Default: 9',
+        )
+    args = argp.parse_args()
+
+    try:
+        Backup = backup_class(args.fork)
+        base = open_backup(args.base, Backup).data
+        if args.command == 'create':
+            target = open_backup(args.new, Backup).data
+            delta, metadata = create_delta(base, target, patch_spec(Backup.DESCRIPTOR))
+            write_delta(args.output, delta, args.compression_level)
+            print(
+                f'Delta written to "{args.output}" ({args.output.stat().st_size / 1024:.1f} KiB,'
+                f' {metadata["added"]} added and {len(metadata["removed"])} removed manga)'
+            )
+        else:
+            write_payload(args.output, apply_delta(base, load_delta(args.delta)), args.compression_level)
+            print(f'Backup rebuilt and verified, written to "{args.output}"')
+    except SchemaNotCached as e:
+        print(f'ERROR! {e}')
+        exit(1)
+    except OSError as e:
+        print(f'ERROR! Could not read the file. {e}')
+        exit(1)
+    except DeltaError as e:
+        print(f'ERROR! {e}')
+        exit(1)
@@ -0,0 +1,216 @@
+import hashlib
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+from google.protobuf.message import Message
+from google.protobuf.message_factory import GetMessageClass
+
+from backup_stream import MANGA_FIELD, WIRE_LEN, decode_varint, iter_spans
+from lazy_backup import LazyBackup, open_backup
+from schema_registry import SchemaNotCached, backup_class
+
+# Compares two backups without decoding either one completely. Every manga
+# is keyed by (source, url), read from the first two fields of its serialized
+# record, and fingerprinted with a hash of the record bytes. Only manga whose
+# hashes differ get parsed, and inside those the same is done per chapter,
+# keyed by url, so the cost grows with the size of the change rather than
+# the size of the library.
+
+DIGEST_SIZE = 16
+
+
+def digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def signed64(value: int) -> int:
+    # int64 varints are two's complement
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def record_key(data, start: int, end: int, number_field: int, string_field: int) -> tuple[int, str]:
+    # (int64 field, string field) of a serialized record, e.g. a manga's
+    # source and url. Both come first, protobuf writes fields in number order.
+    number, text = 0, ''
+    for field, wire_type, value_start, value_end in iter_spans(data, start, end):
+        if field == number_field and wire_type == 0:
+            number = signed64(decode_varint(data, value_start)[0])
+        elif field == string_field and wire_type == WIRE_LEN:
+            text = str(data[value_start:value_end], 'utf-8')
+        if field >= max(number_field, string_field):
+            break
+    return number, text
+
+
+class KeyedBackup:
+    # A LazyBackup with its manga looked up by (source, url)
+    def __init__(self, backup: LazyBackup):
+        self.backup = backup
+        self.data = backup.data
+        manga = backup.fields[MANGA_FIELD].message_type
+        self.source_field = manga.fields_by_name['source'].number
+        self.url_field = manga.fields_by_name['url'].number
+        self.chapters_field = manga.fields_by_name['chapters'].number
+        self.chapter_class = GetMessageClass(manga.fields_by_name['chapters'].message_type)
+        self.chapter_url_field = manga.fields_by_name['chapters'].message_type.fields_by_name['url'].number
+        # key -> (manga index, record hash). Later duplicates of a key win,
+        # like they do when the app restores the backup.
+        self.manga: dict[tuple[int, str], tuple[int, bytes]] = {}
+        for index in range(len(backup)):
+            start, end = backup.span(index)
+            key = record_key(self.data, start, end, self.source_field, self.url_field)
+            self.manga[key] = (index, digest(self.data[start:end]))
+
+    @classmethod
+    def open(cls, path: str | Path, message_type: type[Message]) -> 'KeyedBackup':
+        return cls(open_backup(path, message_type))
+
+    def __len__(self) -> int:
+        return len(self.manga)
+
+    def record(self, key: tuple[int, str]) -> memoryview:
+        start, end = self.backup.span(self.manga[key][0])
+        return self.data[start:end]
+
+    def parse(self, key: tuple[int, str]) -> Message:
+        return self.backup.manga(self.manga[key][0])
+
+    def chapters(self, key: tuple[int, str]) -> dict[str, tuple[memoryview, bytes]]:
+        # url -> (serialized chapter, hash)
+        start, end = self.backup.span(self.manga[key][0])
+        chapters = {}
+        for field, wire_type, chapter_start, chapter_end in iter_spans(self.data, start, end):
+            if field != self.chapters_field or wire_type != WIRE_LEN:
+                continue
+            chapter = self.data[chapter_start:chapter_end]
+            _, url = record_key(chapter, 0, len(chapter), 0, self.chapter_url_field)
+            chapters[url] = (chapter, digest(chapter))
+        return chapters
+
+    def category_names(self) -> dict[int, str]:
+        # Manga refer to categories by their order
+        return {
+            category.order if category.HasField('order') else index: category.name
+            for index, category in enumerate(self.backup.categories())
+        }
+
+
+class BackupDiff:
+    def __init__(self, old: KeyedBackup, new: KeyedBackup):
+        self.added: list[dict] = []
+        self.removed: list[dict] = []
+        self.category_moves: list[dict] = []
+        self.newly_read: list[dict] = []
+        self.changed = self.unchanged = 0
+
+        old_categories, new_categories = old.category_names(), new.category_names()
+        for key in old.manga.keys() - new.manga.keys():
+            self.removed.append(self.entry(key, old.backup.summary(old.manga[key][0]).title))
+        for key, (index, new_digest) in new.manga.items():
+            if key not in old.manga:
+                self.added.append(self.entry(key, new.backup.summary(index).title))
+                continue
+            if old.manga[key][1] == new_digest:
+                self.unchanged += 1
+                continue
+            self.changed += 1
+            old_manga, new_manga = old.parse(key), new.parse(key)
+            old_names = sorted(old_categories.get(cid, 'Uncategorized') for cid in old_manga.categories)
+            new_names = sorted(new_categories.get(cid, 'Uncategorized') for cid in new_manga.categories)
+            if old_names != new_names:
+                entry = self.entry(key, new_manga.title)
+                entry.update(old=old_names or ['Uncategorized'], new=new_names or ['Uncategorized'])
+                self.category_moves.append(entry)
+            if read := self.read_chapters(old.chapters(key), new.chapters(key), new.chapter_class):
+                entry = self.entry(key, new_manga.title)
+                entry['chapters'] = read
+                self.newly_read.append(entry)
+        for entries in (self.added, self.removed, self.category_moves, self.newly_read):
+            entries.sort(key=lambda entry: (entry['title'].lower(), entry['source'], entry['url']))
+
+    @staticmethod
+    def entry(key: tuple[int, str], title: str) -> dict:
+        return {'title': title or 'Unknown Title', 'source': str(key[0]), 'url': key[1]}
+
+    @staticmethod
+    def read_chapters(old: dict, new: dict, chapter_class: type[Message]) -> list[str]:
+        # Names of the chapters read in the new backup but not in the old one
+        read = []
+        for url, (data, chapter_digest) in new.items():
+            if url in old and old[url][1] == chapter_digest:
+                continue
+            chapter = chapter_class.FromString(data)
+            if chapter.read and (url not in old or not chapter_class.FromString(old[url][0]).read):
+                read.append(chapter.name)
+        return read
+
+    @property
+    def chapters_read(self) -> int:
+        return sum(len(entry['chapters']) for entry in self.newly_read)
+
+    def as_dict(self) -> dict:
+        return {
+            'unchanged': self.unchanged,
+            'changed': self.changed,
+            'added': self.added,
+            'removed': self.removed,
+            'category_moves': self.category_moves,
+            'newly_read': self.newly_read,
+        }
+
+
+def print_diff(diff: BackupDiff, limit: int) -> None:
+    def section(title: str, entries: list[dict], describe) -> None:
+        if not entries:
+            return
+        print(f'\n{title} ({len(entries)}):')
+        for entry in entries[:limit] if limit else entries:
+            print(f'• {describe(entry)}')
+        if limit and len(entries) > limit:
+            print(f'  ... and {len(entries) - limit} more')
+
+    section('➕ Added manga', diff.added, lambda entry: entry['title'])
+    section('➖ Removed manga', diff.removed, lambda entry: entry['title'])
+    section(
+        '📂 Category moves',
+        diff.category_moves,
+        lambda entry: f'{entry["title"]}: {", ".join(entry["old"])} → {", ".join(entry["new"])}',
+    )
+    section(
+        '📖 Newly read chapters',
+        diff.newly_read,
+        lambda entry: f'{entry["title"]}: {len(entry["chapters"])} chapter(s)',
+    )
+    print(
+        f'\n📊 {len(diff.added)} added, {len(diff.removed)} removed, {diff.changed} changed,'
+        f' {diff.unchanged} unchanged, {diff.chapters_read} chapters newly read'
+    )
+
+
+if __name__ == '__main__':
+    argp = ArgumentParser(description='Show what changed between two backups')
+    argp.add_argument('old', metavar='<old_backup.tachibk>', type=Path)
+    argp.add_argument('new', metavar='<new_backup.tachibk>', type=Path)
+    argp.add_argument('--fork', default='mihon', metavar='<fork>', help='Fork for the backup schema. Default: mihon')
+    argp.add_argument('--json', type=Path, metavar='<diff.json>', help='Also write the full diff as JSON')
+    argp.add_argument(
+        '--limit', type=int, default=20, metavar='<count>', help='Entries printed per section, 0 for all. Default: 20'
+    )
+    args = argp.parse_args()
+
+    try:
+        Backup = backup_class(args.fork)
+    except SchemaNotCached as e:
+        print(f'ERROR! {e}')
+        exit(1)
+    try:
+        old, new = KeyedBackup.open(args.old, Backup), KeyedBackup.open(args.new, Backup)
+    except OSError as e:
+        print(f'ERROR! Could not read the backup. {e}')
+        exit(1)
+    diff = BackupDiff(old, new)
+    print_diff(diff, args.limit)
+    if args.json:
+        args.json.write_text(json.dumps(diff.as_dict(), indent=2, ensure_ascii=False))
+        print(f'Diff written to "{args.json}"')
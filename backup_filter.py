@@ -0,0 +1,338 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, TextIO
+
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+from google.protobuf.message_factory import GetMessageClass
+
+import parallel_gzip
+import record_file
+from backup_stream import MANGA_FIELD, WIRE_LEN, encode_varint, iter_spans, write_backup_stream, write_json_records
+from json_stream import iter_json_items
+from lazy_backup import LazyBackup, open_backup
+from library import category_names, source_names
+from preference_codec import PreferenceCodec
+
+# Keeps the manga of a backup (or decoded JSON) that match a query, in one
+# pass over backupManga. Names in the query are turned into sets of category
+# orders and source ids up front, so each manga is tested with set lookups
+# on its ids. Matching records are written straight to the output and left
+# unchanged, only the categories no kept manga uses are dropped.
+#
+# Backups are read through LazyBackup, which tests a summary of each manga
+# (ids, dateAdded and read flags) and copies the serialized record if it
+# matches. JSON is read twice as a stream, first for the categories and
+# sources that follow the manga, then for the manga themselves.
+# backupManga always comes first in the output, as in the converter's JSON.
+
+UNCATEGORIZED = 'Uncategorized'
+CATEGORY_FIELD = 2
+
+
+def is_backup(path: str | Path) -> bool:
+    return str(path).endswith(('.tachibk', '.proto.gz', '.proto', record_file.SUFFIX))
+
+
+def open_output(output: Path, level: int, fork: str):
+    if record_file.is_record_file(output):
+        return record_file.open_writer(output, fork)
+    compressed = str(output).endswith(('.tachibk', '.proto.gz'))
+    return parallel_gzip.open(output, 'wb', level) if compressed else open(output, 'wb')
+
+
+def date_to_ms(text: str) -> int:
+    # Local midnight, like the dates the app shows
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+class Query:
+    def __init__(
+        self,
+        categories: list[str] | None = None,
+        exclude_categories: list[str] | None = None,
+        sources: list[str] | None = None,
+        min_read_ratio: float | None = None,
+        max_read_ratio: float | None = None,
+        added_after: str | None = None,
+        added_before: str | None = None,
+    ):
+        self.categories = categories
+        self.exclude_categories = exclude_categories
+        self.sources = sources
+        self.min_read_ratio = min_read_ratio
+        self.max_read_ratio = max_read_ratio
+        # dateAdded range in ms, the end is exclusive
+        self.added_after = date_to_ms(added_after) if added_after else None
+        self.added_before = date_to_ms(added_before) if added_before else None
+        self.category_ids: set[int] | None = None
+        self.excluded_ids: set[int] | None = None
+        self.source_ids: set[int] | None = None
+
+    @property
+    def empty(self) -> bool:
+        return all(
+            value is None
+            for value in (
+                self.categories,
+                self.exclude_categories,
+                self.sources,
+                self.min_read_ratio,
+                self.max_read_ratio,
+                self.added_after,
+                self.added_before,
+            )
+        )
+
+    @staticmethod
+    def resolve(names: list[str], known: dict[int, str], kind: str) -> set[int]:
+        # Names are matched case-insensitively, ids can be given as numbers
+        by_name: dict[str, set[int]] = {}
+        for key, name in known.items():
+            by_name.setdefault(name.casefold(), set()).add(key)
+        ids = set()
+        for name in names:
+            if name.casefold() in by_name:
+                ids |= by_name[name.casefold()]
+            elif name.lstrip('-').isdigit():
+                ids.add(int(name))
+            elif name != UNCATEGORIZED:
+                print(f'⚠️ No {kind} named "{name}"')
+        return ids
+
+    def bind(self, categories: dict[int, str], sources: dict[int, str]) -> None:
+        # categories: order -> name, sources: id -> name
+        if self.categories is not None:
+            self.category_ids = self.resolve(self.categories, categories, 'category')
+        if self.exclude_categories is not None:
+            self.excluded_ids = self.resolve(self.exclude_categories, categories, 'category')
+        if self.sources is not None:
+            self.source_ids = self.resolve(self.sources, sources, 'source')
+
+    def matches(self, source: int, category_ids, read: int, total: int, date_added: int) -> bool:
+        if self.source_ids is not None and source not in self.source_ids:
+            return False
+        if self.category_ids is not None:
+            if category_ids:
+                if self.category_ids.isdisjoint(category_ids):
+                    return False
+            elif UNCATEGORIZED not in self.categories:
+                return False
+        if self.excluded_ids is not None:
+            if category_ids:
+                if not self.excluded_ids.isdisjoint(category_ids):
+                    return False
+            elif UNCATEGORIZED in self.exclude_categories:
+                return False
+        if self.min_read_ratio is not None or self.max_read_ratio is not None:
+            ratio = read / total if total else 0.0
+            if self.min_read_ratio is not None and ratio < self.min_read_ratio:
+                return False
+            if self.max_read_ratio is not None and ratio > self.max_read_ratio:
+                return False
+        if self.added_after is not None and date_added < self.added_after:
+            return False
+        if self.added_before is not None and date_added >= self.added_before:
+            return False
+        return True
+
+    def matches_summary(self, summary: Message) -> bool:
+        read = [chapter.read for chapter in summary.chapters].count(True)
+        return self.matches(summary.source, summary.categories, read, len(summary.chapters), summary.dateAdded)
+
+    def matches_dict(self, manga: dict) -> bool:
+        # MessageToDict output: int64 values are strings
+        chapters = manga.get('chapters', [])
+        read = [chapter.get('read', False) for chapter in chapters].count(True)
+        return self.matches(
+            int(manga.get('source', 0)),
+            {int(cid) for cid in manga.get('categories', [])},
+            read,
+            len(chapters),
+            int(manga.get('dateAdded', 0)),
+        )
+
+
+def order_keys(category_map: dict[str, str]) -> dict[int, str]:
+    return {int(key): name for key, name in category_map.items()}
+
+
+class FilterResult:
+    def __init__(self):
+        self.total = 0
+        self.kept = 0
+        self.used_categories: set[int] = set()
+
+    def keep(self, category_ids) -> None:
+        self.kept += 1
+        self.used_categories.update(int(cid) for cid in category_ids)
+
+
+def filter_backup(
+    path: str | Path, message_type: type[Message], query: Query, output: Path, level: int, fork: str
+) -> FilterResult:
+    backup = open_backup(path, message_type)
+    query.bind(
+        order_keys(category_names(MessageToDict(cat) for cat in backup.categories())),
+        {int(key): name for key, name in source_names(MessageToDict(src) for src in backup.sources()).items()},
+    )
+    result = FilterResult()
+    kept: list[int] = []
+    for index in range(len(backup)):
+        summary = backup.summary(index)
+        result.total += 1
+        if query.matches_summary(summary):
+            kept.append(index)
+            result.keep(summary.categories)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if str(output).endswith('.json'):
+        with open(output, 'wt', buffering=1 << 20) as file:
+            write_json_records(filtered_records(backup, kept, result.used_categories), file, message_type)
+    else:
+        with open_output(output, level, fork) as file:
+            write_filtered_payload(backup, kept, result.used_categories, file)
+    return result
+
+
+def filtered_records(backup: LazyBackup, kept: list[int], used: set[int]) -> Iterator[tuple[int, Message]]:
+    for index in kept:
+        yield MANGA_FIELD, backup.manga(index)
+    for index, category in enumerate(backup.categories()):
+        if (category.order if category.HasField('order') else index) in used:
+            yield CATEGORY_FIELD, category
+    for number in sorted(backup.spans):
+        if number not in (MANGA_FIELD, CATEGORY_FIELD):
+            for entry in backup.entries(number):
+                yield number, entry
+
+
+def write_filtered_payload(backup: LazyBackup, kept: list[int], used: set[int], file) -> None:
+    # Kept manga are copied as serialized, the fields after them too, ones
+    # this schema doesn't know included
+    tag = encode_varint(MANGA_FIELD << 3 | WIRE_LEN)
+    for index in kept:
+        start, end = backup.span(index)
+        file.write(tag + encode_varint(end - start) + backup.data[start:end])
+    category_class = GetMessageClass(backup.fields[CATEGORY_FIELD].message_type)
+    category_index = field_start = 0
+    for number, _, value_start, end in iter_spans(backup.data):
+        start, field_start = field_start, end
+        if number == MANGA_FIELD:
+            continue
+        if number == CATEGORY_FIELD:
+            category = category_class.FromString(backup.data[value_start:end])
+            category_index += 1
+            if (category.order if category.HasField('order') else category_index - 1) not in used:
+                continue
+        file.write(backup.data[start:end])
+
+
+def filter_json(
+    path: str | Path, message_type: type[Message] | None, query: Query, output: Path, level: int, fork: str
+) -> FilterResult:
+    tail: dict[str, object] = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for key, value in iter_json_items(file, 'backupManga'):
+            if key != 'backupManga':
+                tail[key] = value
+    query.bind(
+        order_keys(category_names(tail.get('backupCategories', []))),
+        {int(key): name for key, name in source_names(tail.get('backupSources', [])).items()},
+    )
+
+    result = FilterResult()
+
+    def kept_manga() -> Iterator[dict]:
+        with open(path, 'r', encoding='utf-8') as file:
+            for key, manga in iter_json_items(file, 'backupManga'):
+                if key != 'backupManga':
+                    continue
+                result.total += 1
+                if query.matches_dict(manga):
+                    result.keep(manga.get('categories', []))
+                    yield manga
+
+    def filtered_tail() -> dict[str, object]:
+        # Only complete once every manga has been read
+        filtered = dict(tail)
+        if 'backupCategories' in filtered:
+            filtered['backupCategories'] = [
+                category
+                for index, category in enumerate(tail['backupCategories'])
+                if int(category.get('order', index)) in result.used_categories
+            ]
+            # MessageToDict leaves empty lists out, so does a filtered backup
+            if not filtered['backupCategories']:
+                del filtered['backupCategories']
+        return filtered
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if str(output).endswith('.json'):
+        with open(output, 'w', encoding='utf-8') as file:
+            write_json_object(kept_manga(), filtered_tail, file)
+    else:
+        def items() -> Iterator[tuple[str, object]]:
+            for manga in kept_manga():
+                yield 'backupManga', manga
+            yield from filtered_tail().items()
+
+        # Preferences decoded with --convert-preferences are serialized again
+        with open_output(output, level, fork) as file:
+            write_backup_stream(items(), file, message_type, PreferenceCodec(message_type).encode_preferences)
+    return result
+
+
+def backup_items(data: dict) -> Iterator[tuple[str, object]]:
+    for key, value in data.items():
+        if key == 'backupManga':
+            for manga in value:
+                yield key, manga
+        else:
+            yield key, value
+
+
+def write_backup_dict(
+    data: dict, message_type: type[Message] | None, output: Path, level: int = 9, fork: str = 'mihon'
+) -> None:
+    # A whole decoded backup, written like filter_file does by the output's
+    # extension. message_type is only needed for backup and record files
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if str(output).endswith('.json'):
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+        return
+    with open_output(output, level, fork) as file:
+        write_backup_stream(backup_items(data), file, message_type, PreferenceCodec(message_type).encode_preferences)
+
+
+def write_json_object(manga: Iterator[dict], tail, file: TextIO) -> None:
+    # Same text as json.dump(data, file, indent=2, ensure_ascii=False) with
+    # backupManga first, but the manga are written as they come. tail() is
+    # called once they are all written.
+    file.write('{\n  "backupManga": ')
+    count = 0
+    for entry in manga:
+        file.write(',' if count else '[')
+        file.write('\n    ' + json.dumps(entry, indent=2, ensure_ascii=False).replace('\n', '\n    '))
+        count += 1
+    file.write('\n  ]' if count else '[]')
+    for key, value in tail().items():
+        file.write(f',\n  {json.dumps(key, ensure_ascii=False)}: ')
+        file.write(json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+    file.write('\n}')
+
+
+def filter_file(
+    path: str | Path,
+    message_type: type[Message] | None,
+    query: Query,
+    output: Path,
+    level: int = 9,
+    fork: str = 'mihon',
+) -> FilterResult:
+    # fork is written to record file outputs
+    if is_backup(path):
+        return filter_backup(path, message_type, query, output, level, fork)
+    return filter_json(path, message_type, query, output, level, fork)
@@ -0,0 +1,240 @@
+from argparse import ArgumentParser
+from pathlib import Path
+
+from google.protobuf.message import DecodeError, Message
+from google.protobuf.message_factory import GetMessageClass
+
+import parallel_gzip
+import record_file
+from backup_diff import record_key
+from backup_stream import MANGA_FIELD, WIRE_LEN, encode_varint, iter_fields
+from schema_registry import SchemaNotCached, backup_class
+
+# Combines several backups, e.g. from different devices, into one. The inputs
+# are read one at a time as a stream of serialized fields, and only the
+# merged library is kept, with each manga as serialized bytes. A manga is
+# only decoded when another input has the same (source, url):
+#
+#   manga       the copy with the higher (version, lastModifiedAt) is kept, the
+#               later input on a tie, and gets the chapters, history and
+#               trackers only the other copy has
+#   chapters    by url, the higher (version, lastModifiedAt) wins
+#   history     by url, the latest lastRead wins
+#   categories  by name. Manga refer to categories by their order, so orders
+#               (and ids) are renumbered and every manga's category list is
+#               remapped once all inputs have been read.
+#   the rest    sources by id, preferences and extension repos by key, later
+#               inputs win. Other fields, including ones this schema doesn't
+#               know, are kept once per distinct value.
+
+CATEGORY_FIELD = 2
+# Top-level field -> key field of its entries
+KEY_FIELDS = {
+    'backupSources': 'sourceId',
+    'backupPreferences': 'key',
+    'backupSourcePreferences': 'sourceKey',
+    'backupExtensionRepo': 'baseUrl',
+}
+
+
+def rank(message: Message) -> tuple[int, int]:
+    # Forks without the fields rank everything the same
+    fields = message.DESCRIPTOR.fields_by_name
+    return tuple(getattr(message, name) if name in fields else 0 for name in ('version', 'lastModifiedAt'))
+
+
+def open_input(path: Path):
+    if record_file.is_record_file(path):
+        return record_file.open_payload(path)
+    if path.name.endswith('.tachibk') or path.name.endswith('.proto.gz'):
+        return parallel_gzip.open(path, 'rb')
+    return open(path, 'rb', buffering=1 << 20)
+
+
+def merge_entries(winner, other, key: str, keep) -> None:
+    # Adds the entries only `other` has, keep(current, candidate) decides shared ones
+    entries = {getattr(entry, key): entry for entry in winner}
+    for entry in other:
+        current = entries.get(getattr(entry, key))
+        if current is None:
+            entries[getattr(entry, key)] = winner.add()
+            entries[getattr(entry, key)].CopyFrom(entry)
+        elif keep(current, entry):
+            current.CopyFrom(entry)
+
+
+def merge_manga(current: Message, incoming: Message) -> tuple[Message, bool]:
+    # (merged manga, whether incoming was the winner)
+    incoming_wins = rank(incoming) >= rank(current)
+    winner, other = (incoming, current) if incoming_wins else (current, incoming)
+    merge_entries(winner.chapters, other.chapters, 'url', lambda kept, new: rank(new) > rank(kept))
+    merge_entries(winner.history, other.history, 'url', lambda kept, new: new.lastRead > kept.lastRead)
+    merge_entries(winner.tracking, other.tracking, 'syncId', lambda kept, new: False)
+    return winner, incoming_wins
+
+
+class BackupMerger:
+    def __init__(self, message_type: type[Message]):
+        self.message_type = message_type
+        descriptor = message_type.DESCRIPTOR
+        manga = descriptor.fields_by_number[MANGA_FIELD].message_type
+        self.manga_class = GetMessageClass(manga)
+        self.key_fields = (manga.fields_by_name['source'].number, manga.fields_by_name['url'].number)
+        self.classes = {
+            field.number: GetMessageClass(field.message_type)
+            for field in descriptor.fields
+            if field.message_type is not None
+        }
+        # (source, url) -> [serialized manga, input its category orders belong to]
+        self.manga: dict[tuple[int, str], list] = {}
+        self.category_tables: list[list[Message]] = []
+        # field number -> {key: entry}, key being the serialized entry for unknown fields
+        self.tail: dict[int, dict] = {}
+        self.inputs: list[tuple[str, int]] = []
+        self.merged = 0
+
+    def add(self, stream, name: str) -> None:
+        source = len(self.category_tables)
+        categories: list[Message] = []
+        count = 0
+        for number, wire_type, value, _ in iter_fields(stream):
+            if wire_type != WIRE_LEN:
+                continue
+            if number == MANGA_FIELD:
+                self.add_manga(value, source)
+                count += 1
+            elif number == CATEGORY_FIELD:
+                categories.append(self.classes[number].FromString(value))
+            else:
+                self.add_tail(number, value)
+        self.category_tables.append(categories)
+        self.inputs.append((name, count))
+
+    def add_manga(self, data: bytes, source: int) -> None:
+        key = record_key(data, 0, len(data), *self.key_fields)
+        entry = self.manga.get(key)
+        if entry is not None and entry[0] == data:
+            return
+        if entry is None:
+            self.manga[key] = [data, source]
+            return
+        merged, incoming_wins = merge_manga(self.manga_class.FromString(entry[0]), self.manga_class.FromString(data))
+        # The winner's category ids are kept
+        self.manga[key] = [merged.SerializeToString(), source if incoming_wins else entry[1]]
+        self.merged += 1
+
+    def add_tail(self, number: int, data: bytes) -> None:
+        entries = self.tail.setdefault(number, {})
+        field = self.message_type.DESCRIPTOR.fields_by_number.get(number)
+        if field is None or field.name not in KEY_FIELDS:
+            entries.setdefault(data, data)
+            return
+        message = self.classes[number].FromString(data)
+        key = getattr(message, KEY_FIELDS[field.name])
+        if field.name == 'backupSourcePreferences' and key in entries:
+            merge_entries(entries[key].prefs, message.prefs, 'key', lambda kept, new: True)
+            return
+        entries[key] = message
+
+    def categories(self) -> tuple[list[Message], list[dict[int, int]]]:
+        # (merged categories, old order -> new order for every input)
+        merged: dict[str, Message] = {}
+        used_ids: set[int] = set()
+        remaps = []
+        for table in self.category_tables:
+            remap = {}
+            ordered = sorted(
+                ((category.order if category.HasField('order') else index), index, category)
+                for index, category in enumerate(table)
+            )
+            for order, _, category in ordered:
+                if category.name not in merged:
+                    # Categories keep their order and id unless another one has it already
+                    new = type(category)()
+                    new.CopyFrom(category)
+                    taken = {kept.order for kept in merged.values()}
+                    if order in taken:
+                        new.order = max(taken) + 1
+                    if new.HasField('id') and new.id in used_ids:
+                        new.id = max(used_ids) + 1
+                    if new.HasField('id'):
+                        used_ids.add(new.id)
+                    merged[category.name] = new
+                remap[order] = merged[category.name].order
+            remaps.append(remap)
+        return list(merged.values()), remaps
+
+    def write(self, file) -> int:
+        categories, remaps = self.categories()
+        tag = encode_varint(MANGA_FIELD << 3 | WIRE_LEN)
+        for data, source in self.manga.values():
+            remap = remaps[source]
+            if any(old != new for old, new in remap.items()) or not remap:
+                manga = self.manga_class.FromString(data)
+                if manga.categories:
+                    manga.categories[:] = [remap[order] for order in manga.categories if order in remap]
+                    data = manga.SerializeToString()
+            file.write(tag + encode_varint(len(data)) + data)
+
+        # The other fields follow in number order, like protobuf writes them
+        tail = {CATEGORY_FIELD: [category.SerializeToString() for category in categories]}
+        for number, entries in self.tail.items():
+            tail[number] = [entry if isinstance(entry, bytes) else entry.SerializeToString() for entry in entries.values()]
+        for number in sorted(tail):
+            tag = encode_varint(number << 3 | WIRE_LEN)
+            for data in tail[number]:
+                file.write(tag + encode_varint(len(data)) + data)
+        return len(self.manga)
+
+
+if __name__ == '__main__':
+    argp = ArgumentParser(description='Merge several backups into one')
+    argp.add_argument(
+        'inputs',
+        nargs='+',
+        metavar='<backup_file.tachibk | backup_file.proto.gz | backup_file.proto | records.tbkrec>',
+        type=Path,
+    )
+    argp.add_argument(
+        '--output',
+        '-o',
+        default='output/merged.tachibk',
+        metavar='<merged.tachibk>',
+        help='TACHIBK or PROTO.GZ get compressed, TBKREC is a record file. Default: output/merged.tachibk',
+        type=Path,
+    )
+    argp.add_argument('--fork', default='mihon', metavar='<fork>', help='Fork for the backup schema. Default: mihon')
+    argp.add_argument(
+        '--compression-level',
+        default=parallel_gzip.DEFAULT_LEVEL,
+        type=int,
+        choices=range(10),
+        metavar='<0-9>',
+        help='Gzip level of the merged backup. Default: 9',
+    )
+    args = argp.parse_args()
+
+    try:
+        merger = BackupMerger(backup_class(args.fork))
+    except SchemaNotCached as e:
+        print(f'ERROR! {e}')
+        exit(1)
+    for path in args.inputs:
+        try:
+            with open_input(path) as stream:
+                merger.add(stream, str(path))
+        except (OSError, EOFError, ValueError, DecodeError) as e:
+            print(f'ERROR! Could not read "{path}". {e}')
+            exit(1)
+        print(f'📥 {path}: {merger.inputs[-1][1]} manga')
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    output = str(args.output)
+    compressed = output.endswith('.tachibk') or output.endswith('.proto.gz')
+    if record_file.is_record_file(output):
+        file = record_file.open_writer(output, args.fork)
+    else:
+        file = parallel_gzip.open(output, 'wb', args.compression_level) if compressed else open(output, 'wb')
+    with file:
+        count = merger.write(file)
+    print(f'✅ {count} manga ({merger.merged} merged from several backups) written to "{output}"')
@@ -0,0 +1,236 @@
+from json import dumps
+from typing import BinaryIO, Callable, Iterator, TextIO
+
+from google.protobuf.json_format import MessageToDict, ParseError
+from google.protobuf.message import Message
+from google.protobuf.message_factory import GetMessageClass
+
+from json_emitter import DictJSONEmitter, JSONEmitter
+from proto_builder import build_message
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LEN = 2
+WIRE_FIXED32 = 5
+
+# Field 1 of Backup, the only top-level field big enough to be worth streaming
+MANGA_FIELD = 1
+
+
+def read_varint(stream: BinaryIO) -> int | None:
+    result = shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift:
+                raise EOFError('Truncated varint in backup stream')
+            return None
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def varint_size(value: int) -> int:
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError(f'Truncated backup stream: expected {size} bytes, got {len(data)}')
+    return data
+
+
+def iter_fields(stream: BinaryIO) -> Iterator[tuple[int, int, int | bytes, int]]:
+    # Yields (number, wire type, value, offset of the value in the stream)
+    pos = 0
+    while (key := read_varint(stream)) is not None:
+        number, wire_type = key >> 3, key & 7
+        pos += varint_size(key)
+        match wire_type:
+            case 0:
+                value = read_varint(stream)
+                if value is None:
+                    raise EOFError(f'Truncated value for field {number}')
+                start, pos = pos, pos + varint_size(value)
+            case 1:
+                value = read_exact(stream, 8)
+                start, pos = pos, pos + 8
+            case 2:
+                size = read_varint(stream)
+                if size is None:
+                    raise EOFError(f'Truncated length for field {number}')
+                value = read_exact(stream, size)
+                start = pos + varint_size(size)
+                pos = start + size
+            case 5:
+                value = read_exact(stream, 4)
+                start, pos = pos, pos + 4
+            case _:
+                raise ValueError(f'Unsupported wire type {wire_type} for field {number}')
+        yield number, wire_type, value, start
+
+
+def decode_varint(buffer, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        try:
+            byte = buffer[pos]
+        except IndexError:
+            raise EOFError('Truncated varint in backup payload') from None
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_spans(buffer, start: int = 0, end: int | None = None) -> Iterator[tuple[int, int, int, int]]:
+    # In-memory counterpart of iter_fields: yields (number, wire type, start, end)
+    # of each field value without copying it out of the buffer
+    pos, end = start, len(buffer) if end is None else end
+    while pos < end:
+        key, pos = decode_varint(buffer, pos)
+        number, wire_type = key >> 3, key & 7
+        match wire_type:
+            case 0:
+                value_start = pos
+                _, pos = decode_varint(buffer, pos)
+            case 1:
+                value_start, pos = pos, pos + 8
+            case 2:
+                size, value_start = decode_varint(buffer, pos)
+                pos = value_start + size
+            case 5:
+                value_start, pos = pos, pos + 4
+            case _:
+                raise ValueError(f'Unsupported wire type {wire_type} for field {number}')
+        if pos > end:
+            raise EOFError(f'Truncated value for field {number}')
+        yield number, wire_type, value_start, pos
+
+
+def iter_message_spans(
+    stream: BinaryIO, message_type: type[Message]
+) -> Iterator[tuple[int, Message, int, int]]:
+    # Yields (number, message, start, end), start and end being the byte range
+    # of the serialized submessage in the decompressed payload
+    fields = message_type.DESCRIPTOR.fields_by_number
+    classes: dict[int, type[Message]] = {}
+    for number, wire_type, value, start in iter_fields(stream):
+        field = fields.get(number)
+        # Every known Backup field is a repeated submessage, anything else is skipped
+        if field is None or field.message_type is None or wire_type != WIRE_LEN:
+            continue
+        if number not in classes:
+            classes[number] = GetMessageClass(field.message_type)
+        message = classes[number]()
+        message.ParseFromString(value)
+        yield number, message, start, start + len(value)
+
+
+def iter_messages(stream: BinaryIO, message_type: type[Message]) -> Iterator[tuple[int, Message]]:
+    for number, message, _, _ in iter_message_spans(stream, message_type):
+        yield number, message
+
+
+def iter_records(message: Message) -> Iterator[tuple[int, Message]]:
+    for field, value in message.ListFields():
+        if field.message_type is not None and field.is_repeated:
+            for entry in value:
+                yield field.number, entry
+
+
+def write_json_records(
+    records: Iterator[tuple[int, Message]],
+    file: TextIO,
+    message_type: type[Message],
+    transform: Callable[[dict], None] | None = None,
+    emitter: JSONEmitter | None = None,
+) -> int:
+    # Mirrors dumps(MessageToDict(message), indent=2) byte for byte, but only
+    # keeps one BackupManga alive at a time. The remaining top-level fields are
+    # small and get buffered so they can be written in field number order.
+    emitter = emitter or DictJSONEmitter()
+    fields = message_type.DESCRIPTOR.fields_by_number
+    key_separator = emitter.key_separator
+    manga_key = dumps(fields[MANGA_FIELD].json_name) + key_separator
+    item, inner = emitter.newline(2), emitter.newline(1)
+    tail: dict[int, list[Message]] = {}
+    count = 0
+    file.write('{')
+    for number, message in records:
+        if number != MANGA_FIELD:
+            tail.setdefault(number, []).append(message)
+            continue
+        file.write(',' if count else f'{inner}{manga_key}[')
+        file.write(item + emitter.message(message, 2))
+        count += 1
+    if count:
+        file.write(inner + ']')
+
+    tail_dict = {
+        fields[number].json_name: [MessageToDict(message) for message in tail[number]]
+        for number in sorted(tail)
+    }
+    if transform:
+        transform(tail_dict)
+    for index, (key, value) in enumerate(tail_dict.items()):
+        file.write(',' if count or index else '')
+        file.write(f'{inner}{dumps(key)}{key_separator}{emitter.value(value, 1)}')
+    file.write(emitter.newline(0) + '}' if count or tail_dict else '}')
+    return count
+
+
+def write_json_stream(
+    stream: BinaryIO,
+    file: TextIO,
+    message_type: type[Message],
+    transform: Callable[[dict], None] | None = None,
+    emitter: JSONEmitter | None = None,
+) -> int:
+    return write_json_records(
+        iter_messages(stream, message_type), file, message_type, transform, emitter
+    )
+
+
+def write_backup_stream(
+    items: Iterator[tuple[str, object]],
+    file: BinaryIO,
+    message_type: type[Message],
+    transform: Callable[[dict], None] | None = None,
+) -> int:
+    # Produces the same bytes as build_message(Backup, message_dict).SerializeToString():
+    # protobuf serializes fields in number order, so every backupManga record
+    # (field 1) goes first and the buffered remainder is appended afterwards.
+    manga_field = message_type.DESCRIPTOR.fields_by_number[MANGA_FIELD]
+    manga_class = GetMessageClass(manga_field.message_type)
+    tag = encode_varint(MANGA_FIELD << 3 | WIRE_LEN)
+    tail: dict[str, object] = {}
+    count = 0
+    for key, value in items:
+        if key not in (manga_field.json_name, manga_field.name):
+            tail[key] = value
+            continue
+        try:
+            manga = build_message(manga_class, value, f'{message_type.DESCRIPTOR.name}.{key}[{count}]')
+        except ParseError as e:
+            raise ParseError(f'Failed to parse {key} field: {e}.') from e
+        data = manga.SerializeToString()
+        file.write(tag + encode_varint(len(data)) + data)
+        count += 1
+
+    if transform:
+        transform(tail)
+    file.write(build_message(message_type, tail).SerializeToString())
+    return count
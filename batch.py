@@ -0,0 +1,277 @@
+import contextlib
+import io
+import json
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from pathlib import Path
+
+import raw_cache
+from script_loader import load_script
+
+try:
+    import resource
+except ImportError:  # Windows, the memory budget isn't enforced there
+    resource = None
+
+# Converts every backup (or decoded JSON) matched by the inputs with
+# tachibk-converter.py, one file per worker process. Backups become JSON and
+# JSON files become .tachibk, next to each other in --output-dir.
+#
+# <output-dir>/manifest.json remembers the size, mtime and SHA-256 of every
+# input and the options it was converted with. A file is skipped when its
+# output is still the one written last time and the input either has the
+# same size and mtime or, if it was only touched, the same hash.
+
+BACKUP_SUFFIXES = ('.tachibk', '.proto.gz', '.proto')
+INPUT_SUFFIXES = BACKUP_SUFFIXES + ('.json',)
+MANIFEST_NAME = 'manifest.json'
+REPORT_NAME = 'report.json'
+
+argp = ArgumentParser(description='Convert a whole directory of backups in parallel, without prompts')
+argp.add_argument(
+    'inputs',
+    nargs='+',
+    metavar='<directory | glob | file>',
+    help='Directories are searched for backups and JSON files, quote globs to keep the shell from expanding them',
+)
+argp.add_argument(
+    '--output-dir',
+    '-o',
+    default='output/batch',
+    metavar='<directory>',
+    help='Where converted files, the manifest and the report go. Default: output/batch',
+    type=Path,
+)
+argp.add_argument(
+    '--workers',
+    '-j',
+    type=int,
+    default=os.cpu_count(),
+    metavar='<count>',
+    help='Files converted at the same time. Default: one per CPU',
+)
+argp.add_argument(
+    '--memory-limit',
+    type=int,
+    default=2048,
+    metavar='<MiB>',
+    help='Address space each worker may use, 0 for no limit. A file that needs more fails on its own. Default: 2048',
+)
+argp.add_argument(
+    '--fork',
+    default='mihon',
+    metavar='<fork>',
+    help='Fork for the backup schema, see tachibk-converter.py --help. Default: mihon',
+)
+argp.add_argument(
+    '--compression-level',
+    type=int,
+    choices=range(10),
+    default=9,
+    metavar='<0-9>',
+    help='Gzip level when encoding. Default: 9',
+)
+argp.add_argument(
+    '--fast-json',
+    action='store_true',
+    help='Write JSON straight from the protobuf messages, see tachibk-converter.py --help',
+)
+argp.add_argument('--force', action='store_true', help='Convert every file, even if its output is up to date')
+
+
+def find_inputs(patterns: list[str]) -> list[Path]:
+    found: dict[Path, None] = {}
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = sorted(p for p in path.iterdir() if p.name.endswith(INPUT_SUFFIXES))
+        else:
+            matches = [Path(p) for p in sorted(glob(pattern))]
+        for match in matches:
+            if match.is_file():
+                found.setdefault(match)
+    return list(found)
+
+
+def output_name(input: Path) -> str:
+    name = input.name
+    if name.endswith('.json'):
+        return name.removesuffix('.json') + '.tachibk'
+    for suffix in BACKUP_SUFFIXES:
+        if name.endswith(suffix):
+            return name.removesuffix(suffix) + '.json'
+    return name + '.json'
+
+
+def converter_args(input: Path, output: Path, args) -> list[str]:
+    argv = ['--input', str(input), '--output', str(output), '--fork', args.fork]
+    if input.name.endswith('.json'):
+        # The pool already keeps every core busy
+        argv += ['--compression-level', str(args.compression_level), '--threads', '1']
+    elif args.fast_json:
+        argv.append('--fast-json')
+    return argv
+
+
+def stat_entry(path: Path) -> dict:
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def up_to_date(entry: dict | None, input: Path, output: Path, argv: list[str]) -> tuple[bool, str | None]:
+    # (skip?, input hash if one had to be computed)
+    if entry is None or entry['argv'] != argv or not output.is_file():
+        return False, None
+    if stat_entry(output) != entry['output']:
+        return False, None
+    if stat_entry(input) == entry['input']:
+        return True, entry['sha256']
+    if input.stat().st_size != entry['input']['size']:
+        return False, None
+    digest = raw_cache.file_digest(input)
+    return digest == entry['sha256'], digest
+
+
+def limit_memory(limit_mib: int) -> None:
+    if resource is None or not limit_mib:
+        return
+    limit = limit_mib << 20
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+converter = None
+
+
+def convert(input: Path, output: Path, argv: list[str]) -> dict:
+    # Runs in a worker process, the converter is loaded once per worker
+    global converter
+    if converter is None:
+        converter = load_script('tachibk-converter.py', 'tachibk_converter')
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(log):
+            converter.main(argv)
+    except SystemExit as e:
+        if e.code:
+            error = log.getvalue().strip().splitlines()[-1] if log.getvalue().strip() else f'exit code {e.code}'
+    except MemoryError:
+        error = 'ran out of its memory budget (see --memory-limit)'
+    except Exception as e:
+        error = f'{e.__class__.__name__}: {e}'
+    elapsed = time.perf_counter() - start
+    if error:
+        output.unlink(missing_ok=True)
+    return {
+        'input': str(input),
+        'output': str(output),
+        'status': 'failed' if error else 'converted',
+        'seconds': round(elapsed, 3),
+        'input_bytes': input.stat().st_size,
+        'output_bytes': output.stat().st_size if not error else 0,
+        'error': error,
+    }
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json_file(path: Path, data) -> None:
+    partial = path.with_name(path.name + '.part')
+    partial.write_text(json.dumps(data, indent=2))
+    os.replace(partial, path)
+
+
+def print_summary(results: list[dict], elapsed: float) -> None:
+    print(f'\n{"file":<48} {"status":<10} {"seconds":>8} {"in MiB":>8} {"out MiB":>8}')
+    for result in results:
+        name = Path(result['input']).name
+        print(
+            f'{name[:48]:<48} {result["status"]:<10} {result["seconds"]:>8.2f}'
+            f' {result["input_bytes"] / (1 << 20):>8.1f} {result["output_bytes"] / (1 << 20):>8.1f}'
+        )
+        if result['error']:
+            print(f'    ❌ {result["error"]}')
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('converted', 'skipped', 'failed')}
+    print(
+        f'\n✅ {counts["converted"]} converted, ⏭️  {counts["skipped"]} up to date, ❌ {counts["failed"]} failed'
+        f' in {elapsed:.2f}s'
+    )
+
+
+def run(args) -> list[dict]:
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        print('❌ No backups or JSON files found.')
+        exit(1)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = args.output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+
+    start = time.perf_counter()
+    results: list[dict] = []
+    jobs: dict = {}
+    digests: dict[str, str | None] = {}
+    with ProcessPoolExecutor(args.workers, initializer=limit_memory, initargs=(args.memory_limit,)) as pool:
+        for input in inputs:
+            output = args.output_dir / output_name(input)
+            argv = converter_args(input, output, args)
+            key = str(input.resolve())
+            skip, digests[key] = (False, None) if args.force else up_to_date(manifest.get(key), input, output, argv)
+            if skip:
+                results.append({
+                    'input': str(input),
+                    'output': str(output),
+                    'status': 'skipped',
+                    'seconds': 0.0,
+                    'input_bytes': input.stat().st_size,
+                    'output_bytes': output.stat().st_size,
+                    'error': None,
+                })
+                # Picks up the new mtime of a touched file, so it isn't hashed again
+                manifest[key].update(input=stat_entry(input))
+                continue
+            jobs[pool.submit(convert, input, output, argv)] = (key, input, output, argv)
+
+        for future in as_completed(jobs):
+            key, input, output, argv = jobs[future]
+            result = future.result()
+            results.append(result)
+            print(f'{"✅" if result["status"] == "converted" else "❌"} {input} ({result["seconds"]:.2f}s)')
+            if result['status'] == 'converted':
+                manifest[key] = {
+                    'input': stat_entry(input),
+                    'sha256': digests[key] or raw_cache.file_digest(input),
+                    'output': stat_entry(output),
+                    'argv': argv,
+                }
+            else:
+                manifest.pop(key, None)
+
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda result: result['input'])
+    write_json_file(manifest_path, manifest)
+    write_json_file(
+        args.output_dir / REPORT_NAME,
+        {'seconds': round(elapsed, 3), 'workers': args.workers, 'files': results},
+    )
+    print_summary(results, elapsed)
+    print(f'Report written to "{args.output_dir / REPORT_NAME}"')
+    return results
+
+
+if __name__ == '__main__':
+    results = run(argp.parse_args())
+    exit(1 if any(result['status'] == 'failed' for result in results) else 0)
@@ -0,0 +1,104 @@
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+# Startup cost of every entry point, as reported by python -X importtime.
+# Each script is loaded the way importlib loads a module (so its __main__
+# block doesn't run) in a fresh interpreter, and only the imports it adds on
+# top of a bare interpreter are counted. `--help` is timed as well for the
+# scripts with an argument parser, that is the whole run for a trivial call.
+
+ROOT = Path(__file__).resolve().parent.parent
+ENTRY_POINTS = (
+    'tachibk-converter.py',
+    'pipeline.py',
+    'json_to_tachibk.py',
+    'extract_titles_and_folders.py',
+    'count_cleaned_output.json_.py',
+    'category_filter.py',
+)
+HELP_ENTRY_POINTS = ('tachibk-converter.py', 'pipeline.py')
+LOADER = '''
+import importlib.util, sys
+if sys.argv[1:]:
+    spec = importlib.util.spec_from_file_location('entry_point', sys.argv[1])
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+'''
+LINE_RE = re.compile(r'^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|(?P<indent> *)(?P<name>\S+)$')
+
+argp = ArgumentParser(description='Measure the import time of each entry point')
+argp.add_argument('--repeat', type=int, default=5, metavar='<count>', help='Runs per entry point, the median is kept. Default: 5')
+argp.add_argument('--top', type=int, default=5, metavar='<count>', help='Slowest top-level imports to list per entry point. Default: 5')
+argp.add_argument('--json', type=Path, metavar='<results.json>', help='Also write the results as JSON')
+argp.add_argument('entry_points', nargs='*', default=ENTRY_POINTS, metavar='<script.py>')
+
+
+def top_level_imports(stderr: str) -> dict[str, int]:
+    # Cumulative microseconds of the modules imported directly by the code
+    # being measured, nested imports are included in their parent
+    imports = {}
+    for line in stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match and len(match['indent']) == 1:
+            imports[match['name']] = int(match['cumulative'])
+    return imports
+
+
+def measure_imports(script: str | None = None) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', LOADER, *([script] if script else [])],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        stdin=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'{script} failed to import:\n{result.stderr.strip().splitlines()[-1]}')
+    return top_level_imports(result.stderr)
+
+
+def measure_help(script: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, '--help'], cwd=ROOT, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def benchmark(script: str, baseline: set[str], repeat: int) -> dict:
+    runs = [measure_imports(script) for _ in range(repeat)]
+    modules = {
+        name: int(statistics.median(run.get(name, 0) for run in runs))
+        for name in runs[0]
+        if name not in baseline
+    }
+    result = {
+        'entry_point': script,
+        'import_us': sum(modules.values()),
+        'modules': dict(sorted(modules.items(), key=lambda item: item[1], reverse=True)),
+    }
+    if script in HELP_ENTRY_POINTS:
+        result['help_s'] = statistics.median(measure_help(script) for _ in range(repeat))
+    return result
+
+
+if __name__ == '__main__':
+    args = argp.parse_args()
+    # Whatever the interpreter and the loader import by themselves
+    baseline = set(measure_imports())
+    results = []
+    for script in args.entry_points:
+        result = benchmark(script, baseline, args.repeat)
+        results.append(result)
+        help_time = f'  --help {result["help_s"] * 1000:6.1f} ms' if 'help_s' in result else ''
+        print(f'{script:<32} imports {result["import_us"] / 1000:7.1f} ms{help_time}')
+        for name, elapsed in list(result['modules'].items())[: args.top]:
+            print(f'    {name:<36} {elapsed / 1000:7.1f} ms')
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2))
+        print(f'Results written to "{args.json}"')
@@ -0,0 +1,235 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS isn't reported there
+    resource = None
+
+# Times the main steps of the toolchain on synthetic backups (see
+# synthetic.py) of a few sizes:
+#
+#   decode   read_backup -> parse_backup -> write_json of tachibk-converter.py
+#   encode   parse_json -> write_backup
+#   extract  the reports of extract_titles_and_folders.py, from the JSON
+#   stats    the library and chapter stats of count_cleaned_output.json_.py
+#   filter   a category + read ratio query of backup_filter.py, backup to backup
+#
+# Every stage runs in a fresh process, --repeat times for the wall and CPU
+# time (the median is kept) and once more under tracemalloc for the peak of
+# Python allocations. The peak RSS of that process is reported as well.
+# --json keeps the numbers and --compare checks them against an older run.
+
+STAGES = ('decode', 'encode', 'extract', 'stats', 'filter')
+DATA_DIR = Path('benchmarks/data')
+
+argp = ArgumentParser(description='Time and memory-profile the toolchain on synthetic backups')
+argp.add_argument('--scales', default='1k,10k', metavar='<counts>', help='Comma separated manga counts, e.g. 1k,10k,100k. Default: 1k,10k')
+argp.add_argument('--chapters', type=int, default=50, metavar='<count>', help='Average chapters per manga. Default: 50')
+argp.add_argument('--stages', default=','.join(STAGES), metavar='<names>', help=f'Comma separated, out of {", ".join(STAGES)}. Default: all')
+argp.add_argument('--repeat', type=int, default=3, metavar='<count>', help='Timed runs per stage, the median is kept. Default: 3')
+argp.add_argument('--seed', type=int, default=0, metavar='<seed>', help='Seed of the synthetic backups. Default: 0')
+argp.add_argument('--fork', default='mihon', metavar='<fork>', help='Fork for the backup schema. Default: mihon')
+argp.add_argument(
+    '--json',
+    type=Path,
+    default=DATA_DIR / 'results.json',
+    metavar='<results.json>',
+    help=f'Where the results are written. Default: {DATA_DIR / "results.json"}',
+)
+argp.add_argument('--compare', type=Path, metavar='<old_results.json>', help='Report stages that got slower than in an older run')
+argp.add_argument(
+    '--threshold', type=float, default=10, metavar='<percent>', help='Slowdown that counts as a regression. Default: 10'
+)
+
+
+def stage_function(stage: str, files: dict[str, str], fork: str):
+    # The work of one stage, set up so that calling it repeats only that work
+    from schema_registry import backup_class
+    from script_loader import load_script
+
+    if stage in ('decode', 'encode'):
+        converter = load_script('tachibk-converter.py', 'tachibk_converter')
+        converter.argp = converter.build_parser()
+        converter.Backup = backup_class(fork)
+        if stage == 'decode':
+            converter.args = converter.argp.parse_args(['--input', files['backup'], '--output', files['json']])
+            return lambda: converter.write_json(converter.parse_backup(converter.read_backup(files['backup'])))
+        converter.args = converter.argp.parse_args(['--input', files['json'], '--output', files['encoded']])
+        return lambda: converter.write_backup(converter.parse_json(files['json']))
+
+    from library import Library, load_emoji_map
+
+    emoji_map = load_emoji_map(warn=False)
+    if stage == 'extract':
+        reports = load_script('extract_titles_and_folders.py', 'extract_titles_and_folders')
+        workdir = tempfile.mkdtemp(prefix='tachibk-bench-')
+
+        def extract():
+            # The reports go to manga/ under the working directory
+            with contextlib.chdir(workdir):
+                reports.write_reports(Library.load(files['json']), emoji_map)
+
+        return extract
+    if stage == 'stats':
+        counter = load_script('count_cleaned_output.json_.py', 'count_cleaned_output')
+        return lambda: counter.print_stats(Library.load(files['json'], with_chapters=True), emoji_map)
+
+    from backup_filter import Query, filter_file
+
+    message_type = backup_class(fork)
+    return lambda: filter_file(
+        files['backup'], message_type, Query(categories=['Reading', 'Favorites'], min_read_ratio=0.5), Path(files['filtered'])
+    )
+
+
+def run_stage(stage: str, files: dict[str, str], fork: str, repeat: int) -> dict:
+    # Runs in its own process
+    os.chdir(ROOT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        work = stage_function(stage, files, fork)
+        walls, cpus = [], []
+        for _ in range(repeat):
+            wall, cpu = time.perf_counter(), time.process_time()
+            work()
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+        tracemalloc.start()
+        work()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    result = {
+        'wall_s': round(statistics.median(walls), 4),
+        'cpu_s': round(statistics.median(cpus), 4),
+        'runs_s': [round(wall, 4) for wall in walls],
+        'peak_traced_bytes': peak,
+    }
+    if resource is not None:
+        # KiB on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return result
+
+
+def in_process(stage: str, files: dict[str, str], fork: str, repeat: int) -> dict:
+    # spawn, so no stage inherits the memory of the previous ones
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(run_stage, stage, files, fork, repeat).result()
+
+
+def prepare(scale: str, args) -> dict[str, str]:
+    from schema_registry import backup_class
+    from synthetic import parse_scale, write_backup
+
+    # Absolute, the extract stage runs in another directory
+    name = DATA_DIR.resolve() / f'synthetic-{scale}x{args.chapters}-s{args.seed}'
+    files = {
+        'backup': f'{name}.tachibk',
+        'json': f'{name}.json',
+        'encoded': f'{name}-encoded.tachibk',
+        'filtered': f'{name}-filtered.tachibk',
+    }
+    # Generating a big library takes a while, it is kept for the next run
+    if not Path(files['backup']).is_file():
+        print(f'Generating {files["backup"]}...')
+        write_backup(Path(files['backup']), backup_class(args.fork), parse_scale(scale), args.chapters, args.seed)
+    if not Path(files['json']).is_file():
+        in_process('decode', files, args.fork, 1)
+    return files
+
+
+def payload_size(path: str) -> int:
+    import parallel_gzip
+
+    size = 0
+    with parallel_gzip.open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            size += len(chunk)
+    return size
+
+
+def compare(results: list[dict], old_path: Path, threshold: float) -> list[str]:
+    old = {
+        (entry['scale'], entry['chapters'], stage): timing['wall_s']
+        for entry in json.loads(old_path.read_text())['results']
+        for stage, timing in entry['stages'].items()
+    }
+    regressions = []
+    print(f'\nCompared with "{old_path}":')
+    for entry in results:
+        for stage, timing in entry['stages'].items():
+            before = old.get((entry['scale'], entry['chapters'], stage))
+            if not before:
+                continue
+            change = (timing['wall_s'] / before - 1) * 100
+            slower = change > threshold
+            print(f'{"❌" if slower else "✅"} {entry["scale"]:>6} {stage:<8} {before:8.3f}s → {timing["wall_s"]:8.3f}s ({change:+.1f}%)')
+            if slower:
+                regressions.append(f'{entry["scale"]} {stage}')
+    return regressions
+
+
+if __name__ == '__main__':
+    args = argp.parse_args()
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    if unknown := set(stages) - set(STAGES):
+        argp.error(f'unknown stages: {", ".join(sorted(unknown))}')
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for scale in args.scales.split(','):
+        scale = scale.strip()
+        files = prepare(scale, args)
+        entry = {
+            'scale': scale,
+            'chapters': args.chapters,
+            'backup_bytes': Path(files['backup']).stat().st_size,
+            'payload_bytes': payload_size(files['backup']),
+            'json_bytes': Path(files['json']).stat().st_size,
+            'stages': {},
+        }
+        print(f'\n{scale} manga × ~{args.chapters} chapters ({entry["payload_bytes"] / (1 << 20):.1f} MiB payload)')
+        print(f'{"stage":<8} {"wall s":>9} {"cpu s":>9} {"traced MiB":>11} {"RSS MiB":>9}')
+        for stage in stages:
+            timing = in_process(stage, files, args.fork, args.repeat)
+            entry['stages'][stage] = timing
+            print(
+                f'{stage:<8} {timing["wall_s"]:>9.3f} {timing["cpu_s"]:>9.3f}'
+                f' {timing["peak_traced_bytes"] / (1 << 20):>11.1f} {timing.get("max_rss_bytes", 0) / (1 << 20):>9.1f}'
+            )
+        results.append(entry)
+
+    from google.protobuf import __version__ as protobuf_version
+
+    args.json.parent.mkdir(parents=True, exist_ok=True)
+    args.json.write_text(json.dumps({
+        'python': sys.version.split()[0],
+        'protobuf': protobuf_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'results': results,
+    }, indent=2))
+    print(f'\nResults written to "{args.json}"')
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f'❌ Slower by more than {args.threshold:g}%: {", ".join(regressions)}')
+            exit(1)
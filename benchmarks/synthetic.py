@@ -0,0 +1,248 @@
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Iterator
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from google.protobuf.message import Message  # noqa: E402
+from google.protobuf.message_factory import GetMessageClass  # noqa: E402
+
+import parallel_gzip  # noqa: E402
+from backup_stream import WIRE_LEN, encode_varint  # noqa: E402
+from preference_codec import PreferenceCodec  # noqa: E402
+
+# Writes a valid backup of any size, made up from a seed, so the scripts can
+# be timed on libraries bigger than the ones in backup/. The proportions
+# follow real libraries: most manga come from a handful of sources, about a
+# third is fully read and another third partly, read chapters have history,
+# some manga are tracked, and every preference type shows up.
+#
+# Records are generated and written one at a time, a 100k manga backup
+# doesn't have to fit in memory.
+
+CATEGORIES = (
+    'Reading', 'Plan to Read', 'Completed', 'On Hold', 'Dropped', 'Favorites',
+    'Manhwa', 'Manhua', 'Webtoons', 'One Shots', 'Re-read', 'Ongoing',
+)
+SOURCES = (
+    'MangaDex (EN)', 'Comick (EN)', 'MangaSee', 'Asura Scans', 'Flame Comics', 'Bato.to (ALL)',
+    'MangaPark', 'Webtoons.com (EN)', 'Reaper Scans', 'MangaKakalot', 'Manganato', 'Local source',
+    'Mangago', 'Toonily', 'Manhwa18', 'MangaFire (EN)', 'Weeb Central', 'Hiperdex', 'Kagane', 'Cubari',
+)
+WORDS = (
+    'shadow', 'blade', 'academy', 'return', 'hunter', 'dragon', 'villainess', 'tower', 'sword', 'king',
+    'reincarnated', 'level', 'demon', 'saint', 'regressor', 'moon', 'devouring', 'star', 'solo', 'mage',
+)
+GENRES = (
+    'Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Slice of Life', 'Isekai',
+    'Martial Arts', 'Mystery', 'Psychological', 'School Life', 'Sci-Fi', 'Supernatural', 'Tragedy',
+)
+SCANLATORS = ('Official', 'Asura', 'Flame', 'Reset Scans', 'Night Scans', None)
+TRACKERS = (1, 2, 3, 7)  # MyAnimeList, AniList, Kitsu, MangaUpdates
+DAY_MS = 86_400_000
+NOW_MS = 1_750_000_000_000  # Fixed, so a seed always gives the same bytes
+
+
+def parse_scale(text: str) -> int:
+    # '1k' -> 1000, '100k' -> 100000
+    text = text.strip().lower()
+    if text.endswith('k'):
+        return int(float(text[:-1]) * 1000)
+    if text.endswith('m'):
+        return int(float(text[:-1]) * 1_000_000)
+    return int(text)
+
+
+class BackupGenerator:
+    def __init__(self, message_type: type[Message], manga: int, chapters: int = 50, seed: int = 0):
+        self.message_type = message_type
+        self.manga = manga
+        self.chapters = chapters
+        self.random = random.Random(seed)
+        fields = message_type.DESCRIPTOR.fields_by_name
+        self.classes = {name: GetMessageClass(field.message_type) for name, field in fields.items() if field.message_type}
+        manga_fields = fields['backupManga'].message_type.fields_by_name
+        self.chapter_class = GetMessageClass(manga_fields['chapters'].message_type)
+        self.history_class = GetMessageClass(manga_fields['history'].message_type)
+        self.tracking_class = GetMessageClass(manga_fields['tracking'].message_type)
+        self.codec = PreferenceCodec(message_type)
+        self.source_ids = [self.random.getrandbits(63) for _ in SOURCES]
+        # A few sources hold most of a library
+        self.source_weights = [1 / (rank + 1) for rank in range(len(SOURCES))]
+
+    def title(self) -> str:
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(2, 6))).title()
+
+    def manga_record(self, index: int) -> Message:
+        rng = self.random
+        source = rng.choices(self.source_ids, self.source_weights)[0]
+        date_added = NOW_MS - rng.randrange(5 * 365) * DAY_MS
+        count = max(0, int(rng.gauss(self.chapters, self.chapters / 3)))
+        # Fully read, partly read or not started
+        state = rng.random()
+        read = count if state < 0.35 else rng.randrange(count + 1) if state < 0.65 else 0
+        scanlator = rng.choice(SCANLATORS)
+        chapters = []
+        history = []
+        for number in range(count):
+            url = f'/chapter/{index}-{number}'
+            uploaded = date_added - (count - number) * 7 * DAY_MS
+            is_read = number < read
+            chapters.append(self.chapter_class(
+                url=url,
+                name=f'Chapter {number + 1}',
+                scanlator=scanlator,
+                read=is_read,
+                bookmark=rng.random() < 0.02,
+                lastPageRead=0 if is_read else rng.choice((0, 0, 0, rng.randrange(40))),
+                dateFetch=date_added + rng.randrange(DAY_MS),
+                dateUpload=uploaded,
+                chapterNumber=number + 1,
+                sourceOrder=count - number - 1,
+                lastModifiedAt=(date_added + number * DAY_MS) // 1000,
+                version=rng.randrange(1, 4),
+            ))
+            if is_read:
+                history.append(self.history_class(
+                    url=url, lastRead=uploaded + rng.randrange(30) * DAY_MS, readDuration=rng.randrange(60_000, 900_000)
+                ))
+        tracking = [
+            self.tracking_class(
+                syncId=sync_id,
+                libraryId=rng.getrandbits(31),
+                mediaId=rng.getrandbits(20),
+                trackingUrl=f'https://tracker.example/{sync_id}/manga/{index}',
+                title=f'Tracked {index}',
+                lastChapterRead=read,
+                totalChapters=count,
+                score=rng.randrange(11),
+                status=rng.randrange(1, 7),
+            )
+            for sync_id in rng.sample(TRACKERS, rng.choice((0, 0, 0, 1, 2)))
+        ]
+        manga_class = self.classes['backupManga']
+        return manga_class(
+            source=source,
+            url=f'/manga/{index}',
+            title=self.title(),
+            artist=self.title(),
+            author=self.title(),
+            description=' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))).capitalize() + '.',
+            genre=rng.sample(GENRES, rng.randint(2, 5)),
+            status=rng.randrange(7),
+            thumbnailUrl=f'https://cdn.example/covers/{index}.jpg',
+            dateAdded=date_added,
+            chapters=chapters,
+            categories=rng.sample(range(len(CATEGORIES)), rng.choice((0, 1, 1, 1, 2))),
+            tracking=tracking,
+            favorite=True,
+            history=history,
+            lastModifiedAt=date_added // 1000,
+            favoriteModifiedAt=date_added // 1000,
+            version=rng.randrange(1, 10),
+        )
+
+    def preference(self, key: str, type_name: str, value) -> Message:
+        value = {'type': type_name, 'truevalue': self.codec.encode(type_name, value)}
+        return self.classes['backupPreferences'](key=key, value=value)
+
+    def preferences(self, prefix: str, count: int) -> list[Message]:
+        rng = self.random
+        values = {
+            'Int': lambda: rng.randrange(-100, 1000),
+            'Long': lambda: str(NOW_MS - rng.randrange(10**9)),
+            'Float': lambda: rng.random(),
+            'String': lambda: rng.choice(WORDS),
+            'Boolean': lambda: rng.random() < 0.5,
+            'StringSet': lambda: rng.sample(WORDS, rng.randint(0, 4)),
+        }
+        types = list(values)
+        prefs = []
+        for index in range(count):
+            name = types[index % len(types)]
+            prefs.append(self.preference(f'{prefix}_{index}', f'{name}PreferenceValue', values[name]()))
+        return prefs
+
+    def records(self) -> Iterator[tuple[int, Message]]:
+        # (field number, record) in the order protobuf writes them
+        fields = self.message_type.DESCRIPTOR.fields_by_name
+        for index in range(self.manga):
+            yield fields['backupManga'].number, self.manga_record(index)
+        for order, name in enumerate(CATEGORIES):
+            yield fields['backupCategories'].number, self.classes['backupCategories'](name=name, order=order, id=order + 1)
+        for source_id, name in zip(self.source_ids, SOURCES):
+            yield fields['backupSources'].number, self.classes['backupSources'](name=name, sourceId=source_id)
+        if 'backupPreferences' in fields:
+            for pref in self.preferences('pref', 60):
+                yield fields['backupPreferences'].number, pref
+        if 'backupSourcePreferences' in fields:
+            source_prefs = self.classes['backupSourcePreferences']
+            for source_id in self.source_ids[:8]:
+                yield fields['backupSourcePreferences'].number, source_prefs(
+                    sourceKey=f'source_{source_id}', prefs=self.preferences(f'source_{source_id}', 6)
+                )
+        if 'backupExtensionRepo' in fields:
+            for name in ('keiyoushi', 'example'):
+                yield fields['backupExtensionRepo'].number, self.classes['backupExtensionRepo'](
+                    baseUrl=f'https://raw.githubusercontent.com/{name}/extensions/repo',
+                    name=name,
+                    website=f'https://{name}.example',
+                    signingKeyFingerprint=f'{self.random.getrandbits(256):064x}',
+                )
+
+    def write(self, file) -> int:
+        # Payload size
+        size = 0
+        for number, record in self.records():
+            data = record.SerializeToString()
+            field = encode_varint(number << 3 | WIRE_LEN) + encode_varint(len(data)) + data
+            file.write(field)
+            size += len(field)
+        return size
+
+
+def write_backup(path: Path, message_type: type[Message], manga: int, chapters: int, seed: int = 0, level: int = 6) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    generator = BackupGenerator(message_type, manga, chapters, seed)
+    compressed = path.name.endswith(('.tachibk', '.proto.gz'))
+    with parallel_gzip.open(path, 'wb', level) if compressed else open(path, 'wb', buffering=1 << 20) as file:
+        return generator.write(file)
+
+
+if __name__ == '__main__':
+    from schema_registry import SchemaNotCached, backup_class
+
+    argp = ArgumentParser(description='Write a made-up backup of any size')
+    argp.add_argument('--manga', default='1k', metavar='<count>', help='Manga in the library, 10k and 1m work too. Default: 1k')
+    argp.add_argument('--chapters', type=int, default=50, metavar='<count>', help='Average chapters per manga. Default: 50')
+    argp.add_argument('--seed', type=int, default=0, metavar='<seed>', help='Same seed, same backup. Default: 0')
+    argp.add_argument('--fork', default='mihon', metavar='<fork>', help='Fork for the backup schema. Default: mihon')
+    argp.add_argument(
+        '--compression-level', type=int, default=6, choices=range(10), metavar='<0-9>', help='Gzip level. Default: 6'
+    )
+    argp.add_argument(
+        '--output',
+        '-o',
+        type=Path,
+        metavar='<synthetic.tachibk | synthetic.proto>',
+        help='Default: benchmarks/data/synthetic-<manga>x<chapters>.tachibk',
+    )
+    args = argp.parse_args()
+
+    manga = parse_scale(args.manga)
+    output = args.output or Path(f'benchmarks/data/synthetic-{args.manga}x{args.chapters}.tachibk')
+    try:
+        Backup = backup_class(args.fork)
+    except SchemaNotCached as e:
+        print(f'ERROR! {e}')
+        exit(1)
+    start = time.perf_counter()
+    size = write_backup(output, Backup, manga, args.chapters, args.seed, args.compression_level)
+    print(
+        f'{manga} manga written to "{output}" ({size / (1 << 20):.1f} MiB payload,'
+        f' {output.stat().st_size / (1 << 20):.1f} MiB on disk) in {time.perf_counter() - start:.1f}s'
+    )
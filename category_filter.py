@@ -1,23 +1,14 @@
-import json
 import os
-from collections import defaultdict
+from argparse import ArgumentParser
+from pathlib import Path
+
+from library import Library, load_emoji_map
+from sqlite_export import is_sqlite_file
 
 ROTATION_LIMIT = 5
 ROTATION_FILE = "output/rotation_counter.txt"
 OUTPUT_BASENAME = "output_cleaned_{}.json"
 
-def load_emoji_map(path="manga/emoji.txt"):
-    emoji_map = {}
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                if ":" in line:
-                    key, emoji = line.strip().split(":", 1)
-                    emoji_map[key.strip()] = emoji.strip()
-    else:
-        print("⚠️ emoji.txt not found. Emojis will be skipped.")
-    return emoji_map
-
 def get_next_output_filename():
     os.makedirs("output", exist_ok=True)
     # Read rotation count
@@ -40,136 +31,208 @@ def get_next_output_filename():
 
     return output_filename
 
-# Load data
-with open("output/output.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-emoji_map = load_emoji_map()
-
-# Build category and source mappings
-category_map = {}
-for i, cat in enumerate(data.get("backupCategories", [])):
-    key = str(cat.get("order", i))
-    category_map[key] = cat.get("name", "Uncategorized")
-
-source_map = {}
-for src in data.get("backupSources", []):
-    source_map[str(src.get("sourceId"))] = src.get("name", "Unknown")
-
-# Extract manga data
-manga_list = []
-for manga in data.get("backupManga", []):
-    title = manga.get("title", "Unknown Title")
-    category_ids = manga.get("categories", [])
-    categories = [category_map.get(str(cid), "Uncategorized") for cid in category_ids] if category_ids else ["Uncategorized"]
-    source_id = str(manga.get("source", ""))
-    extension = source_map.get(source_id, f"Unknown ({source_id})")
-
-    chapters = manga.get("chapters", [])
-    total_chapters = len(chapters)
-    read_chapters = sum(1 for c in chapters if c.get("read", False))
-
-    manga_list.append({
-        "raw_data": manga,
-        "title": title,
-        "categories": categories,
-        "extension": extension,
-        "read_chapters": read_chapters,
-        "total_chapters": total_chapters
-    })
-
-# Build category list with counts
-category_counts = defaultdict(int)
-for manga in manga_list:
-    for cat in manga["categories"]:
-        category_counts[cat] += 1
-
-# Include "Uncategorized" explicitly if any manga lacks categories
-if any(not m["raw_data"].get("categories") for m in manga_list):
-    category_counts["Uncategorized"] += sum(1 for m in manga_list if not m["raw_data"].get("categories"))
-
-# Sort categories alphabetically
-sorted_categories = sorted(category_counts.items(), key=lambda x: x[0].lower())
-
-# Display categories with emojis and counts
-print("\n\033[1mAvailable Categories:\033[0m")
-for i, (category, count) in enumerate(sorted_categories, 1):
-    emoji = emoji_map.get(category, "•")
-    print(f"\033[94m{i:>2}.\033[0m {emoji} {category}: \033[93m{count}\033[0m manga")
-
-# User choice
-print("\n\033[1mOptions:\033[0m")
-print("\033[92m1. Remove selected categories\033[0m")
-print("\033[91m2. Keep only selected categories\033[0m")
-
-choice = input("\nEnter your choice (1/2): ")
-while choice not in ["1", "2"]:
-    print("Invalid choice!")
-    choice = input("Enter your choice (1/2): ")
-
-# Category selection
-selected = input("\nEnter category numbers to select (space-separated): ").split()
-selected_indices = [int(i) for i in selected if i.isdigit()]
-valid_indices = [i for i in selected_indices if 1 <= i <= len(sorted_categories)]
-if not valid_indices:
-    print("No valid categories selected. Exiting.")
-    exit()
-
-selected_categories = [sorted_categories[i - 1][0] for i in valid_indices]
-
-# Create new JSON
-output_data = data.copy()
-output_data["backupManga"] = []
-
-if choice == "1":
-    print("\n\033[92mRemoving selected categories...\033[0m")
-    for manga in manga_list:
-        raw = manga["raw_data"]
-        existing_cat_ids = raw.get("categories", [])
-        if not existing_cat_ids:
-            if "Uncategorized" in selected_categories:
-                continue
-        else:
-            new_cat_ids = [
-                cid for cid in existing_cat_ids
-                if category_map.get(str(cid), "Uncategorized") not in selected_categories
-            ]
-            if not new_cat_ids and "Uncategorized" in selected_categories:
-                continue
-            raw["categories"] = new_cat_ids
-        output_data["backupManga"].append(raw)
-else:
-    print("\n\033[91mKeeping only selected categories...\033[0m")
-    for manga in manga_list:
-        raw = manga["raw_data"]
+def count_categories(library):
+    # Build category list with counts
+    category_counts = library.category_counts.copy()
+
+    # Include "Uncategorized" explicitly if any manga lacks categories
+    if library.uncategorized:
+        category_counts["Uncategorized"] += library.uncategorized
+
+    # Sort categories alphabetically
+    return sorted(category_counts.items(), key=lambda x: x[0].lower())
+
+def choose_categories(sorted_categories, emoji_map):
+    # Display categories with emojis and counts
+    print("\n\033[1mAvailable Categories:\033[0m")
+    for i, (category, count) in enumerate(sorted_categories, 1):
+        emoji = emoji_map.get(category, "•")
+        print(f"\033[94m{i:>2}.\033[0m {emoji} {category}: \033[93m{count}\033[0m manga")
+
+    # User choice
+    print("\n\033[1mOptions:\033[0m")
+    print("\033[92m1. Remove selected categories\033[0m")
+    print("\033[91m2. Keep only selected categories\033[0m")
+
+    choice = input("\nEnter your choice (1/2): ")
+    while choice not in ["1", "2"]:
+        print("Invalid choice!")
+        choice = input("Enter your choice (1/2): ")
+
+    # Category selection
+    selected = input("\nEnter category numbers to select (space-separated): ").split()
+    selected_indices = [int(i) for i in selected if i.isdigit()]
+    valid_indices = [i for i in selected_indices if 1 <= i <= len(sorted_categories)]
+    if not valid_indices:
+        print("No valid categories selected. Exiting.")
+        exit()
+
+    return choice, [sorted_categories[i - 1][0] for i in valid_indices]
+
+def filter_category_ids(category_ids, category_map, selected_categories, choice):
+    # New category ids for a manga, or None when the manga is dropped
+    keep = choice == "2"
+    if not category_ids:
+        return [] if ("Uncategorized" in selected_categories) == keep else None
+    new_cat_ids = [
+        cid for cid in category_ids
+        if (category_map.get(str(cid), "Uncategorized") in selected_categories) == keep
+    ]
+    if not new_cat_ids and ("Uncategorized" in selected_categories) != keep:
+        return None
+    return new_cat_ids
+
+def build_parser():
+    argp = ArgumentParser(
+        description="Filter a decoded backup. Without query options the categories are picked interactively."
+    )
+    argp.add_argument("--input", "-i", default="output/output.json", metavar="<output.json | backup.tachibk | output.tbkrec>",
+                      help="Decoded JSON, backup or record file to filter. Default: output/output.json")
+    argp.add_argument("--output", "-o", type=Path, metavar="<filtered.json | filtered.tachibk | filtered.tbkrec>",
+                      help="JSON, TACHIBK, PROTO.GZ, PROTO or TBKREC by extension. Default: output/output_cleaned_<n>.json")
+    argp.add_argument("--category", "-c", action="extend", nargs="+", metavar="<name>",
+                      help="Keep manga in any of these categories (\"Uncategorized\" for manga without one)")
+    argp.add_argument("--exclude-category", "-x", action="extend", nargs="+", metavar="<name>",
+                      help="Drop manga in any of these categories")
+    argp.add_argument("--source", "-s", action="extend", nargs="+", metavar="<name | id>",
+                      help="Keep manga from these sources")
+    argp.add_argument("--min-read-ratio", type=float, metavar="<0-1>", help="Keep manga with at least this share of chapters read")
+    argp.add_argument("--max-read-ratio", type=float, metavar="<0-1>", help="Keep manga with at most this share of chapters read")
+    argp.add_argument("--added-after", metavar="<YYYY-MM-DD>", help="Keep manga added on or after this day")
+    argp.add_argument("--added-before", metavar="<YYYY-MM-DD>", help="Keep manga added before this day")
+    argp.add_argument("--fork", default="mihon", metavar="<fork>", help="Fork for the backup schema. Default: mihon")
+    argp.add_argument("--compression-level", type=int, default=9, choices=range(10), metavar="<0-9>",
+                      help="Gzip level for TACHIBK and PROTO.GZ output. Default: 9")
+    return argp
+
+def backup_schema(args, writes_backup):
+    # (fork, Backup class), the class only when the input or the output is a backup.
+    # Protobuf is only needed then
+    from backup_filter import is_backup
+    from record_file import is_record_file, read_fork
+    fork = args.fork
+    try:
+        if is_record_file(args.input):
+            # Record files name the schema they were written with
+            fork = read_fork(args.input)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read {args.input}: {e}")
+        exit(1)
+    if not is_backup(args.input) and not writes_backup:
+        return fork, None
+    from schema_registry import SchemaNotCached, backup_class
+    try:
+        return fork, backup_class(fork)
+    except SchemaNotCached as e:
+        print(f"❌ {e}")
+        exit(1)
+
+def load_input(path, message_type, keep_raw=False):
+    from backup_filter import is_backup
+    try:
+        if is_backup(path):
+            return Library.load_backup(path, message_type, keep_raw=keep_raw)
+        return Library.load(path, keep_raw=keep_raw)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read {path}: {e}")
+        exit(1)
+
+def run_query(args, query):
+    from json import JSONDecodeError
+
+    from google.protobuf.json_format import ParseError
+    from google.protobuf.message import EncodeError
+
+    from backup_filter import filter_file
+    output = args.output or Path(get_next_output_filename())
+    fork, message_type = backup_schema(args, not str(output).endswith(".json"))
+    try:
+        result = filter_file(args.input, message_type, query, output, args.compression_level, fork)
+    except OSError as e:
+        print(f"❌ Could not read {args.input}: {e}")
+        exit(1)
+    except (ParseError, EncodeError, JSONDecodeError) as e:
+        output.unlink(missing_ok=True)
+        print(f"❌ Invalid JSON backup: {e}")
+        exit(1)
+    print(f"\n✅ Kept {result.kept} of {result.total} manga, saved to \033[1m{output}\033[0m")
+
+def main():
+    args = build_parser().parse_args()
+    if is_sqlite_file(args.input):
+        # The export leaves out preferences, extension repos and the like
+        print(f"❌ {args.input} is a SQLite export, which can't be written back as a backup."
+              " Filter the backup, record file or JSON it was exported from.")
+        exit(1)
+    from backup_filter import Query
+    try:
+        query = Query(args.category, args.exclude_category, args.source, args.min_read_ratio,
+                      args.max_read_ratio, args.added_after, args.added_before)
+    except ValueError as e:
+        print(f"❌ Invalid date: {e}")
+        exit(1)
+    if not query.empty:
+        run_query(args, query)
+        return
+
+    emoji_map = load_emoji_map()
+    fork, message_type = backup_schema(args, args.output is not None and not str(args.output).endswith(".json"))
+
+    # The menu only needs category names per manga, which the converter's sidecar
+    # index (or a backup's summaries) has; the full library is loaded once the
+    # selection is made
+    library = load_input(args.input, message_type)
+    sorted_categories = count_categories(library)
+    choice, selected_categories = choose_categories(sorted_categories, emoji_map)
+
+    if library.data is None:
+        library = load_input(args.input, message_type, keep_raw=True)
+    data = library.data
+
+    # Create new JSON
+    output_data = data.copy()
+    output_data["backupManga"] = []
+
+    if choice == "1":
+        print("\n\033[92mRemoving selected categories...\033[0m")
+    else:
+        print("\n\033[91mKeeping only selected categories...\033[0m")
+    for manga in library:
+        raw = manga.raw
         existing_cat_ids = raw.get("categories", [])
-        if not existing_cat_ids:
-            if "Uncategorized" not in selected_categories:
-                continue
-        else:
-            new_cat_ids = [
-                cid for cid in existing_cat_ids
-                if category_map.get(str(cid), "Uncategorized") in selected_categories
-            ]
-            if not new_cat_ids and "Uncategorized" not in selected_categories:
-                continue
-            raw["categories"] = new_cat_ids
+        new_cat_ids = filter_category_ids(existing_cat_ids, library.category_map, selected_categories, choice)
+        if new_cat_ids is None:
+            continue
+        if existing_cat_ids:
+            # A new dict, the entry itself belongs to library.data
+            raw = {**raw, "categories": new_cat_ids}
         output_data["backupManga"].append(raw)
 
-# Clean unused categories
-used_cat_ids = set()
-for manga in output_data["backupManga"]:
-    used_cat_ids.update(manga.get("categories", []))
-
-output_data["backupCategories"] = [
-    cat for cat in data.get("backupCategories", [])
-    if cat.get("order") in used_cat_ids
-]
-
-# Save to rotating output file
-output_file = get_next_output_filename()
-with open(output_file, "w", encoding="utf-8") as f:
-    json.dump(output_data, f, ensure_ascii=False, indent=2)
-
-print(f"\n✅ Processing complete! Cleaned data saved to \033[1m{output_file}\033[0m")
-print(f"Selected categories: {', '.join(selected_categories)}")
+    # Clean unused categories
+    used_cat_ids = set()
+    for manga in output_data["backupManga"]:
+        used_cat_ids.update(manga.get("categories", []))
+
+    output_data["backupCategories"] = [
+        cat for cat in data.get("backupCategories", [])
+        if cat.get("order") in used_cat_ids
+    ]
+
+    # Save to rotating output file, or a backup or record file by extension
+    from google.protobuf.json_format import ParseError
+    from google.protobuf.message import EncodeError
+
+    from backup_filter import write_backup_dict
+    output_file = args.output or Path(get_next_output_filename())
+    try:
+        write_backup_dict(output_data, message_type, output_file, args.compression_level, fork)
+    except (ParseError, EncodeError) as e:
+        output_file.unlink(missing_ok=True)
+        print(f"❌ Invalid JSON backup: {e}")
+        exit(1)
+
+    print(f"\n✅ Processing complete! Cleaned data saved to \033[1m{output_file}\033[0m")
+    print(f"Selected categories: {', '.join(selected_categories)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from library_index import little_endian, written_for
+
+np = None  # Imported by numpy_available(), only reading the columns back needs it
+
+# Per-chapter columns for the whole library, stored next to the decoded JSON
+# (output.json -> output.chapters) as flat arrays with a per-manga offsets
+# array, so chapter stats are NumPy reductions instead of loops over dicts.
+# lastRead isn't a chapter field, it is joined in from the manga's history.
+
+MAGIC = b'TBKCHP01'
+HEADER = struct.Struct('<8sIIQq')
+COLUMNS = (
+    ('lastPageRead', 'q'),
+    ('dateFetch', 'q'),
+    ('dateUpload', 'q'),
+    ('sourceOrder', 'q'),
+    ('lastRead', 'q'),
+    ('chapterNumber', 'f'),
+    ('read', 'B'),
+    ('bookmark', 'B'),
+)
+CHAPTER_FIELDS = tuple(name for name, _ in COLUMNS if name != 'lastRead')
+
+
+def numpy_available() -> bool:
+    # Deferred because it takes longer to import than decoding a small backup,
+    # and writing the columns doesn't use it
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+def chapters_path(json_path: str | Path) -> Path:
+    return Path(json_path).with_suffix('.chapters')
+
+
+def chapters_are_fresh(json_path: str | Path) -> bool:
+    # Unlike load_chapters, doesn't need NumPy
+    return written_for(chapters_path(json_path), MAGIC, HEADER, json_path)
+
+
+class ChapterColumns:
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def add_manga(self, manga) -> None:
+        chapters = manga.chapters
+        for name in CHAPTER_FIELDS:
+            self.columns[name].extend([getattr(chapter, name) for chapter in chapters])
+        history = {entry.url: entry.lastRead for entry in manga.history}
+        self.columns['lastRead'].extend([history.get(chapter.url, 0) for chapter in chapters])
+        self.offsets.append(len(self.columns['read']))
+
+    def add_dict(self, manga: dict) -> None:
+        # MessageToDict output: int64 values are strings, unset fields missing
+        chapters = manga.get('chapters', [])
+        for name, typecode in COLUMNS:
+            if name == 'lastRead':
+                continue
+            convert = float if typecode == 'f' else int
+            self.columns[name].extend([convert(chapter.get(name, 0)) for chapter in chapters])
+        history = {entry.get('url'): int(entry.get('lastRead', 0)) for entry in manga.get('history', [])}
+        self.columns['lastRead'].extend([history.get(chapter.get('url'), 0) for chapter in chapters])
+        self.offsets.append(len(self.columns['read']))
+
+    def to_bytes(self, json_size: int = 0, json_mtime_ns: int = 0) -> bytes:
+        sections = [
+            HEADER.pack(MAGIC, len(self), len(self.columns['read']), json_size, json_mtime_ns),
+            little_endian(self.offsets),
+        ]
+        sections.extend(little_endian(self.columns[name]) for name, _ in COLUMNS)
+        return b''.join(sections)
+
+    def write(self, path: str | Path, json_path: str | Path) -> None:
+        stat = os.stat(json_path)
+        partial = Path(path).with_suffix('.chapters.part')
+        with open(partial, 'wb') as file:
+            file.write(self.to_bytes(stat.st_size, stat.st_mtime_ns))
+        os.replace(partial, path)
+
+
+class ChapterStore:
+    def __init__(self, offsets, columns: dict):
+        self.offsets = offsets
+        self.columns = columns
+        self.json_size = self.json_mtime_ns = 0
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ChapterStore':
+        magic, manga, chapters, json_size, json_mtime_ns = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a chapter store file')
+        pos = HEADER.size
+        offsets = np.frombuffer(data, '<u8', manga + 1, pos)
+        pos += offsets.nbytes
+        columns = {}
+        for name, typecode in COLUMNS:
+            columns[name] = np.frombuffer(data, np.dtype(typecode).newbyteorder('<'), chapters, pos)
+            pos += columns[name].nbytes
+        store = cls(offsets, columns)
+        store.json_size, store.json_mtime_ns = json_size, json_mtime_ns
+        return store
+
+    @classmethod
+    def from_columns(cls, builder: ChapterColumns) -> 'ChapterStore':
+        return cls(
+            np.frombuffer(builder.offsets, np.uint64),
+            {name: np.frombuffer(builder.columns[name], typecode) for name, typecode in COLUMNS},
+        )
+
+    @property
+    def total_chapters(self):
+        return np.diff(self.offsets).astype(np.int64)
+
+    def per_manga_sum(self, values):
+        # Sum over each manga's chapter range, empty ranges included
+        totals = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+        return totals[self.offsets[1:]] - totals[self.offsets[:-1]]
+
+    @property
+    def read_chapters(self):
+        return self.per_manga_sum(self.columns['read'])
+
+    def read_breakdown(self) -> tuple[int, int, int]:
+        # (fully read, partially read, unread) manga
+        read, total = self.read_chapters, self.total_chapters
+        fully_read = int(np.count_nonzero((read == total) & (total > 0)))
+        unread = int(np.count_nonzero(read == 0))
+        return fully_read, len(self) - fully_read - unread, unread
+
+    def read_per_month(self) -> list[tuple[str, int]]:
+        # Dated by the history entry, read chapters without one are left out
+        last_read = self.columns['lastRead']
+        dates = last_read[(self.columns['read'] != 0) & (last_read > 0)]
+        months, counts = np.unique(dates.astype('datetime64[ms]').astype('datetime64[M]'), return_counts=True)
+        return [(str(month), int(count)) for month, count in zip(months, counts)]
+
+
+def load_chapters(json_path: str | Path) -> ChapterStore | None:
+    # Same freshness rule as the library index
+    if not numpy_available():
+        return None
+    try:
+        with open(chapters_path(json_path), 'rb') as file:
+            store = ChapterStore.from_bytes(file.read())
+        stat = os.stat(json_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if (store.json_size, store.json_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return store
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+# Decoded backups kept between runs with --cache, so converting the same backup again is
+# a file copy. An entry holds the JSON and the sidecars written next to it
+# (library index and chapter columns) and is keyed by:
+#
+#   - the SHA-256 of the input file
+#   - the fork and a fingerprint of the schema it was decoded with, so an
+#     updated schema_pb2/registry schema never serves stale JSON
+#   - the converter version and the options that change the JSON
+#
+# Entries whose input and fork match but whose schema doesn't are dropped
+# when they are looked up. The least recently used entries are evicted once
+# the cache grows past its size limit.
+#
+# <cache_dir>/<key>/ holds the files and meta.json with the key's parts,
+# the entry size and when it was last used.
+
+CACHE_DIR = Path('manga/proto/decoded')
+DEFAULT_SIZE_MIB = 1024
+META_NAME = 'meta.json'
+
+
+def schema_fingerprint(message_type) -> str:
+    # Same for the same messages and fields, wherever the schema came from
+    from google.protobuf import descriptor_pb2
+
+    file = descriptor_pb2.FileDescriptorProto()
+    message_type.DESCRIPTOR.file.CopyToProto(file)
+    return hashlib.sha256(file.SerializeToString(deterministic=True)).hexdigest()[:16]
+
+
+class DecodeCache:
+    def __init__(self, cache_dir: str | Path = CACHE_DIR, max_bytes: int = DEFAULT_SIZE_MIB << 20):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(digest: str, fork: str, schema: str, options: dict) -> str:
+        parts = json.dumps([digest, fork, schema, options], sort_keys=True)
+        return hashlib.sha256(parts.encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def entries(self) -> list[tuple[Path, dict]]:
+        entries = []
+        if not self.cache_dir.is_dir():
+            return entries
+        for path in self.cache_dir.iterdir():
+            try:
+                entries.append((path, json.loads((path / META_NAME).read_text())))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def invalidate(self, digest: str, fork: str, schema: str) -> int:
+        # Drops the entries of this input that were decoded with another schema
+        stale = [
+            path
+            for path, meta in self.entries()
+            if meta.get('sha256') == digest and meta.get('fork') == fork and meta.get('schema') != schema
+        ]
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+        return len(stale)
+
+    def restore(self, key: str, outputs: dict[str, Path]) -> bool:
+        # Copies the cached files to outputs (name in the entry -> path), False on a miss
+        entry = self.path(key)
+        meta_path = entry / META_NAME
+        try:
+            meta = json.loads(meta_path.read_text())
+            for name, output in outputs.items():
+                if name in meta['files']:
+                    output.parent.mkdir(parents=True, exist_ok=True)
+                    # copy2 keeps the mtime, which the sidecars check against the JSON
+                    shutil.copy2(entry / name, output)
+        except (OSError, ValueError, KeyError):
+            return False
+        meta['last_used'] = time.time()
+        meta_path.write_text(json.dumps(meta))
+        return True
+
+    def store(self, key: str, outputs: dict[str, Path], meta: dict) -> bool:
+        # False when the entry alone is over the size limit. Files are stored as
+        # given, leaving out sidecars that don't belong to the JSON is up to the caller
+        files = {name: output for name, output in outputs.items() if output.is_file()}
+        size = sum(output.stat().st_size for output in files.values())
+        if size > self.max_bytes:
+            return False
+        entry = self.path(key)
+        partial = self.cache_dir / f'{key}.part-{os.getpid()}'
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir(parents=True)
+        for name, output in files.items():
+            shutil.copy2(output, partial / name)
+        meta = {**meta, 'files': list(files), 'size': size, 'last_used': time.time()}
+        (partial / META_NAME).write_text(json.dumps(meta))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(partial, entry)
+        self.evict()
+        return True
+
+    def evict(self) -> list[Path]:
+        # Least recently used first, until the rest fits
+        entries = sorted(self.entries(), key=lambda entry: entry[1].get('last_used', 0))
+        total = sum(meta.get('size', 0) for _, meta in entries)
+        evicted = []
+        for path, meta in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= meta.get('size', 0)
+            evicted.append(path)
+        return evicted
@@ -1,105 +1,79 @@
 import json
 import os
+import sys
 from collections import defaultdict
 
-# === Load emoji.txt ===
-def load_emoji_map(path="manga/emoji.txt"):
-    emoji_map = {}
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                if ":" in line:
-                    key, emoji = line.strip().split(":", 1)
-                    emoji_map[key.strip()] = emoji.strip()
-    return emoji_map
-
-emoji_map = load_emoji_map()
-
-# === Load output.json ===
-with open("output/output.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-# === Build ID maps ===
-category_map = {}
-for i, cat in enumerate(data.get("backupCategories", [])):
-    key = str(cat.get("order", i))
-    category_map[key] = cat.get("name", "Uncategorized")
-
-source_map = {}
-for src in data.get("backupSources", []):
-    source_map[str(src.get("sourceId"))] = src.get("name", "Unknown")
-
-# === Extract manga data ===
-result = []
-for manga in data.get("backupManga", []):
-    title = manga.get("title", "Unknown Title")
-    category_ids = manga.get("categories", [])
-    categories = [category_map.get(str(cid), "Uncategorized") for cid in category_ids] or ["Uncategorized"]
-    source_id = str(manga.get("source", ""))
-    extension = source_map.get(source_id, f"Unknown ({source_id})")
-
-    chapters = manga.get("chapters", [])
-    total_chapters = len(chapters)
-    read_chapters = sum(1 for c in chapters if c.get("read", False))
-
-    result.append({
-        "title": title,
-        "categories": categories,
-        "extension": extension,
-        "read_chapters": read_chapters,
-        "total_chapters": total_chapters
-    })
-
-# === Prepare output directories ===
-output_dir = "manga"
-sub_dir = os.path.join(output_dir, "sub")
-ext_dir = os.path.join(output_dir, "extension")
-os.makedirs(sub_dir, exist_ok=True)
-os.makedirs(ext_dir, exist_ok=True)
-
-# === Clean sub/ and extension/ folders ===
-for folder in [sub_dir, ext_dir]:
-    for file in os.listdir(folder):
-        file_path = os.path.join(folder, file)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-
-# === Write all.json ===
-with open(os.path.join(output_dir, "all.json"), "w", encoding="utf-8") as f:
-    json.dump(result, f, ensure_ascii=False, indent=2)
-
-# === Write category .txt files ===
-category_groups = defaultdict(list)
-for entry in result:
-    for cat in entry.get("categories", ["Uncategorized"]):
-        category_groups[cat].append(entry)
-
-for category, entries in category_groups.items():
-    safe_category = category.replace("/", "-").replace("\\", "-")
-    emoji = emoji_map.get(category, "•")
-    filename = os.path.join(sub_dir, f"{safe_category}.txt")
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(f"# {emoji} {category}\n\n")
-        for i, entry in enumerate(entries, start=1):
-            tick = " ✅" if entry["read_chapters"] == entry["total_chapters"] and entry["total_chapters"] > 0 else ""
-            f.write(f"{i}. {entry['title']} ({entry['total_chapters']}) [{entry['extension']}] {tick}\n")
-
-# === Write extension .txt files ===
-extension_groups = defaultdict(list)
-for entry in result:
-    extension = entry["extension"]
-    extension_groups[extension].append(entry)
-
-for extension, entries in extension_groups.items():
-    safe_extension = extension.replace("/", "-").replace("\\", "-")
-    filename = os.path.join(ext_dir, f"{safe_extension}.txt")
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(f"# 📦 {extension}\n\n")
-        for i, entry in enumerate(entries, start=1):
-            catlist = ", ".join(f"{emoji_map.get(cat, '•')} {cat}" for cat in entry.get("categories", ["Uncategorized"]))
-            tick = " ✅" if entry["read_chapters"] == entry["total_chapters"] and entry["total_chapters"] > 0 else ""
-            f.write(f"{i}. {entry['title']} ({entry['total_chapters']}) [{catlist}]{tick}\n")
-
-print("✅ all.json updated with full category + emoji support.")
-print("📁 Category text files saved in 'manga/sub/'")
-print("📁 Extension text files saved in 'manga/extension/'")
\ No newline at end of file
+from library import Library, load_emoji_map
+from record_file import is_record_file
+from sqlite_export import is_sqlite_file
+
+# === Load output.json, or read a backup, record file or SQLite export directly when one is given ===
+# python3 extract_titles_and_folders.py backup/your_file.tachibk
+# python3 extract_titles_and_folders.py output/library.sqlite  (counts come from indexed SQL queries)
+def load_library(argv):
+    if argv and (is_record_file(argv[0]) or is_sqlite_file(argv[0])):
+        return Library.load(argv[0])
+    if argv:
+        sys.path.insert(0, "./manga/proto")
+        from schema_pb2 import Backup
+        from lazy_backup import open_backup
+
+        return Library.from_lazy(open_backup(argv[0], Backup))
+    return Library.load("output/output.json")
+
+def write_reports(library, emoji_map):
+    # === Prepare output directories ===
+    output_dir = "manga"
+    sub_dir = os.path.join(output_dir, "sub")
+    ext_dir = os.path.join(output_dir, "extension")
+    os.makedirs(sub_dir, exist_ok=True)
+    os.makedirs(ext_dir, exist_ok=True)
+
+    # === Clean sub/ and extension/ folders ===
+    for folder in [sub_dir, ext_dir]:
+        for file in os.listdir(folder):
+            file_path = os.path.join(folder, file)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    # === Write all.json ===
+    with open(os.path.join(output_dir, "all.json"), "w", encoding="utf-8") as f:
+        json.dump(library.summaries, f, ensure_ascii=False, indent=2)
+
+    # === Write category .txt files ===
+    category_groups = defaultdict(list)
+    for manga in library:
+        for cat in manga.categories:
+            category_groups[cat].append(manga)
+
+    for category, entries in category_groups.items():
+        safe_category = category.replace("/", "-").replace("\\", "-")
+        emoji = emoji_map.get(category, "•")
+        filename = os.path.join(sub_dir, f"{safe_category}.txt")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(f"# {emoji} {category}\n\n")
+            for i, manga in enumerate(entries, start=1):
+                tick = " ✅" if manga.fully_read else ""
+                f.write(f"{i}. {manga.title} ({manga.total_chapters}) [{manga.extension}] {tick}\n")
+
+    # === Write extension .txt files ===
+    extension_groups = defaultdict(list)
+    for manga in library:
+        extension_groups[manga.extension].append(manga)
+
+    for extension, entries in extension_groups.items():
+        safe_extension = extension.replace("/", "-").replace("\\", "-")
+        filename = os.path.join(ext_dir, f"{safe_extension}.txt")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(f"# 📦 {extension}\n\n")
+            for i, manga in enumerate(entries, start=1):
+                catlist = ", ".join(f"{emoji_map.get(cat, '•')} {cat}" for cat in manga.categories)
+                tick = " ✅" if manga.fully_read else ""
+                f.write(f"{i}. {manga.title} ({manga.total_chapters}) [{catlist}]{tick}\n")
+
+    print("✅ all.json updated with full category + emoji support.")
+    print("📁 Category text files saved in 'manga/sub/'")
+    print("📁 Extension text files saved in 'manga/extension/'")
+
+if __name__ == "__main__":
+    write_reports(load_library(sys.argv[1:]), load_emoji_map(warn=False))
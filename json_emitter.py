@@ -0,0 +1,124 @@
+import math
+from base64 import b64encode
+from functools import lru_cache
+from json import dumps
+from json.encoder import encode_basestring_ascii
+from typing import Callable
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+
+# Writes JSON straight from protobuf messages. The output is identical to
+# dumps(MessageToDict(message), indent=2), or to separators=(',', ':') in
+# compact mode, without building the intermediate dicts.
+
+INT64_TYPES = (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64)
+FLOAT_NAMES = {math.inf: '"Infinity"', -math.inf: '"-Infinity"'}
+
+
+@lru_cache(maxsize=1 << 16)
+def shortest_float(value: float) -> str:
+    return repr(ToShortestFloat(value))
+
+
+def float_writer(single: bool) -> Callable[[float], str]:
+    def write(value: float) -> str:
+        if value != value:
+            return '"NaN"'
+        if value in FLOAT_NAMES:
+            return FLOAT_NAMES[value]
+        return shortest_float(value) if single else repr(value)
+
+    return write
+
+
+def enum_writer(field: FieldDescriptor) -> Callable[[int], str]:
+    names = {number: f'"{value.name}"' for number, value in field.enum_type.values_by_number.items()}
+    return lambda value: names.get(value) or str(value)
+
+
+def write_int64(value: int) -> str:
+    return f'"{value}"'
+
+
+def write_bool(value: bool) -> str:
+    return 'true' if value else 'false'
+
+
+def write_bytes(value: bytes) -> str:
+    return f'"{b64encode(value).decode()}"'
+
+
+def scalar_writer(field: FieldDescriptor) -> Callable:
+    match field.cpp_type:
+        case FieldDescriptor.CPPTYPE_STRING:
+            return write_bytes if field.type == FieldDescriptor.TYPE_BYTES else encode_basestring_ascii
+        case cpp_type if cpp_type in INT64_TYPES:
+            return write_int64
+        case FieldDescriptor.CPPTYPE_BOOL:
+            return write_bool
+        case FieldDescriptor.CPPTYPE_FLOAT:
+            return float_writer(True)
+        case FieldDescriptor.CPPTYPE_DOUBLE:
+            return float_writer(False)
+        case FieldDescriptor.CPPTYPE_ENUM:
+            return enum_writer(field)
+    return str
+
+
+class JSONEmitter:
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self.key_separator = ':' if compact else ': '
+        self.newlines: list[str] = []
+        self.plans: dict[Descriptor, dict[FieldDescriptor, tuple]] = {}
+
+    def newline(self, level: int) -> str:
+        while len(self.newlines) <= level:
+            self.newlines.append('' if self.compact else '\n' + '  ' * len(self.newlines))
+        return self.newlines[level]
+
+    def plan(self, descriptor: Descriptor) -> dict[FieldDescriptor, tuple]:
+        plan = {}
+        for field in descriptor.fields:
+            is_message = field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE
+            plan[field] = (
+                encode_basestring_ascii(field.json_name) + self.key_separator,
+                field.is_repeated,
+                None if is_message else scalar_writer(field),
+            )
+        self.plans[descriptor] = plan
+        return plan
+
+    def message(self, message: Message, level: int = 0) -> str:
+        fields = message.ListFields()
+        if not fields:
+            return '{}'
+        plan = self.plans.get(message.DESCRIPTOR) or self.plan(message.DESCRIPTOR)
+        inner = self.newline(level + 1)
+        parts = []
+        for field, value in fields:
+            key, repeated, write = plan[field]
+            if not repeated:
+                parts.append(key + (write(value) if write else self.message(value, level + 1)))
+                continue
+            item = self.newline(level + 2)
+            if write:
+                items = map(write, value)
+            else:
+                items = (self.message(entry, level + 2) for entry in value)
+            parts.append(f'{key}[{item}{("," + item).join(items)}{inner}]')
+        return f'{{{inner}{("," + inner).join(parts)}{self.newline(level)}}}'
+
+    def value(self, value, level: int = 0) -> str:
+        if self.compact:
+            return dumps(value, separators=(',', ':'))
+        return dumps(value, indent=2).replace('\n', self.newline(level))
+
+
+class DictJSONEmitter(JSONEmitter):
+    # Reference path through MessageToDict, used when --fast-json is off
+    def message(self, message: Message, level: int = 0) -> str:
+        return self.value(MessageToDict(message), level)
@@ -0,0 +1,84 @@
+from json import JSONDecodeError, JSONDecoder
+from typing import Iterator, TextIO
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+# Characters that may continue a number, a value followed by one is incomplete
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+class JSONStreamReader:
+    def __init__(self, file: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: int | None = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise JSONDecodeError(f'Expecting {char!r}', self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number touching the end of the buffer may still be truncated
+                if self.eof or end < len(self.buffer) and self.buffer[end] not in NUMBER_CHARS:
+                    self.pos = end
+                    return value
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow geometrically so huge entries are not re-decoded once per chunk
+            self.fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+
+def iter_json_items(file: TextIO, stream_key: str) -> Iterator[tuple[str, object]]:
+    # Yields (key, value) for every top-level key of a JSON object, except that
+    # the array under `stream_key` is yielded one (key, element) pair at a time
+    reader = JSONStreamReader(file)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise JSONDecodeError('Expecting property name', reader.buffer, reader.pos)
+        reader.expect(':')
+        if key == stream_key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() != ']':
+                while True:
+                    yield key, reader.value()
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+            reader.expect(']')
+        else:
+            yield key, reader.value()
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
@@ -0,0 +1,132 @@
+from array import array
+from typing import Iterator
+
+from google.protobuf import descriptor_pb2, descriptor_pool
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.message import Message
+from google.protobuf.message_factory import GetMessageClass
+
+import parallel_gzip
+import raw_cache
+import record_file
+from backup_stream import MANGA_FIELD, WIRE_LEN, iter_spans
+
+# Fields decoded for a manga summary. Everything else, chapter names and urls
+# included, is skipped by the protobuf parser without being turned into objects.
+SUMMARY_FIELDS = ('source', 'url', 'title', 'dateAdded', 'categories', 'chapters')
+CHAPTER_SUMMARY_FIELDS = ('read',)
+
+summary_types: dict[Descriptor, type[Message]] = {}
+
+
+def reduced_message(
+    proto: descriptor_pb2.DescriptorProto, descriptor: Descriptor, name: str, keep: tuple[str, ...]
+) -> None:
+    proto.name = name
+    for field in descriptor.fields:
+        if field.name not in keep:
+            continue
+        field_proto = proto.field.add()
+        field_proto.name = field.name
+        field_proto.number = field.number
+        field_proto.type = field.type
+        field_proto.label = (
+            FieldDescriptor.LABEL_REPEATED if field.is_repeated else FieldDescriptor.LABEL_OPTIONAL
+        )
+
+
+def summary_type(manga: Descriptor) -> type[Message]:
+    if manga in summary_types:
+        return summary_types[manga]
+    file = descriptor_pb2.FileDescriptorProto(
+        name=f'summary_{manga.full_name}.proto', package='summary', syntax='proto2'
+    )
+    chapter = manga.fields_by_name['chapters'].message_type
+    reduced_message(file.message_type.add(), chapter, 'ChapterSummary', CHAPTER_SUMMARY_FIELDS)
+    reduced_message(file.message_type.add(), manga, 'MangaSummary', SUMMARY_FIELDS)
+    for field in file.message_type[1].field:
+        if field.name == 'chapters':
+            field.type_name = '.summary.ChapterSummary'
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file)
+    summary_types[manga] = GetMessageClass(pool.FindMessageTypeByName('summary.MangaSummary'))
+    return summary_types[manga]
+
+
+class LazyBackup:
+    def __init__(self, data, message_type: type[Message]):
+        self.data = memoryview(data)
+        self.message_type = message_type
+        self.fields = message_type.DESCRIPTOR.fields_by_number
+        # Flat (start, end) pairs for every top-level submessage, per field number
+        self.spans: dict[int, array] = {}
+        for number, wire_type, start, end in iter_spans(self.data):
+            if wire_type == WIRE_LEN and number in self.fields:
+                self.spans.setdefault(number, array('Q')).extend((start, end))
+        manga = self.fields[MANGA_FIELD].message_type
+        self.manga_class = GetMessageClass(manga)
+        self.summary_class = summary_type(manga)
+
+    def __len__(self) -> int:
+        return len(self.spans.get(MANGA_FIELD, ())) // 2
+
+    def span(self, index: int, number: int = MANGA_FIELD) -> tuple[int, int]:
+        spans = self.spans[number]
+        return spans[2 * index], spans[2 * index + 1]
+
+    def parse(self, message_class: type[Message], index: int, number: int = MANGA_FIELD) -> Message:
+        start, end = self.span(index, number)
+        message = message_class()
+        message.ParseFromString(self.data[start:end])
+        return message
+
+    def manga(self, index: int) -> Message:
+        return self.parse(self.manga_class, index)
+
+    def summary(self, index: int) -> Message:
+        return self.parse(self.summary_class, index)
+
+    def __getitem__(self, index: int) -> Message:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('manga index out of range')
+        return self.manga(index)
+
+    def __iter__(self) -> Iterator[Message]:
+        for index in range(len(self)):
+            yield self.manga(index)
+
+    def summaries(self) -> Iterator[Message]:
+        for index in range(len(self)):
+            yield self.summary(index)
+
+    def entries(self, number: int) -> list[Message]:
+        message_class = GetMessageClass(self.fields[number].message_type)
+        count = len(self.spans.get(number, ())) // 2
+        return [self.parse(message_class, index, number) for index in range(count)]
+
+    def entries_by_name(self, name: str) -> list[Message]:
+        return self.entries(self.message_type.DESCRIPTOR.fields_by_name[name].number)
+
+    def categories(self) -> list[Message]:
+        return self.entries_by_name('backupCategories')
+
+    def sources(self) -> list[Message]:
+        return self.entries_by_name('backupSources')
+
+
+def count_read_chapters(summary: Message) -> int:
+    return [chapter.read for chapter in summary.chapters].count(True)
+
+
+def open_backup(path: str, message_type: type[Message]) -> LazyBackup:
+    path = str(path)
+    if record_file.is_record_file(path):
+        return LazyBackup(record_file.map_payload(path), message_type)
+    if not (path.endswith('.tachibk') or path.endswith('.proto.gz')):
+        return LazyBackup(raw_cache.map_file(path), message_type)
+    if raw_cache.has_entries() and (cached := raw_cache.lookup(raw_cache.file_digest(path))):
+        return LazyBackup(raw_cache.map_file(cached), message_type)
+    with parallel_gzip.open(path, 'rb') as file:
+        return LazyBackup(file.read(), message_type)
@@ -0,0 +1,316 @@
+import json
+import os
+import sys
+from collections import Counter
+from functools import cached_property
+
+import chapter_store
+import record_file
+import sqlite_export
+from chapter_store import ChapterColumns, ChapterStore, load_chapters
+from library_index import IndexBuilder, LibraryIndex, load_index
+
+# One summary row per manga, built once per backup and shared by the report
+# scripts and pipeline.py. Category and source names are interned, so the
+# thousands of rows pointing at the same category share one string.
+
+EMOJI_PATH = 'manga/emoji.txt'
+
+
+def load_emoji_map(path: str = EMOJI_PATH, warn: bool = True) -> dict[str, str]:
+    emoji_map = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if ':' in line:
+                    key, emoji = line.strip().split(':', 1)
+                    emoji_map[key.strip()] = emoji.strip()
+    elif warn:
+        print('⚠️ emoji.txt not found. Emojis will be skipped.')
+    return emoji_map
+
+
+class MangaSummary:
+    __slots__ = ('title', 'categories', 'extension', 'read_chapters', 'total_chapters', 'has_categories', 'raw')
+
+    def __init__(
+        self,
+        title: str,
+        categories: list[str],
+        extension: str,
+        read_chapters: int,
+        total_chapters: int,
+        has_categories: bool = True,
+        raw: dict | None = None,
+    ):
+        self.title = title
+        self.categories = categories
+        self.extension = extension
+        self.read_chapters = read_chapters
+        self.total_chapters = total_chapters
+        # False when the manga itself has no category ids, as opposed to ids
+        # that don't resolve to a category
+        self.has_categories = has_categories
+        # The backupManga entry, only kept when the caller needs to edit it
+        self.raw = raw
+
+    @property
+    def fully_read(self) -> bool:
+        return self.read_chapters == self.total_chapters and self.total_chapters > 0
+
+    def as_dict(self) -> dict:
+        return {
+            'title': self.title,
+            'categories': self.categories,
+            'extension': self.extension,
+            'read_chapters': self.read_chapters,
+            'total_chapters': self.total_chapters,
+        }
+
+
+def category_names(categories) -> dict[str, str]:
+    # Keyed like the manga's category ids: the category order, as a string
+    category_map = {}
+    for i, cat in enumerate(categories):
+        category_map[str(cat.get('order', i))] = sys.intern(cat.get('name', 'Uncategorized'))
+    return category_map
+
+
+def source_names(sources) -> dict[str, str]:
+    return {str(src.get('sourceId')): sys.intern(src.get('name', 'Unknown')) for src in sources}
+
+
+def extension_name(source_map: dict[str, str], source_id: str) -> str:
+    if source_id in source_map:
+        return source_map[source_id]
+    return sys.intern(f'Unknown ({source_id})')
+
+
+class Library:
+    def __init__(
+        self,
+        manga: list[MangaSummary],
+        category_map: dict[str, str] | None = None,
+        data: dict | None = None,
+        chapters: ChapterStore | None = None,
+    ):
+        self.manga = manga
+        self.category_map = category_map or {}
+        # The decoded backup, when the library was loaded from one with raw entries
+        self.data = data
+        # Per-chapter columns, only loaded for chapter stats and when NumPy is around
+        self.chapters = chapters
+
+    def __len__(self) -> int:
+        return len(self.manga)
+
+    def __iter__(self):
+        return iter(self.manga)
+
+    @classmethod
+    def from_backup_dict(cls, data: dict, keep_raw: bool = False, with_chapters: bool = False) -> 'Library':
+        category_map = category_names(data.get('backupCategories', []))
+        source_map = source_names(data.get('backupSources', []))
+        entries = data.get('backupManga', [])
+        store = None
+        if with_chapters and chapter_store.numpy_available():
+            columns = ChapterColumns()
+            for raw in entries:
+                columns.add_dict(raw)
+            store = ChapterStore.from_columns(columns)
+            read_counts = store.read_chapters.tolist()
+        else:
+            read_counts = [
+                [chapter.get('read', False) for chapter in raw.get('chapters', [])].count(True) for raw in entries
+            ]
+        manga = []
+        for raw, read_chapters in zip(entries, read_counts):
+            category_ids = raw.get('categories', [])
+            manga.append(
+                MangaSummary(
+                    raw.get('title', 'Unknown Title'),
+                    [category_map.get(str(cid), 'Uncategorized') for cid in category_ids] or ['Uncategorized'],
+                    extension_name(source_map, str(raw.get('source', ''))),
+                    read_chapters,
+                    len(raw.get('chapters', [])),
+                    bool(category_ids),
+                    raw if keep_raw else None,
+                )
+            )
+        return cls(manga, category_map, data if keep_raw else None, store)
+
+    @classmethod
+    def from_summaries(cls, entries: list[dict]) -> 'Library':
+        # The all.json format written by extract_titles_and_folders.py
+        manga = [
+            MangaSummary(
+                entry.get('title', 'Unknown Title'),
+                [sys.intern(cat) for cat in entry.get('categories', ['Uncategorized'])],
+                sys.intern(entry.get('extension', 'Unknown')),
+                entry.get('read_chapters', 0),
+                entry.get('total_chapters', 0),
+            )
+            for entry in entries
+        ]
+        return cls(manga)
+
+    @classmethod
+    def from_index(cls, index: LibraryIndex) -> 'Library':
+        manga = [
+            MangaSummary(
+                index.title(row),
+                index.categories(row),
+                sys.intern(index.extension(row)),
+                index.read_chapters[row],
+                index.total_chapters[row],
+                index.has_categories(row),
+            )
+            for row in range(len(index))
+        ]
+        category_map = {
+            str(key): sys.intern(name) for key, name in zip(index.category_keys, index.category_names)
+        }
+        return cls(manga, category_map)
+
+    @classmethod
+    def from_lazy(cls, backup) -> 'Library':
+        # Only titles, ids and read flags get decoded, chapter bodies are skipped
+        from google.protobuf.json_format import MessageToDict
+        from lazy_backup import count_read_chapters
+
+        category_map = category_names(MessageToDict(cat) for cat in backup.categories())
+        source_map = source_names(MessageToDict(src) for src in backup.sources())
+        manga = []
+        for summary in backup.summaries():
+            category_ids = list(summary.categories)
+            manga.append(
+                MangaSummary(
+                    summary.title if summary.HasField('title') else 'Unknown Title',
+                    [category_map.get(str(cid), 'Uncategorized') for cid in category_ids] or ['Uncategorized'],
+                    extension_name(source_map, str(summary.source) if summary.HasField('source') else ''),
+                    count_read_chapters(summary),
+                    len(summary.chapters),
+                    bool(category_ids),
+                )
+            )
+        return cls(manga, category_map)
+
+    @classmethod
+    def from_backup(cls, backup, with_chapters: bool = False) -> 'Library':
+        # A LazyBackup, through the same index the converter writes next to the JSON
+        columns = ChapterColumns() if with_chapters and chapter_store.numpy_available() else None
+        builder = IndexBuilder(backup.message_type, columns)
+        builder.add_lazy(backup)
+        library = cls.from_index(LibraryIndex(builder.to_bytes()))
+        if columns is not None:
+            library.chapters = ChapterStore.from_columns(columns)
+        return library
+
+    @classmethod
+    def load_records(cls, path: str, keep_raw: bool = False, with_chapters: bool = False) -> 'Library':
+        from schema_registry import backup_class
+
+        return cls.load_backup(path, backup_class(record_file.read_fork(path)), keep_raw, with_chapters)
+
+    @classmethod
+    def load_backup(cls, path: str, message_type, keep_raw: bool = False, with_chapters: bool = False) -> 'Library':
+        # A backup or record file, read with message_type
+        from lazy_backup import open_backup
+
+        backup = open_backup(path, message_type)
+        if not keep_raw:
+            return cls.from_backup(backup, with_chapters)
+        from google.protobuf.json_format import MessageToDict
+
+        message = backup.message_type()
+        message.ParseFromString(backup.data)
+        return cls.from_backup_dict(MessageToDict(message), keep_raw, with_chapters)
+
+    @classmethod
+    def load_sqlite(cls, path: str) -> 'Library':
+        # A database written by sqlite_export.py, the counts come from its indexes
+        connection = sqlite_export.connect(path)
+        try:
+            category_map = {str(key): sys.intern(name) for key, name in sqlite_export.category_map(connection).items()}
+            category_keys = sqlite_export.category_keys(connection)
+            manga = []
+            for manga_id, title, extension, read_chapters, total_chapters in sqlite_export.iter_summaries(connection):
+                keys = category_keys.get(manga_id, [])
+                manga.append(
+                    MangaSummary(
+                        title if title is not None else 'Unknown Title',
+                        [category_map.get(str(key), 'Uncategorized') for key in keys] or ['Uncategorized'],
+                        sys.intern(extension),
+                        read_chapters,
+                        total_chapters,
+                        bool(keys),
+                    )
+                )
+        finally:
+            connection.close()
+        return cls(manga, category_map)
+
+    @classmethod
+    def from_json(cls, data, keep_raw: bool = False, with_chapters: bool = False) -> 'Library':
+        if isinstance(data, dict) and 'backupManga' in data:
+            return cls.from_backup_dict(data, keep_raw, with_chapters)
+        # Backups wrapped in a "data" key
+        if isinstance(data, dict) and 'backupManga' in data.get('data', {}):
+            return cls.from_backup_dict(data['data'], keep_raw, with_chapters)
+        if isinstance(data, list) and all(isinstance(m, dict) for m in data):
+            return cls.from_summaries(data)
+        raise ValueError('expected list of manga dicts')
+
+    @classmethod
+    def load(cls, path: str = 'output/output.json', keep_raw: bool = False, with_chapters: bool = False) -> 'Library':
+        if record_file.is_record_file(path):
+            return cls.load_records(path, keep_raw, with_chapters)
+        if sqlite_export.is_sqlite_file(path):
+            # No raw entries or chapter columns in there, the report counts are enough
+            return cls.load_sqlite(path)
+        # Decoded backups come with a sidecar index and chapter columns from the
+        # converter, which have everything but the raw entries
+        if not keep_raw and (index := load_index(path)) is not None:
+            library = cls.from_index(index)
+            if with_chapters:
+                library.chapters = load_chapters(path)
+            return library
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_json(json.load(f), keep_raw, with_chapters)
+
+    @cached_property
+    def summaries(self) -> list[dict]:
+        return [manga.as_dict() for manga in self.manga]
+
+    @cached_property
+    def read_breakdown(self) -> tuple[int, int, int]:
+        # (fully read, partially read, unread) manga
+        if self.chapters is not None:
+            return self.chapters.read_breakdown()
+        fully_read = sum(1 for manga in self.manga if manga.fully_read)
+        unread = sum(1 for manga in self.manga if manga.read_chapters == 0)
+        return fully_read, len(self.manga) - fully_read - unread, unread
+
+    @property
+    def fully_read(self) -> int:
+        return self.read_breakdown[0]
+
+    @property
+    def partially_read(self) -> int:
+        return self.read_breakdown[1]
+
+    @property
+    def unread(self) -> int:
+        return self.read_breakdown[2]
+
+    @cached_property
+    def uncategorized(self) -> int:
+        return sum(1 for manga in self.manga if not manga.has_categories)
+
+    @cached_property
+    def category_counts(self) -> Counter:
+        return Counter(cat for manga in self.manga for cat in manga.categories)
+
+    @cached_property
+    def extension_counts(self) -> Counter:
+        return Counter(manga.extension for manga in self.manga)
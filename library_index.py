@@ -0,0 +1,269 @@
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+# Columnar sidecar written next to the decoded JSON (output.json -> output.idx)
+# with one row per manga: title, source id, category bitmap and ordered
+# category list, total/read chapter counts and the record's byte range in the
+# raw backup payload. Loading it is a handful of memoryview casts, so the
+# report scripts don't need to parse the full JSON.
+
+MAGIC = b'TBKIDX01'
+HEADER = struct.Struct('<8sIIIIIQq')
+UNKNOWN_CATEGORY = 0xFFFF
+NO_CATEGORIES = 1
+NO_SOURCE = 2
+
+
+def index_path(json_path: str | Path) -> Path:
+    return Path(json_path).with_suffix('.idx')
+
+
+def written_for(path: str | Path, magic: bytes, header: struct.Struct, json_path: str | Path) -> bool:
+    # Whether the sidecar at path was written for the JSON as it is now, from
+    # its header alone. Both sidecar headers end with the JSON's size and mtime
+    try:
+        with open(path, 'rb') as file:
+            fields = header.unpack(file.read(header.size))
+        stat = os.stat(json_path)
+    except (OSError, struct.error):
+        return False
+    return fields[0] == magic and fields[-2:] == (stat.st_size, stat.st_mtime_ns)
+
+
+def index_is_fresh(json_path: str | Path) -> bool:
+    return written_for(index_path(json_path), MAGIC, HEADER, json_path)
+
+
+def little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class IndexBuilder:
+    def __init__(self, message_type, chapters=None):
+        fields = message_type.DESCRIPTOR.fields_by_name
+        self.manga_field = fields['backupManga'].number
+        self.category_field = fields['backupCategories'].number
+        self.source_field = fields['backupSources'].number
+        self.titles: list[str] = []
+        self.sources = array('q')
+        self.flags = bytearray()
+        self.category_ids = array('q')
+        self.category_starts = array('I', [0])
+        self.total = array('I')
+        self.read = array('I')
+        self.offsets = array('Q')
+        self.sizes = array('I')
+        self.categories: list[tuple[int, str]] = []
+        self.source_names: list[tuple[int, str]] = []
+        # Optional chapter_store.ChapterColumns fed with every manga
+        self.chapters = chapters
+
+    def add_manga(self, manga, start: int, end: int) -> None:
+        # Same defaults the report scripts apply to the JSON
+        self.titles.append(manga.title if manga.HasField('title') else 'Unknown Title')
+        self.sources.append(manga.source)
+        self.flags.append(
+            (0 if manga.categories else NO_CATEGORIES) | (0 if manga.HasField('source') else NO_SOURCE)
+        )
+        self.category_ids.extend(manga.categories)
+        self.category_starts.append(len(self.category_ids))
+        self.total.append(len(manga.chapters))
+        self.read.append([chapter.read for chapter in manga.chapters].count(True))
+        self.offsets.append(start)
+        self.sizes.append(end - start)
+        if self.chapters is not None:
+            self.chapters.add_manga(manga)
+
+    def add_category(self, category) -> None:
+        key = category.order if category.HasField('order') else len(self.categories)
+        self.categories.append((key, category.name if category.HasField('name') else 'Uncategorized'))
+
+    def add_source(self, source) -> None:
+        self.source_names.append((source.sourceId, source.name if source.HasField('name') else 'Unknown'))
+
+    def add(self, number: int, message, start: int, end: int) -> None:
+        if number == self.manga_field:
+            self.add_manga(message, start, end)
+        elif number == self.category_field:
+            self.add_category(message)
+        elif number == self.source_field:
+            self.add_source(message)
+
+    def track(self, records):
+        # Pass-through for iter_message_spans() that indexes while streaming
+        for number, message, start, end in records:
+            self.add(number, message, start, end)
+            yield number, message
+
+    def add_lazy(self, backup) -> None:
+        # Summaries lack the chapter columns, those need the full manga
+        parse = backup.summary if self.chapters is None else backup.manga
+        for index in range(len(backup)):
+            self.add_manga(parse(index), *backup.span(index))
+        for category in backup.categories():
+            self.add_category(category)
+        for source in backup.sources():
+            self.add_source(source)
+
+    def add_message(self, message, backup) -> None:
+        # A fully parsed Backup, with byte ranges taken from the LazyBackup over
+        # the payload it was parsed from
+        for index, manga in enumerate(message.backupManga):
+            self.add_manga(manga, *backup.span(index))
+        for category in message.backupCategories:
+            self.add_category(category)
+        for source in message.backupSources:
+            self.add_source(source)
+
+    def to_bytes(self, json_size: int = 0, json_mtime_ns: int = 0) -> bytes:
+        # Later categories with the same key win, like the dict based maps did
+        key_index = {key: position for position, (key, _) in enumerate(self.categories)}
+        bitmap_bytes = (len(self.categories) + 7) // 8
+        bitmap = bytearray(bitmap_bytes * len(self.titles))
+        category_list = array('H')
+        for row in range(len(self.titles)):
+            for category_id in self.category_ids[self.category_starts[row] : self.category_starts[row + 1]]:
+                position = key_index.get(category_id, UNKNOWN_CATEGORY)
+                category_list.append(position)
+                if position != UNKNOWN_CATEGORY:
+                    bitmap[row * bitmap_bytes + position // 8] |= 1 << position % 8
+
+        strings = self.titles + [name for _, name in self.categories] + [name for _, name in self.source_names]
+        blob = bytearray()
+        string_offsets = array('I', [0])
+        for string in strings:
+            blob += string.encode('utf-8')
+            string_offsets.append(len(blob))
+
+        sections = (
+            HEADER.pack(
+                MAGIC,
+                len(self.titles),
+                len(self.categories),
+                len(self.source_names),
+                bitmap_bytes,
+                len(blob),
+                json_size,
+                json_mtime_ns,
+            ),
+            little_endian(string_offsets),
+            little_endian(array('q', [key for key, _ in self.categories])),
+            little_endian(array('q', [source_id for source_id, _ in self.source_names])),
+            little_endian(self.sources),
+            little_endian(self.offsets),
+            little_endian(self.category_starts),
+            little_endian(self.total),
+            little_endian(self.read),
+            little_endian(self.sizes),
+            little_endian(category_list),
+            bytes(self.flags),
+            bytes(bitmap),
+            bytes(blob),
+        )
+        return b''.join(sections)
+
+    def write(self, path: str | Path, json_path: str | Path) -> None:
+        stat = os.stat(json_path)
+        partial = Path(path).with_suffix('.idx.part')
+        with open(partial, 'wb') as file:
+            file.write(self.to_bytes(stat.st_size, stat.st_mtime_ns))
+        os.replace(partial, path)
+
+
+class LibraryIndex:
+    def __init__(self, data: bytes):
+        (
+            magic,
+            self.count,
+            categories,
+            sources,
+            self.bitmap_bytes,
+            blob_size,
+            self.json_size,
+            self.json_mtime_ns,
+        ) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a library index file')
+        view = memoryview(data)
+        pos = HEADER.size
+
+        def take(typecode: str, length: int):
+            nonlocal pos
+            size = struct.calcsize(typecode) * length
+            section = view[pos : pos + size]
+            pos += size
+            if sys.byteorder == 'little':
+                return section.cast(typecode)
+            values = array(typecode)
+            values.frombytes(section)
+            values.byteswap()
+            return values
+
+        count = self.count
+        self.string_offsets = take('I', count + categories + sources + 1)
+        self.category_keys = take('q', categories)
+        self.source_ids = take('q', sources)
+        self.sources = take('q', count)
+        self.offsets = take('Q', count)
+        self.category_starts = take('I', count + 1)
+        self.total_chapters = take('I', count)
+        self.read_chapters = take('I', count)
+        self.sizes = take('I', count)
+        self.category_list = take('H', self.category_starts[-1])
+        self.flags = take('B', count)
+        self.bitmap = take('B', count * self.bitmap_bytes)
+        self.blob = take('B', blob_size)
+
+        self.category_names = [self.string(count + position) for position in range(categories)]
+        self.source_names = {
+            source_id: self.string(count + categories + position)
+            for position, source_id in enumerate(self.source_ids)
+        }
+
+    def __len__(self) -> int:
+        return self.count
+
+    def string(self, position: int) -> str:
+        return str(self.blob[self.string_offsets[position] : self.string_offsets[position + 1]], 'utf-8')
+
+    def title(self, row: int) -> str:
+        return self.string(row)
+
+    def has_categories(self, row: int) -> bool:
+        return not self.flags[row] & NO_CATEGORIES
+
+    def in_category(self, row: int, position: int) -> bool:
+        return bool(self.bitmap[row * self.bitmap_bytes + position // 8] & 1 << position % 8)
+
+    def categories(self, row: int) -> list[str]:
+        positions = self.category_list[self.category_starts[row] : self.category_starts[row + 1]]
+        return [
+            'Uncategorized' if position == UNKNOWN_CATEGORY else self.category_names[position]
+            for position in positions
+        ] or ['Uncategorized']
+
+    def extension(self, row: int) -> str:
+        if self.flags[row] & NO_SOURCE:
+            return 'Unknown ()'
+        source = self.sources[row]
+        return self.source_names.get(source, f'Unknown ({source})')
+
+
+def load_index(json_path: str | Path) -> LibraryIndex | None:
+    # The sidecar is only trusted while the JSON it was written for is untouched
+    path = index_path(json_path)
+    try:
+        with open(path, 'rb') as file:
+            index = LibraryIndex(file.read())
+        stat = os.stat(json_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if (index.json_size, index.json_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return index
@@ -0,0 +1,102 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:  # Windows, no peak RSS there
+    resource = None
+
+# Wall time, CPU time, bytes in and out and memory of each stage of a run,
+# e.g. gunzip, ParseFromString, MessageToDict and dumps when decoding.
+#
+# The peak RSS of a stage is the process high-water mark once the stage is
+# done, so the stage that raised it is the one where it first shows up.
+# With trace_memory the tracemalloc peak of every stage is recorded too.
+# That slows Python allocations down and doesn't see the memory protobuf
+# allocates by itself, which only the RSS covers.
+
+
+def max_rss() -> int | None:
+    if resource is None:
+        return None
+    # KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Stage:
+    def __init__(self, name: str, bytes_in: int | None = None):
+        self.name = name
+        self.bytes_in = bytes_in
+        # Set by the code of the stage when it knows it
+        self.bytes_out: int | None = None
+        self.wall_s = self.cpu_s = 0.0
+        self.max_rss_bytes: int | None = None
+        self.traced_peak_bytes: int | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'wall_s': round(self.wall_s, 6),
+            'cpu_s': round(self.cpu_s, 6),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'max_rss_bytes': self.max_rss_bytes,
+            'traced_peak_bytes': self.traced_peak_bytes,
+        }
+
+
+class Metrics:
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: list[Stage] = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, bytes_in: int | None = None) -> Iterator[Stage]:
+        stage = Stage(name, bytes_in)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_s = time.perf_counter() - wall
+            stage.cpu_s = time.process_time() - cpu
+            stage.max_rss_bytes = max_rss()
+            if self.trace_memory:
+                stage.traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+            self.stages.append(stage)
+
+    def as_dict(self, **info) -> dict:
+        return {
+            **info,
+            'wall_s': round(time.perf_counter() - self.start_wall, 6),
+            'cpu_s': round(time.process_time() - self.start_cpu, 6),
+            'max_rss_bytes': max_rss(),
+            'stages': [stage.as_dict() for stage in self.stages],
+        }
+
+    def write(self, path: str | Path, **info) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(self.as_dict(**info), indent=2))
+
+    def print_table(self) -> None:
+        def mib(value: int | None) -> str:
+            return f'{value / (1 << 20):.1f}' if value is not None else '-'
+
+        print(f'\n{"stage":<14} {"wall s":>8} {"cpu s":>8} {"in MiB":>8} {"out MiB":>8} {"RSS MiB":>8} {"traced MiB":>10}')
+        for stage in self.stages:
+            print(
+                f'{stage.name:<14} {stage.wall_s:>8.3f} {stage.cpu_s:>8.3f} {mib(stage.bytes_in):>8} {mib(stage.bytes_out):>8}'
+                f' {mib(stage.max_rss_bytes):>8} {mib(stage.traced_peak_bytes):>10}'
+            )
+        total = self.as_dict()
+        print(f'{"total":<14} {total["wall_s"]:>8.3f} {total["cpu_s"]:>8.3f}')
@@ -0,0 +1,212 @@
+import builtins
+import io
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, Full, Queue
+
+# pigz-style gzip: the input is cut into blocks that are deflated on a thread
+# pool (zlib releases the GIL), each primed with the previous block's tail as
+# dictionary so the ratio stays close to a single-threaded stream. Blocks end
+# on a sync flush, which lets them be concatenated into one gzip member.
+
+BLOCK_SIZE = 1 << 17
+DICT_SIZE = 1 << 15
+READ_SIZE = 1 << 20
+DEFAULT_LEVEL = 9
+
+
+def compress_block(data: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    if dictionary:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    def __init__(
+        self,
+        filename: str,
+        level: int = DEFAULT_LEVEL,
+        threads: int | None = None,
+        block_size: int = BLOCK_SIZE,
+    ):
+        self.filename = filename
+        self.file = builtins.open(filename, 'wb')
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.pending: deque[Future] = deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        extra_flags = 2 if level == 9 else 4 if level == 1 else 0
+        self.file.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + bytes((extra_flags, 255)))
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[: self.block_size])
+            del self.buffer[: self.block_size]
+            self.submit(block, False)
+        return len(data)
+
+    def submit(self, block: bytes, last: bool) -> None:
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.pool.submit(compress_block, block, self.dictionary, self.level, last))
+        self.dictionary = block[-DICT_SIZE:]
+        # Bound the number of blocks held in memory
+        while len(self.pending) > self.threads * 2:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.submit(bytes(self.buffer), True)
+            self.buffer.clear()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            self.file.write(struct.pack('<II', self.crc, self.size & 0xFFFFFFFF))
+        finally:
+            self.pool.shutdown()
+            self.file.close()
+            super().close()
+
+    def abort(self) -> None:
+        # No trailer for a stream that didn't get all its data, and no partial
+        # file left behind that would pass for a complete (if short) backup
+        if self.closed:
+            return
+        self.buffer.clear()
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.pool.shutdown()
+        self.file.close()
+        os.unlink(self.filename)
+        super().close()
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ParallelGzipWriterBuffer(io.BufferedWriter):
+    # What open() hands out for writing: the with statement ends up here
+    # rather than on the raw writer
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.raw.abort()
+        self.close()
+
+
+class ParallelGzipReader(io.RawIOBase):
+    # Decompression of a deflate stream can't be split, so instead of splitting
+    # it the reading and inflating run on a background thread, overlapping with
+    # whatever the consumer (usually the protobuf parser) does with the output.
+    def __init__(self, filename: str, queue_size: int = 8):
+        self.file = builtins.open(filename, 'rb')
+        self.queue: Queue = Queue(queue_size)
+        self.chunk = memoryview(b'')
+        self.finished = False
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.inflate, daemon=True)
+        self.worker.start()
+
+    def put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def inflate(self) -> None:
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while chunk := self.file.read(READ_SIZE):
+                while chunk:
+                    data = decompressor.decompress(chunk)
+                    if data and not self.put(data):
+                        return
+                    chunk = b''
+                    # Concatenated gzip members are a valid gzip file as well
+                    if decompressor.eof and decompressor.unused_data:
+                        chunk = decompressor.unused_data
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if not decompressor.eof:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def next_chunk(self) -> bool:
+        if self.finished:
+            return False
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        if item is None:
+            self.finished = True
+            return False
+        self.chunk = memoryview(item)
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.chunk and not self.next_chunk():
+            return 0
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def readall(self) -> bytes:
+        parts = [bytes(self.chunk)]
+        self.chunk = memoryview(b'')
+        while self.next_chunk():
+            parts.append(self.chunk)
+        self.chunk = memoryview(b'')
+        return b''.join(parts)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.stopped.set()
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+        self.worker.join()
+        self.file.close()
+        super().close()
+
+
+def open(filename, mode: str = 'rb', level: int = DEFAULT_LEVEL, threads: int | None = None):
+    match mode:
+        case 'rb':
+            return io.BufferedReader(ParallelGzipReader(str(filename)), READ_SIZE)
+        case 'wb':
+            return ParallelGzipWriterBuffer(ParallelGzipWriter(str(filename), level, threads), BLOCK_SIZE)
+    raise ValueError(f'Invalid mode: {mode!r}')
@@ -0,0 +1,206 @@
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+import parallel_gzip
+import record_file
+from backup_stream import iter_records, write_json_records
+import chapter_store
+from category_filter import choose_categories, count_categories, filter_category_ids, get_next_output_filename
+from extract_titles_and_folders import write_reports
+from chapter_store import ChapterColumns, ChapterStore, chapters_path
+from json_emitter import JSONEmitter
+from lazy_backup import open_backup
+from library import Library, load_emoji_map
+from library_index import IndexBuilder, LibraryIndex, index_path
+from metrics import Metrics
+from schema_registry import SchemaNotCached, backup_class
+from script_loader import load_script
+
+# Runs what the tachibk() shell function does with four processes in one:
+# the backup is decoded once and every stage works on the same in-memory model.
+
+STAGES = ('json', 'extract', 'stats', 'filter', 'encode')
+DEFAULT_STAGES = ('json', 'extract', 'stats')
+
+argp = ArgumentParser(description='Decode a backup once and run the report, filter and encode steps on it')
+argp.add_argument(
+    '--input',
+    '-i',
+    required=True,
+    metavar='<backup_file.tachibk | backup_file.proto.gz | backup_file.proto | records.tbkrec>',
+    type=Path,
+)
+argp.add_argument(
+    '--output',
+    '-o',
+    default='output/output.json',
+    metavar='<output.json | output.tbkrec>',
+    help='Where the json stage writes the decoded backup, TBKREC for a record file. Default: output/output.json',
+    type=Path,
+)
+argp.add_argument(
+    '--stages',
+    nargs='+',
+    default=DEFAULT_STAGES,
+    choices=STAGES,
+    metavar='<stage>',
+    help=f'Stages to run, always in the order {", ".join(STAGES)}. Default: {" ".join(DEFAULT_STAGES)}',
+)
+argp.add_argument(
+    '--encoded-output',
+    default='output/restored.tachibk',
+    metavar='<restored.tachibk | restored.tbkrec>',
+    help='Where the encode stage writes the (filtered) backup. Default: output/restored.tachibk',
+    type=Path,
+)
+argp.add_argument(
+    '--fork',
+    default='mihon',
+    metavar='<fork>',
+    help='Fork for the backup schema, record files name their own. Default: mihon',
+)
+argp.add_argument(
+    '--compression-level',
+    default=parallel_gzip.DEFAULT_LEVEL,
+    type=int,
+    choices=range(10),
+    metavar='<0-9>',
+    help='Gzip level for the encode stage. Default: 9',
+)
+argp.add_argument(
+    '--threads',
+    type=int,
+    metavar='<count>',
+    help='Threads used for gzip compression. Default: one per CPU',
+)
+argp.add_argument(
+    '--trace-memory',
+    action='store_true',
+    help='Record the tracemalloc peak of every stage. Slows the stages down',
+)
+argp.add_argument(
+    '--metrics-json',
+    type=Path,
+    metavar='<metrics.json>',
+    help='Write the time, CPU time and peak memory of every stage as JSON',
+)
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.fork = args.fork
+        if record_file.is_record_file(args.input):
+            # Record files name the schema they were written with
+            self.fork = record_file.read_fork(args.input)
+        self.message_type = backup_class(self.fork)
+        self.metrics = Metrics(args.trace_memory)
+        self.emoji_map = load_emoji_map()
+
+    @contextmanager
+    def stage(self, name: str):
+        print(f'\n▶️  {name}')
+        with self.metrics.stage(name) as stage:
+            yield stage
+        print(f'⏱️  {name}: {stage.wall_s:.2f}s')
+
+    def decode(self) -> None:
+        self.backup = open_backup(self.args.input, self.message_type)
+        self.message = self.message_type()
+        self.message.ParseFromString(self.backup.data)
+        self.index_builder = IndexBuilder(self.message_type, ChapterColumns())
+        self.index_builder.add_message(self.message, self.backup)
+        self.library = Library.from_index(LibraryIndex(self.index_builder.to_bytes()))
+        if chapter_store.numpy_available():
+            self.library.chapters = ChapterStore.from_columns(self.index_builder.chapters)
+        print(f'Decoded {len(self.library)} manga from "{self.args.input}"')
+
+    def write_json(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wt', buffering=1 << 20) as file:
+            write_json_records(iter_records(self.message), file, self.message_type, emitter=JSONEmitter())
+
+    def json(self) -> None:
+        if record_file.is_record_file(self.args.output):
+            # The payload as it was read, the other scripts index it themselves
+            record_file.write_records(self.args.output, self.fork, self.backup.data)
+            print(f'Record file written to "{self.args.output}"')
+            return
+        self.write_json(self.args.output)
+        self.index_builder.write(index_path(self.args.output), self.args.output)
+        self.index_builder.chapters.write(chapters_path(self.args.output), self.args.output)
+        print(f'Backup decoded to "{self.args.output}"')
+
+    def extract(self) -> None:
+        write_reports(self.library, self.emoji_map)
+
+    def stats(self) -> None:
+        counter = load_script('count_cleaned_output.json_.py', 'count_cleaned_output')
+        counter.print_stats(self.library, self.emoji_map)
+
+    def filter(self) -> None:
+        choice, selected_categories = choose_categories(count_categories(self.library), self.emoji_map)
+
+        # Edited in place, so the encode stage picks up the filtered library
+        kept = []
+        for manga in self.message.backupManga:
+            category_ids = filter_category_ids(
+                manga.categories, self.library.category_map, selected_categories, choice
+            )
+            if category_ids is None:
+                continue
+            manga.categories[:] = category_ids
+            kept.append(manga)
+        del self.message.backupManga[:]
+        self.message.backupManga.extend(kept)
+
+        used_category_ids = {category_id for manga in kept for category_id in manga.categories}
+        categories = [
+            category
+            for category in self.message.backupCategories
+            if category.HasField('order') and category.order in used_category_ids
+        ]
+        del self.message.backupCategories[:]
+        self.message.backupCategories.extend(categories)
+
+        output_file = Path(get_next_output_filename())
+        self.write_json(output_file)
+        print(f'Kept {len(kept)} of {len(self.library)} manga, cleaned data saved to "{output_file}"')
+
+    def encode(self) -> None:
+        output = self.args.encoded_output
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if record_file.is_record_file(output):
+            record_file.write_records(output, self.fork, self.message.SerializeToString())
+            print(f'Record file written to {output}')
+            return
+        with parallel_gzip.open(output, 'wb', self.args.compression_level, self.args.threads) as zip:
+            zip.write(self.message.SerializeToString())
+        print(f'Compressed backup written to {output}')
+
+    def run(self) -> None:
+        with self.stage('decode'):
+            self.decode()
+        for name in STAGES:
+            if name in self.args.stages:
+                with self.stage(name):
+                    getattr(self, name)()
+
+        self.metrics.print_table()
+        if self.args.metrics_json:
+            self.metrics.write(self.args.metrics_json, input=str(self.args.input), output=str(self.args.output))
+            print(f'Metrics written to "{self.args.metrics_json}"')
+
+
+if __name__ == '__main__':
+    args = argp.parse_args()
+    try:
+        pipeline = Pipeline(args)
+    except SchemaNotCached as e:
+        print(f'ERROR! {e}')
+        exit(1)
+    except (OSError, ValueError) as e:
+        print(f'ERROR! Could not read "{args.input}". {e}')
+        exit(1)
+    pipeline.run()
@@ -0,0 +1,103 @@
+import binascii
+from typing import Iterator
+
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+from google.protobuf.message import DecodeError, Message
+from google.protobuf.message_factory import GetMessageClass
+
+# A preference value is stored as its type name and the serialized
+# <Type>PreferenceValue message of the schema, e.g. IntPreferenceValue for
+# an Int. The codec parses truevalue with that message and turns it into
+# the message's JSON form ({"value": 5}), and serializes it the same way
+# when encoding, so a converted value becomes the same bytes again. Values
+# whose bytes wouldn't come back identical, and types the schema has no
+# message for, are left as they are (base64 in JSON).
+#
+# Older --convert-preferences output has the bare value instead of the
+# JSON form, those are encoded through the same messages. Bare values are
+# numbers, booleans and lists, except for String preferences, where a bare
+# "auto" can't be told from base64 by its text. A String value is only kept
+# as base64 when its bytes are a String message the decoder would have
+# converted, which real bare text isn't.
+
+TYPES = ('Int', 'Long', 'Float', 'String', 'Boolean', 'StringSet')
+
+
+def short_type(type_name: str) -> str:
+    # 'eu.kanade...IntPreferenceValue' -> 'Int'
+    return type_name.split('.')[-1].removesuffix('PreferenceValue')
+
+
+def is_base64(text: str) -> bool:
+    try:
+        binascii.a2b_base64(text, strict_mode=True)
+    except ValueError:  # binascii.Error, or text that isn't ASCII
+        return False
+    return True
+
+
+def iter_preferences(message_dict: dict) -> Iterator[dict]:
+    # The 'value' of every preference, app and source ones
+    for pref in message_dict.get('backupPreferences', []):
+        yield pref['value']
+    for source in message_dict.get('backupSourcePreferences', []):
+        for pref in source.get('prefs', []):
+            yield pref['value']
+
+
+class PreferenceCodec:
+    def __init__(self, message_type: type[Message]):
+        pool = message_type.DESCRIPTOR.file.pool
+        # short type name -> value message class
+        self.classes: dict[str, type[Message]] = {}
+        for name in TYPES:
+            try:
+                self.classes[name] = GetMessageClass(pool.FindMessageTypeByName(f'{name}PreferenceValue'))
+            except KeyError:
+                continue
+
+    def decode(self, type_name: str, raw: bytes) -> dict | None:
+        # JSON form of a serialized value, None if it can't be converted back exactly
+        cls = self.classes.get(short_type(type_name))
+        if cls is None:
+            return None
+        message = cls()
+        try:
+            message.MergeFromString(raw)
+        except DecodeError:
+            return None
+        if message.SerializePartialToString() != raw:
+            return None
+        return MessageToDict(message)
+
+    def encode(self, type_name: str, value) -> bytes:
+        cls = self.classes.get(short_type(type_name))
+        if cls is None:
+            raise ParseError(f'No message for preferences of type {type_name}')
+        if not isinstance(value, dict):
+            value = {'value': value}
+        return ParseDict(value, cls()).SerializePartialToString()
+
+    def is_raw(self, type_name: str, value) -> bool:
+        # True for the base64 bytes of an unconverted value
+        if not isinstance(value, str):
+            return False
+        if short_type(type_name) != 'String':
+            return True
+        # An empty string is a String value, the base64 of no bytes at all
+        # isn't what a backup holds for one (that's b'\n\x00')
+        return value != '' and is_base64(value) and self.decode(type_name, binascii.a2b_base64(value)) is not None
+
+    def decode_preferences(self, message_dict: dict) -> None:
+        for value in iter_preferences(message_dict):
+            # JSON holds bytes as base64
+            decoded = self.decode(value['type'], binascii.a2b_base64(value['truevalue']))
+            if decoded is not None:
+                value['truevalue'] = decoded
+
+    def encode_preferences(self, message_dict: dict) -> None:
+        for value in iter_preferences(message_dict):
+            true_value = value['truevalue']
+            if self.is_raw(value['type'], true_value):
+                continue
+            value['truevalue'] = binascii.b2a_base64(self.encode(value['type'], true_value), newline=False).decode()
@@ -0,0 +1,231 @@
+import base64
+import math
+import re
+from typing import Callable
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.json_format import ParseError
+from google.protobuf.message import Message
+
+# Builds protobuf messages straight from decoded JSON dicts, following the
+# rules (and error messages) of google.protobuf.json_format.ParseDict, but with
+# the per-field lookups and converters computed once per message descriptor.
+
+SCALAR, REPEATED_SCALAR, MESSAGE, REPEATED_MESSAGE = range(4)
+
+INT_RANGES = {
+    FieldDescriptor.CPPTYPE_INT32: (-(1 << 31), (1 << 31) - 1),
+    FieldDescriptor.CPPTYPE_INT64: (-(1 << 63), (1 << 63) - 1),
+    FieldDescriptor.CPPTYPE_UINT32: (0, (1 << 32) - 1),
+    FieldDescriptor.CPPTYPE_UINT64: (0, (1 << 64) - 1),
+}
+FLOAT_MAX = 3.4028234663852886e38
+UNPAIRED_SURROGATE_RE = re.compile(
+    '[\ud800-\udbff](?![\udc00-\udfff])|(?<![\ud800-\udbff])[\udc00-\udfff]'
+)
+
+plans: dict[Descriptor, dict[str, tuple]] = {}
+
+
+def convert_integer(value) -> int:
+    if isinstance(value, float) and not value.is_integer():
+        raise ParseError(f"Couldn't parse integer: {value}")
+    if isinstance(value, str) and value.find(' ') != -1:
+        raise ParseError(f'Couldn\'t parse integer: "{value}"')
+    if isinstance(value, bool):
+        raise ParseError(f'Bool value {value} is not acceptable for integer field')
+    try:
+        return int(value)
+    except ValueError as e:
+        try:
+            number = float(value)
+        except ValueError:
+            raise e
+        if not number.is_integer():
+            raise ParseError(f'Couldn\'t parse non-integer string: "{value}"') from e
+        return int(number)
+
+
+def integer_converter(low: int, high: int) -> Callable:
+    def convert(value) -> int:
+        number = value if type(value) is int else convert_integer(value)
+        if not low <= number <= high:
+            raise ValueError(f'Value out of range: {number}')
+        return number
+
+    return convert
+
+
+def float_converter(single: bool) -> Callable:
+    def convert(value) -> float:
+        if isinstance(value, float):
+            if math.isnan(value):
+                raise ParseError('Couldn\'t parse NaN, use quoted "NaN" instead')
+            if math.isinf(value):
+                if value > 0:
+                    raise ParseError(
+                        'Couldn\'t parse Infinity or value too large, use quoted "Infinity" instead'
+                    )
+                raise ParseError(
+                    'Couldn\'t parse -Infinity or value too small, use quoted "-Infinity" instead'
+                )
+            if single and value > FLOAT_MAX:
+                raise ParseError('Float value too large')
+            if single and value < -FLOAT_MAX:
+                raise ParseError('Float value too small')
+        if value == 'nan':
+            raise ParseError('Couldn\'t parse float "nan", use "NaN" instead')
+        try:
+            return float(value)
+        except ValueError as e:
+            match value:
+                case '-Infinity':
+                    return float('-inf')
+                case 'Infinity':
+                    return float('inf')
+                case 'NaN':
+                    return float('nan')
+            raise ParseError(f"Couldn't parse float: {value}") from e
+
+    return convert
+
+
+def convert_bool(value) -> bool:
+    if not isinstance(value, bool):
+        raise ParseError('Expected true or false without quotes')
+    return value
+
+
+def convert_string(value) -> str:
+    if UNPAIRED_SURROGATE_RE.search(value):
+        raise ParseError('Unpaired surrogate')
+    return value
+
+
+def convert_bytes(value) -> bytes:
+    encoded = value.encode('utf-8') if isinstance(value, str) else value
+    return base64.urlsafe_b64decode(encoded + b'=' * (4 - len(encoded) % 4))
+
+
+def enum_converter(field: FieldDescriptor) -> Callable:
+    enum_type = field.enum_type
+
+    def convert(value) -> int:
+        enum_value = enum_type.values_by_name.get(value)
+        if enum_value is None:
+            try:
+                number = int(value)
+            except ValueError as e:
+                raise ParseError(
+                    f'Invalid enum value {value} for enum type {enum_type.full_name}'
+                ) from e
+            enum_value = enum_type.values_by_number.get(number)
+            if enum_value is None:
+                if enum_type.is_closed:
+                    raise ParseError(
+                        f'Invalid enum value {value} for enum type {enum_type.full_name}'
+                    )
+                return number
+        return enum_value.number
+
+    return convert
+
+
+def scalar_converter(field: FieldDescriptor) -> Callable:
+    match field.cpp_type:
+        case cpp_type if cpp_type in INT_RANGES:
+            return integer_converter(*INT_RANGES[cpp_type])
+        case FieldDescriptor.CPPTYPE_FLOAT:
+            return float_converter(True)
+        case FieldDescriptor.CPPTYPE_DOUBLE:
+            return float_converter(False)
+        case FieldDescriptor.CPPTYPE_BOOL:
+            return convert_bool
+        case FieldDescriptor.CPPTYPE_ENUM:
+            return enum_converter(field)
+    return convert_bytes if field.type == FieldDescriptor.TYPE_BYTES else convert_string
+
+
+def plan(descriptor: Descriptor) -> dict[str, tuple]:
+    fields: dict[str, tuple] = {}
+    for field in descriptor.fields:
+        is_message = field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE
+        if field.is_repeated:
+            kind = REPEATED_MESSAGE if is_message else REPEATED_SCALAR
+        else:
+            kind = MESSAGE if is_message else SCALAR
+        entry = (
+            field.name,
+            kind,
+            None if is_message else scalar_converter(field),
+            field.message_type,
+        )
+        # json_format accepts both the camelCase JSON name and the proto name
+        fields[field.name] = fields[field.json_name] = entry
+    plans[descriptor] = fields
+    return fields
+
+
+def convert_message(descriptor: Descriptor, js: dict, path: str) -> dict:
+    if not isinstance(js, dict):
+        raise ParseError(f'Expected a JSON object for {descriptor.full_name} at {path}')
+    fields = plans.get(descriptor) or plan(descriptor)
+    kwargs = {}
+    for name, value in js.items():
+        entry = fields.get(name)
+        if entry is None:
+            raise ParseError(
+                f'Message type "{descriptor.full_name}" has no field named "{name}" at "{path}".\n'
+                f' Available Fields(except extensions): "{[f.json_name for f in descriptor.fields]}"'
+            )
+        field_name, kind, convert, message_type = entry
+        if value is None:
+            kwargs.pop(field_name, None)
+            continue
+        try:
+            if kind == SCALAR:
+                try:
+                    kwargs[field_name] = convert(value)
+                except ParseError as e:
+                    raise ParseError(f'{e} at {path}.{name}') from e
+            elif kind == REPEATED_SCALAR:
+                if not isinstance(value, list):
+                    raise ParseError(
+                        f'repeated field {name} must be in [] which is {value} at {path}'
+                    )
+                items = []
+                for index, item in enumerate(value):
+                    item_path = f'{path}.{name}[{index}]'
+                    if item is None:
+                        raise ParseError(
+                            f'null is not allowed to be used as an element in a repeated field at {item_path}'
+                        )
+                    try:
+                        items.append(convert(item))
+                    except ParseError as e:
+                        raise ParseError(f'{e} at {item_path}') from e
+                kwargs[field_name] = items
+            elif kind == MESSAGE:
+                kwargs[field_name] = convert_message(message_type, value, f'{path}.{name}')
+            else:
+                if not isinstance(value, list):
+                    raise ParseError(
+                        f'repeated field {name} must be in [] which is {value} at {path}'
+                    )
+                items = []
+                for index, item in enumerate(value):
+                    item_path = f'{path}.{name}[{index}]'
+                    if item is None:
+                        raise ParseError(
+                            f'null is not allowed to be used as an element in a repeated field at {item_path}'
+                        )
+                    items.append(convert_message(message_type, item, item_path))
+                kwargs[field_name] = items
+        except (ParseError, ValueError, TypeError) as e:
+            raise ParseError(f'Failed to parse {name} field: {e}.') from e
+    return kwargs
+
+
+def build_message(message_type: type[Message], js: dict, path: str | None = None) -> Message:
+    descriptor = message_type.DESCRIPTOR
+    return message_type(**convert_message(descriptor, js, path or descriptor.name))
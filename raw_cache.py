@@ -0,0 +1,56 @@
+import hashlib
+import mmap
+import os
+from pathlib import Path
+
+# Decompressed backup payloads, kept only with --keep-raw and named after the
+# SHA-256 of the compressed file, so decoding the same backup again can map
+# the payload from disk instead of running gunzip.
+RAW_CACHE_DIR = Path('manga/proto/raw')
+
+
+def file_digest(path: str | Path) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+def cached_path(digest: str) -> Path:
+    return RAW_CACHE_DIR / f'{digest}.raw'
+
+
+def map_file(path: str | Path) -> memoryview:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b'')
+        # The mapping stays valid after the file is closed
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def lookup(digest: str) -> Path | None:
+    path = cached_path(digest)
+    return path if path.is_file() else None
+
+
+def store(digest: str, data) -> Path:
+    RAW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = cached_path(digest)
+    partial = path.with_suffix('.part')
+    with open(partial, 'wb') as file:
+        file.write(data)
+    os.replace(partial, path)
+    return path
+
+
+def store_stream(digest: str, stream, chunk_size: int = 1 << 20) -> Path:
+    RAW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = cached_path(digest)
+    partial = path.with_suffix('.part')
+    with open(partial, 'wb') as file:
+        while chunk := stream.read(chunk_size):
+            file.write(chunk)
+    os.replace(partial, path)
+    return path
+
+
+def has_entries() -> bool:
+    return RAW_CACHE_DIR.is_dir() and any(RAW_CACHE_DIR.glob('*.raw'))
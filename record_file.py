@@ -0,0 +1,86 @@
+import struct
+from pathlib import Path
+
+import raw_cache
+
+# Binary alternative to output.json for passing a library between the
+# scripts. A record file is a short header naming the fork, followed by the
+# backup payload as it is: one length-prefixed protobuf record per manga,
+# category, source and so on. So converting from a backup is gunzip and a
+# copy, converting back is gzip, and reading one maps the file and indexes
+# the records (see LazyBackup) without parsing anything up front.
+#
+#   magic         TBKREC01
+#   fork length   uint16, little endian
+#   fork          UTF-8, e.g. mihon, picks the schema the records are read with
+#   payload       the decompressed Backup message
+#
+# JSON stays the format to read or edit by hand.
+
+SUFFIX = '.tbkrec'
+MAGIC = b'TBKREC01'
+HEADER = struct.Struct('<8sH')
+
+
+def is_record_file(path: str | Path) -> bool:
+    return str(path).endswith(SUFFIX)
+
+
+def header(fork: str) -> bytes:
+    name = fork.encode()
+    return HEADER.pack(MAGIC, len(name)) + name
+
+
+def read_header(data) -> tuple[str, int]:
+    # (fork, offset of the payload)
+    if len(data) < HEADER.size:
+        raise ValueError('Not a record file')
+    magic, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a record file')
+    return str(data[HEADER.size : HEADER.size + size], 'utf-8'), HEADER.size + size
+
+
+def read_stream_header(file) -> str:
+    # The fork, leaves the file at the start of the payload
+    start = file.read(HEADER.size)
+    if len(start) < HEADER.size:
+        raise ValueError('Not a record file')
+    magic, size = HEADER.unpack(start)
+    if magic != MAGIC:
+        raise ValueError('Not a record file')
+    return str(file.read(size), 'utf-8')
+
+
+def read_fork(path: str | Path) -> str:
+    with open(path, 'rb') as file:
+        return read_stream_header(file)
+
+
+def map_payload(path: str | Path) -> memoryview:
+    data = raw_cache.map_file(path)
+    return data[read_header(data)[1] :]
+
+
+def open_payload(path: str | Path):
+    # The payload as a stream, for the readers that go record by record
+    file = open(path, 'rb', buffering=1 << 20)
+    try:
+        read_stream_header(file)
+    except ValueError:
+        file.close()
+        raise
+    return file
+
+
+def open_writer(path: str | Path, fork: str):
+    # The payload is written to the returned file
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    file = open(path, 'wb', buffering=1 << 20)
+    file.write(header(fork))
+    return file
+
+
+def write_records(path: str | Path, fork: str, payload) -> None:
+    with open_writer(path, fork) as file:
+        file.write(payload)
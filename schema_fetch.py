@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from schema_registry import SchemaNotCached
+
+# On-disk cache for the Kotlin backup models the schema is generated from.
+# Everything is keyed by the commit SHA the fork's default branch points at:
+# a model listing or file fetched for a SHA never changes, so only the
+# "which commit is HEAD" lookup goes to the network, revalidated with its
+# ETag (GitHub answers 304 without counting it against the rate limit).
+#
+# manga/proto/cache/
+#   http/<url hash>.json          ETag and body of revalidated requests
+#   <owner>_<repo>/HEAD           last SHA seen, used in offline mode
+#   <owner>_<repo>/<sha>/files.json
+#   <owner>_<repo>/<sha>/models/<path below the models directory>
+
+API_URL = 'https://api.github.com'
+MODELS_PATH = 'app/src/main/java/eu/kanade/tachiyomi/data/backup/models'
+CACHE_DIR = Path('manga/proto/cache')
+WORKERS = 8
+TIMEOUT = 30
+
+
+class SchemaCacheMiss(SchemaNotCached):
+    # Offline and the models aren't in the cache
+    pass
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+    partial.write_bytes(data)
+    os.replace(partial, path)
+
+
+class SchemaFetcher:
+    def __init__(
+        self,
+        cache_dir: str | Path = CACHE_DIR,
+        offline: bool = False,
+        workers: int = WORKERS,
+        api_url: str = API_URL,
+        session: requests.Session | None = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.offline = offline
+        self.workers = workers
+        self.api_url = api_url.rstrip('/')
+        if session is None:
+            # One keep-alive connection per worker thread
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            if token := os.environ.get('GITHUB_TOKEN'):
+                session.headers['Authorization'] = f'Bearer {token}'
+        self.session = session
+
+    def repo_dir(self, repo: str) -> Path:
+        return self.cache_dir / repo.replace('/', '_')
+
+    def request(self, url: str, headers: dict | None = None) -> requests.Response:
+        response = self.session.get(url, headers=headers, timeout=TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def revalidate(self, url: str, headers: dict | None = None) -> bytes:
+        # GET with If-None-Match against the copy from the last run
+        entry_path = self.cache_dir / 'http' / f'{hashlib.sha256(url.encode()).hexdigest()[:32]}.json'
+        entry = json.loads(entry_path.read_text()) if entry_path.is_file() else None
+        if self.offline:
+            if entry is None:
+                raise SchemaCacheMiss(f'{url} is not cached')
+            return entry['body'].encode()
+        headers = dict(headers or {})
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        response = self.request(url, headers)
+        if response.status_code == 304:
+            return entry['body'].encode()
+        entry = {'url': url, 'etag': response.headers.get('ETag'), 'body': response.text}
+        write_atomic(entry_path, json.dumps(entry).encode())
+        return response.content
+
+    def commit_sha(self, repo: str) -> str:
+        head_path = self.repo_dir(repo) / 'HEAD'
+        if self.offline:
+            if not head_path.is_file():
+                raise SchemaCacheMiss(f'No cached schema for {repo}')
+            return head_path.read_text().strip()
+        sha = self.revalidate(
+            f'{self.api_url}/repos/{repo}/commits/HEAD', {'Accept': 'application/vnd.github.sha'}
+        ).decode().strip()
+        write_atomic(head_path, sha.encode())
+        return sha
+
+    def list_models(self, repo: str, sha: str) -> list[tuple[str, str]]:
+        listing_path = self.repo_dir(repo) / sha / 'files.json'
+        if listing_path.is_file():
+            return [tuple(entry) for entry in json.loads(listing_path.read_text())]
+        if self.offline:
+            raise SchemaCacheMiss(f'No cached model listing for {repo}@{sha}')
+        files: list[tuple[str, str]] = []
+        git = self.request(f'{self.api_url}/repos/{repo}/contents/{MODELS_PATH}?ref={sha}').json()
+        for entry in git:
+            if entry.get('type') == 'file':
+                files.append((entry.get('name'), entry.get('download_url')))
+            elif entry.get('type') == 'dir':
+                for sub_entry in self.request(entry.get('url')).json():
+                    if sub_entry.get('type') == 'file':
+                        files.append((sub_entry.get('name'), sub_entry.get('download_url')))
+        write_atomic(listing_path, json.dumps(files).encode())
+        return files
+
+    def model(self, repo: str, sha: str, name: str, url: str) -> str:
+        # Files in subdirectories can share a name with top-level ones
+        _, found, relative = url.partition(f'{MODELS_PATH}/')
+        path = self.repo_dir(repo) / sha / 'models' / (relative if found else name)
+        if path.is_file():
+            return path.read_text(encoding='utf-8')
+        if self.offline:
+            raise SchemaCacheMiss(f'{name} of {repo}@{sha} is not cached')
+        data = self.request(url).content
+        write_atomic(path, data)
+        return data.decode('utf-8')
+
+    def fetch_models(self, repo: str) -> list[tuple[str, str]]:
+        # (file name, Kotlin source) of every backup model, in listing order
+        try:
+            sha = self.commit_sha(repo)
+        except requests.RequestException as e:
+            head_path = self.repo_dir(repo) / 'HEAD'
+            if not head_path.is_file():
+                raise
+            # Cached listings and models are used as is, no network needed
+            print(f'... {e.__class__.__name__} while checking {repo}, using the cached schema')
+            sha = head_path.read_text().strip()
+        files = self.list_models(repo, sha)
+        with ThreadPoolExecutor(self.workers) as pool:
+            sources = list(pool.map(lambda file: self.model(repo, sha, *file), files))
+        return [(name, source) for (name, _), source in zip(files, sources)]
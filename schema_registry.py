@@ -0,0 +1,224 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Callable
+
+from google.protobuf import descriptor_pb2, descriptor_pool
+from google.protobuf.message import DecodeError, Message
+from google.protobuf.message_factory import GetMessageClass
+
+# Message classes for every fork without protoc: the generated .proto text is
+# parsed straight into a FileDescriptorProto and loaded into a descriptor pool
+# of its own (the forks share message names). The FileDescriptorSet is kept
+# in manga/proto/registry/<fork>.pb, so picking a fork later is one small
+# file read. <fork>.sha256 holds the hash of the .proto text it was built
+# from, the bundled schema.proto is rebuilt into the registry once it changes.
+
+REGISTRY_DIR = Path('manga/proto/registry')
+BUNDLED_PROTO = Path('manga/proto/schema.proto')
+FILE_NAME = 'schema.proto'
+
+FieldProto = descriptor_pb2.FieldDescriptorProto
+SCALAR_TYPES = {
+    'double': FieldProto.TYPE_DOUBLE,
+    'float': FieldProto.TYPE_FLOAT,
+    'int32': FieldProto.TYPE_INT32,
+    'int64': FieldProto.TYPE_INT64,
+    'uint32': FieldProto.TYPE_UINT32,
+    'uint64': FieldProto.TYPE_UINT64,
+    'sint32': FieldProto.TYPE_SINT32,
+    'sint64': FieldProto.TYPE_SINT64,
+    'fixed32': FieldProto.TYPE_FIXED32,
+    'fixed64': FieldProto.TYPE_FIXED64,
+    'sfixed32': FieldProto.TYPE_SFIXED32,
+    'sfixed64': FieldProto.TYPE_SFIXED64,
+    'bool': FieldProto.TYPE_BOOL,
+    'string': FieldProto.TYPE_STRING,
+    'bytes': FieldProto.TYPE_BYTES,
+}
+LABELS = {
+    'required': FieldProto.LABEL_REQUIRED,
+    'optional': FieldProto.LABEL_OPTIONAL,
+    'repeated': FieldProto.LABEL_REPEATED,
+}
+TOKEN_RE = re.compile(r'\s+|//[^\n]*|(?P<token>"[^"]*"|-?\d+|[A-Za-z_][\w.]*|[{}=;])')
+
+
+class SchemaNotCached(LookupError):
+    pass
+
+
+def tokenize(text: str) -> list[tuple[str, int]]:
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match:
+            line = text.count('\n', 0, pos) + 1
+            raise ValueError(f'Unexpected {text[pos]!r} on line {line} of the schema')
+        if match['token']:
+            tokens.append((match['token'], text.count('\n', 0, pos) + 1))
+        pos = match.end()
+    return tokens
+
+
+def parse_proto(text: str, name: str = FILE_NAME) -> descriptor_pb2.FileDescriptorProto:
+    # Covers what proto_gen writes: proto2 syntax, top-level enums and messages
+    # with labelled scalar, enum or message fields
+    tokens = tokenize(text)
+    pos = 0
+
+    def take(expected: str | None = None) -> str:
+        nonlocal pos
+        if pos >= len(tokens):
+            raise ValueError('Unexpected end of the schema')
+        token, line = tokens[pos]
+        if expected is not None and token != expected:
+            raise ValueError(f'Expected {expected!r} but found {token!r} on line {line} of the schema')
+        pos += 1
+        return token
+
+    def number() -> int:
+        token, line = tokens[pos] if pos < len(tokens) else ('', 0)
+        if not token.lstrip('-').isdigit():
+            raise ValueError(f'Expected a number but found {token!r} on line {line} of the schema')
+        return int(take())
+
+    file = descriptor_pb2.FileDescriptorProto(name=name)
+    field_types: list[tuple[FieldProto, str, int]] = []
+    while pos < len(tokens):
+        match take():
+            case 'syntax':
+                take('=')
+                syntax = take().strip('"')
+                take(';')
+                # protoc leaves the field unset for proto2
+                if syntax != 'proto2':
+                    file.syntax = syntax
+            case 'package':
+                file.package = take()
+                take(';')
+            case 'enum':
+                enum = file.enum_type.add(name=take())
+                take('{')
+                while pos < len(tokens) and tokens[pos][0] != '}':
+                    value = enum.value.add(name=take())
+                    take('=')
+                    value.number = number()
+                    take(';')
+                take('}')
+            case 'message':
+                message = file.message_type.add(name=take())
+                take('{')
+                while pos < len(tokens) and tokens[pos][0] != '}':
+                    label, line = tokens[pos]
+                    if label not in LABELS:
+                        raise ValueError(f'Expected a field label but found {label!r} on line {line} of the schema')
+                    take()
+                    field_type = take()
+                    field = message.field.add(label=LABELS[label], name=take())
+                    take('=')
+                    field.number = number()
+                    take(';')
+                    field_types.append((field, field_type, line))
+                take('}')
+            case token:
+                raise ValueError(f'Unexpected {token!r} on line {tokens[pos - 1][1]} of the schema')
+
+    prefix = f'.{file.package}.' if file.package else '.'
+    enums = {enum.name for enum in file.enum_type}
+    messages = {message.name for message in file.message_type}
+    for field, field_type, line in field_types:
+        if field_type in SCALAR_TYPES:
+            field.type = SCALAR_TYPES[field_type]
+        elif field_type in enums:
+            field.type = FieldProto.TYPE_ENUM
+            field.type_name = prefix + field_type
+        elif field_type in messages:
+            field.type = FieldProto.TYPE_MESSAGE
+            field.type_name = prefix + field_type
+        else:
+            raise ValueError(f'Unknown type {field_type!r} for field {field.name!r} on line {line} of the schema')
+    return file
+
+
+class SchemaRegistry:
+    def __init__(self, cache_dir: str | Path = REGISTRY_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.pools: dict[str, descriptor_pool.DescriptorPool] = {}
+
+    def path(self, fork: str) -> Path:
+        return self.cache_dir / f'{fork}.pb'
+
+    def source_path(self, fork: str) -> Path:
+        return self.cache_dir / f'{fork}.sha256'
+
+    def source_hash(self, fork: str) -> str | None:
+        try:
+            return self.source_path(fork).read_text().strip()
+        except OSError:
+            return None
+
+    def cached(self, fork: str) -> descriptor_pb2.FileDescriptorSet | None:
+        try:
+            return descriptor_pb2.FileDescriptorSet.FromString(self.path(fork).read_bytes())
+        except (OSError, DecodeError):
+            return None
+
+    def store(self, fork: str, proto_text: str) -> descriptor_pb2.FileDescriptorSet:
+        descriptor_set = descriptor_pb2.FileDescriptorSet(file=[parse_proto(proto_text)])
+        path = self.path(fork)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix('.pb.part')
+        partial.write_bytes(descriptor_set.SerializeToString())
+        os.replace(partial, path)
+        self.source_path(fork).write_text(text_hash(proto_text))
+        self.pools.pop(fork, None)
+        return descriptor_set
+
+    def pool(self, fork: str, generate: Callable[[str], str] | None = None) -> descriptor_pool.DescriptorPool:
+        # generate(fork) returns the .proto text, called when the fork isn't cached
+        if fork in self.pools:
+            return self.pools[fork]
+        descriptor_set = self.cached(fork)
+        bundled = bundled_text(fork)
+        if bundled is not None and (descriptor_set is None or self.source_hash(fork) != text_hash(bundled)):
+            descriptor_set = self.store(fork, bundled)
+        elif descriptor_set is None:
+            if generate is None:
+                raise SchemaNotCached(f'No cached schema for {fork}')
+            descriptor_set = self.store(fork, generate(fork))
+        pool = descriptor_pool.DescriptorPool()
+        for file in descriptor_set.file:
+            pool.Add(file)
+        self.pools[fork] = pool
+        return pool
+
+    def message_class(
+        self, fork: str, name: str = 'Backup', generate: Callable[[str], str] | None = None
+    ) -> type[Message]:
+        return GetMessageClass(self.pool(fork, generate).FindMessageTypeByName(name))
+
+
+def text_hash(proto_text: str) -> str:
+    return hashlib.sha256(proto_text.encode()).hexdigest()
+
+
+def bundled_text(fork: str) -> str | None:
+    # mihon's schema ships with the repository
+    if fork == 'mihon' and BUNDLED_PROTO.is_file():
+        return BUNDLED_PROTO.read_text()
+    return None
+
+
+def bundled_schema(fork: str) -> str:
+    # generate() for the tools that don't download models, other forks must
+    # be in the registry already
+    if (text := bundled_text(fork)) is not None:
+        return text
+    raise SchemaNotCached(f'No cached schema for {fork}, decode a backup with tachibk-converter.py --fork {fork} first')
+
+
+def backup_class(fork: str = 'mihon') -> type[Message]:
+    return SchemaRegistry().message_class(fork, generate=bundled_schema)
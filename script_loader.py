@@ -0,0 +1,16 @@
+import importlib.util
+from pathlib import Path
+
+# The scripts whose file names aren't valid module names (tachibk-converter.py,
+# count_cleaned_output.json_.py) are loaded from their path. They keep their
+# work under __main__, so loading one only defines its functions.
+
+ROOT = Path(__file__).resolve().parent
+
+
+def load_script(path: str, name: str):
+    # path is relative to the repository, whatever the working directory
+    spec = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import sqlite3
+
+    from google.protobuf.message import Message
+
+# Loads a backup into a SQLite database with one table per kind of record,
+# so a library can be queried with SQL instead of walking the JSON:
+#
+#   manga             one row per backupManga, manga_id is its position in the backup
+#   manga_categories  (manga_id, category_key) for each category id of a manga
+#   chapters          per manga chapter, with the read flag
+#   tracking          per manga tracker entry
+#   history           per manga read history
+#   categories        keyed by their order, which the manga's category ids point at
+#   sources           source id -> name
+#
+# Columns are named like the backup fields (and the JSON keys). Fields the
+# backup doesn't set are NULL, fields the fork's schema doesn't have too.
+#
+# Everything is inserted with executemany in batches inside one transaction,
+# and the indexes are created once the rows are in, which is much faster
+# than keeping them up to date on every insert.
+#
+# sqlite3 is only imported by export_backup and connect: the entry points
+# import this module for is_sqlite_file, and loading sqlite3 with it was one
+# of their largest import costs.
+
+SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+BATCH_ROWS = 20_000
+
+# (column, SQL type), the column is the backup field of the same name
+MANGA_COLUMNS = (
+    ('source', 'INTEGER'),
+    ('url', 'TEXT'),
+    ('title', 'TEXT'),
+    ('artist', 'TEXT'),
+    ('author', 'TEXT'),
+    ('description', 'TEXT'),
+    ('genre', 'TEXT'),
+    ('status', 'INTEGER'),
+    ('thumbnailUrl', 'TEXT'),
+    ('dateAdded', 'INTEGER'),
+    ('favorite', 'INTEGER'),
+    ('lastModifiedAt', 'INTEGER'),
+    ('favoriteModifiedAt', 'INTEGER'),
+    ('version', 'INTEGER'),
+    ('notes', 'TEXT'),
+)
+CHAPTER_COLUMNS = (
+    ('url', 'TEXT'),
+    ('name', 'TEXT'),
+    ('scanlator', 'TEXT'),
+    ('read', 'INTEGER'),
+    ('bookmark', 'INTEGER'),
+    ('lastPageRead', 'INTEGER'),
+    ('dateFetch', 'INTEGER'),
+    ('dateUpload', 'INTEGER'),
+    ('chapterNumber', 'REAL'),
+    ('sourceOrder', 'INTEGER'),
+    ('lastModifiedAt', 'INTEGER'),
+    ('version', 'INTEGER'),
+)
+TRACKING_COLUMNS = (
+    ('syncId', 'INTEGER'),
+    ('libraryId', 'INTEGER'),
+    ('mediaId', 'INTEGER'),
+    ('trackingUrl', 'TEXT'),
+    ('title', 'TEXT'),
+    ('lastChapterRead', 'REAL'),
+    ('totalChapters', 'INTEGER'),
+    ('score', 'REAL'),
+    ('status', 'INTEGER'),
+    ('startedReadingDate', 'INTEGER'),
+    ('finishedReadingDate', 'INTEGER'),
+    ('private', 'INTEGER'),
+)
+HISTORY_COLUMNS = (
+    ('url', 'TEXT'),
+    ('lastRead', 'INTEGER'),
+    ('readDuration', 'INTEGER'),
+)
+CATEGORY_COLUMNS = (
+    ('id', 'INTEGER'),
+    ('name', 'TEXT'),
+    ('flags', 'INTEGER'),
+)
+
+
+def columns_sql(columns: tuple[tuple[str, str], ...]) -> str:
+    return ', '.join(f'"{name}" {sql_type}' for name, sql_type in columns)
+
+
+SCHEMA = f'''
+CREATE TABLE manga (manga_id INTEGER PRIMARY KEY, {columns_sql(MANGA_COLUMNS)});
+CREATE TABLE manga_categories (manga_id INTEGER NOT NULL, category_key INTEGER NOT NULL);
+CREATE TABLE chapters (manga_id INTEGER NOT NULL, {columns_sql(CHAPTER_COLUMNS)});
+CREATE TABLE tracking (manga_id INTEGER NOT NULL, {columns_sql(TRACKING_COLUMNS)});
+CREATE TABLE history (manga_id INTEGER NOT NULL, {columns_sql(HISTORY_COLUMNS)});
+CREATE TABLE categories (category_key INTEGER PRIMARY KEY, {columns_sql(CATEGORY_COLUMNS)});
+CREATE TABLE sources (source_id INTEGER PRIMARY KEY, name TEXT);
+'''
+
+INDEXES = '''
+CREATE INDEX manga_source_url ON manga (source, url);
+CREATE INDEX manga_categories_category ON manga_categories (category_key, manga_id);
+CREATE INDEX chapters_read ON chapters (manga_id, "read");
+CREATE INDEX tracking_manga ON tracking (manga_id);
+CREATE INDEX history_manga ON history (manga_id);
+'''
+
+
+def is_sqlite_file(path: str | Path) -> bool:
+    return str(path).endswith(SUFFIXES)
+
+
+def insert_sql(table: str, columns: tuple[tuple[str, str], ...], key: str = 'manga_id', verb: str = 'INSERT') -> str:
+    names = ', '.join(f'"{name}"' for name, _ in columns)
+    return f'{verb} INTO {table} ({key}, {names}) VALUES ({", ".join("?" * (len(columns) + 1))})'
+
+
+class RowReader:
+    # Turns messages of one type into rows, the same field order as the columns.
+    # ListFields only returns the fields that are set, in one call, which is
+    # what makes the unset ones NULL
+    def __init__(self, message_type, columns: tuple[tuple[str, str], ...]):
+        fields = message_type.fields_by_name
+        self.names = [name for name, _ in columns]
+        # Only genre, kept the way the apps show it
+        self.joined = [
+            position + 1 for position, name in enumerate(self.names) if name in fields and fields[name].is_repeated
+        ]
+
+    def row(self, key: int, message: Message) -> list:
+        values = {field.name: value for field, value in message.ListFields()}
+        row = [key, *map(values.get, self.names)]
+        for position in self.joined:
+            if row[position] is not None:
+                row[position] = ', '.join(row[position])
+        return row
+
+
+class Batches:
+    # executemany per table, every BATCH_ROWS rows
+    def __init__(self, connection: sqlite3.Connection, batch_rows: int = BATCH_ROWS):
+        self.connection = connection
+        self.batch_rows = batch_rows
+        self.rows: dict[str, list] = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, sql: str, rows: list) -> None:
+        pending = self.rows.setdefault(sql, [])
+        pending.extend(rows)
+        if len(pending) >= self.batch_rows:
+            self.flush(sql)
+
+    def flush(self, sql: str | None = None) -> None:
+        for statement in [sql] if sql else list(self.rows):
+            rows = self.rows.pop(statement, [])
+            if rows:
+                self.connection.executemany(statement, rows)
+                table = statement.split(' INTO ', 1)[1].split()[0]
+                self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+
+def write_rows(connection: sqlite3.Connection, backup) -> dict[str, int]:
+    # backup is a LazyBackup, its manga are parsed one at a time
+    from backup_stream import MANGA_FIELD
+
+    manga_type = backup.fields[MANGA_FIELD].message_type
+    manga_rows = RowReader(manga_type, MANGA_COLUMNS)
+    chapter_rows = RowReader(manga_type.fields_by_name['chapters'].message_type, CHAPTER_COLUMNS)
+    tracking_rows = RowReader(manga_type.fields_by_name['tracking'].message_type, TRACKING_COLUMNS)
+    history_rows = RowReader(manga_type.fields_by_name['history'].message_type, HISTORY_COLUMNS)
+    manga_sql = insert_sql('manga', MANGA_COLUMNS)
+    category_link_sql = 'INSERT INTO manga_categories (manga_id, category_key) VALUES (?, ?)'
+    chapter_sql = insert_sql('chapters', CHAPTER_COLUMNS)
+    tracking_sql = insert_sql('tracking', TRACKING_COLUMNS)
+    history_sql = insert_sql('history', HISTORY_COLUMNS)
+
+    batches = Batches(connection)
+    for manga_id, manga in enumerate(backup):
+        batches.add(manga_sql, [manga_rows.row(manga_id, manga)])
+        batches.add(category_link_sql, [(manga_id, key) for key in manga.categories])
+        batches.add(chapter_sql, [chapter_rows.row(manga_id, chapter) for chapter in manga.chapters])
+        batches.add(tracking_sql, [tracking_rows.row(manga_id, track) for track in manga.tracking])
+        batches.add(history_sql, [history_rows.row(manga_id, entry) for entry in manga.history])
+
+    categories = backup.categories()
+    if categories:
+        category_rows = RowReader(categories[0].DESCRIPTOR, CATEGORY_COLUMNS)
+        # The order, or the position when a category has none, like library.category_names.
+        # A later category with the same order replaces the earlier one there too
+        batches.add(
+            insert_sql('categories', CATEGORY_COLUMNS, 'category_key', 'INSERT OR REPLACE'),
+            [
+                category_rows.row(category.order if category.HasField('order') else index, category)
+                for index, category in enumerate(categories)
+            ],
+        )
+    batches.add(
+        'INSERT OR REPLACE INTO sources (source_id, name) VALUES (?, ?)',
+        [(source.sourceId, source.name if source.HasField('name') else None) for source in backup.sources()],
+    )
+    batches.flush()
+    return batches.counts
+
+
+def export_backup(backup, path: str | Path) -> dict[str, int]:
+    # Rows written per table. The database is built next to path and moved
+    # over it at the end, an existing file is replaced
+    import sqlite3
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f'{path.name}.part-{os.getpid()}')
+    partial.unlink(missing_ok=True)
+    connection = sqlite3.connect(partial, isolation_level=None)
+    try:
+        # Nothing to recover if the export is interrupted, the partial file is dropped
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('BEGIN')
+        # executescript would commit the transaction first, hence one statement at a time
+        for statement in SCHEMA.strip().split(';\n'):
+            connection.execute(statement)
+        counts = write_rows(connection, backup)
+        for statement in INDEXES.strip().split(';\n'):
+            connection.execute(statement)
+        connection.execute('COMMIT')
+        connection.execute('ANALYZE')
+    except BaseException:
+        connection.close()
+        partial.unlink(missing_ok=True)
+        raise
+    connection.close()
+    os.replace(partial, path)
+    return counts
+
+
+def connect(path: str | Path) -> sqlite3.Connection:
+    # Read only, so a missing file is an error instead of a new empty database
+    import sqlite3
+
+    return sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True)
+
+
+def iter_summaries(connection: sqlite3.Connection) -> Iterator[tuple]:
+    # (manga_id, title, extension, read chapters, total chapters), in backup order,
+    # the extension named like library.extension_name. Both counts come from the chapters_read index without reading the table
+    return connection.execute('''
+        SELECT m.manga_id,
+               m.title,
+               CASE WHEN s.source_id IS NULL THEN 'Unknown (' || COALESCE(m.source, '') || ')'
+                    ELSE COALESCE(s.name, 'Unknown') END,
+               (SELECT COUNT(*) FROM chapters c WHERE c.manga_id = m.manga_id AND c."read"),
+               (SELECT COUNT(*) FROM chapters c WHERE c.manga_id = m.manga_id)
+        FROM manga m
+        LEFT JOIN sources s ON s.source_id = m.source
+        ORDER BY m.manga_id
+    ''')
+
+
+def category_keys(connection: sqlite3.Connection) -> dict[int, list[int]]:
+    # manga_id -> its category ids, in the order of the backup
+    keys: dict[int, list[int]] = {}
+    for manga_id, key in connection.execute('SELECT manga_id, category_key FROM manga_categories ORDER BY rowid'):
+        keys.setdefault(manga_id, []).append(key)
+    return keys
+
+
+def category_map(connection: sqlite3.Connection) -> dict[int, str]:
+    return {
+        key: name if name is not None else 'Uncategorized'
+        for key, name in connection.execute('SELECT category_key, name FROM categories ORDER BY rowid')
+    }
@@ -1,22 +1,33 @@
+from __future__ import annotations
+
 __version__ = "1.2.1"
 
-import gzip
 import re
-import varint
-from argparse import ArgumentParser
-from base64 import b64decode, b64encode
-from json import dumps, loads
+from argparse import ArgumentParser, Namespace
+from functools import cache
+from json import JSONDecodeError, dumps, loads
 from pathlib import Path
-from requests import get
-from struct import pack, unpack
-from subprocess import run
-from google.protobuf.json_format import (
-    Parse,
-    ParseError,
-    MessageToDict,
-)
-import sys
-sys.path.insert(0, './manga/proto')
+from typing import TYPE_CHECKING
+
+import parallel_gzip
+import raw_cache
+import record_file
+import sqlite_export
+from metrics import Metrics
+
+if TYPE_CHECKING:
+    from google.protobuf.message import Message
+
+    from json_emitter import JSONEmitter
+    from library_index import IndexBuilder
+    from preference_codec import PreferenceCodec
+    from schema_fetch import SchemaFetcher
+
+# Only the standard library is imported up front, so --help and argument
+# errors come back right away. protobuf and the JSON/index writers are
+# imported by the code that uses them, requests only when a schema has to be
+# downloaded.
+
 FORKS = {
     'mihon': 'mihonapp/mihon',
     'sy': 'jobobby04/TachiyomiSY',
@@ -36,59 +47,152 @@ DATA_TYPES = {
     'Char': 'string',
 }
 
-argp = ArgumentParser()
-argp.add_argument(
-    '--input',
-    '-i',
-    metavar='<backup_file.tachibk | backup_file.proto.gz | decoded_backup.json>',
-    help='File extension defines whether to decode a backup file to JSON or encode it back',
-    type=Path,
-)
-argp.add_argument(
-    '--output',
-    '-o',
-    default='output.json',
-    metavar='<output.json | encoded_backup.tachibk>',
-    help='When encoding, TACHIBK or PROTO.GZ will additionally recompress the backup file',
-    type=Path,
-)
-argp.add_argument(
-    '--fork',
-    default=list(FORKS.keys())[0],
-    choices=FORKS.keys(),
-    metavar=f'<{" | ".join(FORKS.keys())}>',
-    help='Fork for the backup schema. Default: mihon',
-)
-argp.add_argument(
-    '--dump-schemas',
-    action='store_true',
-    help='Dump protobuf schemas from all supported forks',
-)
-argp.add_argument(
-    '--convert-preferences',
-    action='store_true',
-    help='Convert the preference values into human-readable format.\n[EXPERIMENTAL!] May not be encoded back into a backup file',
-)
-args = argp.parse_args()
+
+def build_parser() -> ArgumentParser:
+    argp = ArgumentParser()
+    argp.add_argument(
+        '--input',
+        '-i',
+        metavar='<backup_file.tachibk | backup_file.proto.gz | backup_file.proto | decoded_backup.json | records.tbkrec>',
+        help='File extension defines whether to decode a backup file to JSON or encode it back',
+        type=Path,
+    )
+    argp.add_argument(
+        '--output',
+        '-o',
+        default='output.json',
+        metavar='<output.json | encoded_backup.tachibk | records.tbkrec | library.sqlite>',
+        help='When encoding, TACHIBK or PROTO.GZ will additionally recompress the backup file. TBKREC writes the '
+        'binary record file the other scripts read faster than JSON. SQLITE or DB loads the manga, chapters, '
+        'categories, tracking, history and sources into indexed tables',
+        type=Path,
+    )
+    argp.add_argument(
+        '--fork',
+        default=list(FORKS.keys())[0],
+        choices=FORKS.keys(),
+        metavar=f'<{" | ".join(FORKS.keys())}>',
+        help='Fork for the backup schema. Default: mihon',
+    )
+    argp.add_argument(
+        '--dump-schemas',
+        action='store_true',
+        help='Dump protobuf schemas from all supported forks',
+    )
+    argp.add_argument(
+        '--offline',
+        action='store_true',
+        help='Generate schemas only from the model files cached in manga/proto/cache/',
+    )
+    argp.add_argument(
+        '--convert-preferences',
+        action='store_true',
+        help='Convert the preference values into human-readable format. They are encoded back to the same bytes',
+    )
+    argp.add_argument(
+        '--stream',
+        action='store_true',
+        help='Decode or encode the backup one manga entry at a time to keep memory low on huge libraries',
+    )
+    argp.add_argument(
+        '--fast-json',
+        action='store_true',
+        help='Write JSON straight from the protobuf messages instead of going through MessageToDict',
+    )
+    argp.add_argument(
+        '--compact',
+        action='store_true',
+        help='Write JSON without indentation. Implies --fast-json',
+    )
+    argp.add_argument(
+        '--compression-level',
+        default=parallel_gzip.DEFAULT_LEVEL,
+        type=int,
+        choices=range(10),
+        metavar='<0-9>',
+        help='Gzip level when encoding. Lower is faster, 9 gives the smallest backup. Default: 9',
+    )
+    argp.add_argument(
+        '--threads',
+        type=int,
+        metavar='<count>',
+        help='Threads used for gzip compression. Default: one per CPU',
+    )
+    argp.add_argument(
+        '--no-index',
+        action='store_true',
+        help='Skip the library index and chapter columns written next to the JSON. The report scripts then parse the '
+        'JSON instead',
+    )
+    argp.add_argument(
+        '--keep-raw',
+        action='store_true',
+        help=f'Keep the decompressed backup in {raw_cache.RAW_CACHE_DIR}/ so decoding the same file again skips gunzip',
+    )
+    argp.add_argument(
+        '--cache',
+        action='store_true',
+        help='Keep a copy of the decoded JSON and index in manga/proto/decoded/, so decoding the same backup with the '
+        'same schema and options again only copies it back. Costs a second full write of the outputs on a miss',
+    )
+    argp.add_argument(
+        '--cache-size',
+        type=int,
+        default=1024,
+        metavar='<MiB>',
+        help='Size limit of the decode cache with --cache, least recently used backups go first. Default: 1024',
+    )
+    argp.add_argument(
+        '--profile',
+        type=Path,
+        metavar='<profile.pstats>',
+        help='Write a cProfile dump of the conversion, e.g. for python -m pstats or snakeviz',
+    )
+    argp.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help='Record the tracemalloc peak of every stage. Slows the conversion down',
+    )
+    argp.add_argument(
+        '--metrics-json',
+        type=Path,
+        metavar='<metrics.json>',
+        help='Write the time, CPU time, bytes and peak memory of every stage as JSON',
+    )
+    return argp
+
+
+# Set by main(), read by the helpers below
+argp: ArgumentParser
+args: Namespace
+Backup: type[Message]
+metrics = Metrics()
+
+
+@cache
+def schema_fetcher() -> SchemaFetcher:
+    # Shared by all forks so --dump-schemas reuses the pooled connections
+    from schema_fetch import SchemaFetcher
+
+    return SchemaFetcher(offline=args.offline)
 
 
 def fetch_schema(fork: str) -> list[tuple[str, str]]:
-    files: list[tuple[str, str]] = []
-    git = get(
-        f'https://api.github.com/repos/{fork}/contents/app/src/main/java/eu/kanade/tachiyomi/data/backup/models'
-    ).json()
-    for entry in git:
-        if entry.get('type') == 'file':
-            files.append((entry.get('name'), entry.get('download_url')))
-        elif entry.get('type') == 'dir':
-            for sub_entry in get(entry.get('url')).json():
-                if sub_entry.get('type') == 'file':
-                    files.append((sub_entry.get('name'), sub_entry.get('download_url')))
-    return files
-
-
-def parse_model(model: str) -> list[str]:
-    data = get(model).text
+    from requests import RequestException
+
+    import schema_fetch
+
+    try:
+        return schema_fetcher().fetch_models(fork)
+    except schema_fetch.SchemaCacheMiss as e:
+        print(f'ERROR! {e}. Run once without --offline to fill the cache.')
+        exit(1)
+    except RequestException as e:
+        print(f'ERROR! Unable to download the {fork} backup models.', e)
+        exit(1)
+
+
+def parse_model(data: str) -> list[str]:
     message: list[str] = []
     for name in re.finditer(CLASS_RE, data, re.MULTILINE):
         message.append('message {name} {{'.format(name=name.group('name')))
@@ -117,7 +221,7 @@ def parse_model(model: str) -> list[str]:
     return message
 
 
-def proto_gen(file: str = None, fork: str = args.fork):
+def proto_gen(fork: str, file: str | None = None) -> str:
     # Hard-coded exceptions to make parsing easier
     schema = '''syntax = "proto2";
 
@@ -140,173 +244,432 @@ message PreferenceValue {
     filename = file or f'schema-{fork}.proto'
     print(f'Writing {filename}')
     print('\n'.join(schema), file=open(filename, 'wt'))
+    return '\n'.join(schema)
+
 
+def dump_schemas() -> None:
+    from schema_registry import SchemaRegistry
 
-if args.dump_schemas:
     print('Generating Protobuf schemas')
+    registry = SchemaRegistry()
     for fork in FORKS:
-        proto_gen(fork=fork)
+        registry.store(fork, proto_gen(fork=fork))
     print('END')
-    exit(0)
 
-try:
-    from schema_pb2 import Backup
-except (ModuleNotFoundError, NameError):
+
+def schema_source(fork: str) -> str:
+    # The repository ships mihon's schema, other forks are generated from their models
+    from schema_registry import bundled_text
+
+    if (text := bundled_text(fork)) is not None:
+        return text
     print('No protobuf schema found...')
-    proto_gen('schema.proto')
-    print('Generating Python sources...')
+    return proto_gen(fork=fork)
+
+
+def load_schema(fork: str) -> type[Message]:
+    from schema_registry import SchemaRegistry
+
     try:
-        run(['protoc', '--python_out=.', '--pyi_out=.', 'schema.proto'])
-    except FileNotFoundError:
-        print(
-            'ERROR! Protoc not found.',
-            'Download at https://github.com/protocolbuffers/protobuf/releases/latest',
-        )
+        return SchemaRegistry().message_class(fork, generate=schema_source)
+    except ValueError as e:
+        print('ERROR! Unable to build the protobuf schema.', e)
         exit(1)
+
+
+def file_size(path: str | Path) -> int | None:
     try:
-        from schema_pb2 import Backup
-    except (ModuleNotFoundError, NameError):
-        print('ERROR! Still unable to find the protobuf schema. Aborting.')
-        exit(1)
+        return Path(path).stat().st_size
+    except OSError:
+        return None
+
+
+def is_compressed(input: str) -> bool:
+    return input.endswith('.tachibk') or input.endswith('.proto.gz')
 
 
-def read_backup(input: str) -> str | bytes:
-    if input.endswith('.tachibk') or input.endswith('.proto.gz'):
-        with gzip.open(input, 'rb') as zip:
+def raw_digest(input: str) -> str | None:
+    # Hashing is only worth it when there is a cache to hit or to fill
+    if args.keep_raw or raw_cache.has_entries():
+        return raw_cache.file_digest(input)
+    return None
+
+
+def read_backup(input: str) -> bytes | memoryview:
+    try:
+        if record_file.is_record_file(input):
+            return record_file.map_payload(input)
+        if not is_compressed(input):
+            return raw_cache.map_file(input)
+        digest = raw_digest(input)
+        if digest and (cached := raw_cache.lookup(digest)):
+            print(f'Using cached raw backup {cached}')
+            return raw_cache.map_file(cached)
+        with parallel_gzip.open(input, 'rb') as zip:
             backup_data = zip.read()
-            with open('manga/proto/extracted_tachibk', 'wb') as file:
-                file.write(backup_data)
-    else:
-        try:
-            with open('extracted_tachibk', 'rb') as file:
-                backup_data = file.read()
-        except OSError:
-            print('ERROR! No Backup to process.')
-            argp.print_help()
-            exit(1)
+    except OSError:
+        print('ERROR! No Backup to process.')
+        argp.print_help()
+        exit(1)
+    if args.keep_raw:
+        print(f'Raw backup kept at {raw_cache.store(digest, backup_data)}')
     return backup_data
 
 
-def parse_backup(backup_data) -> Backup:
+def open_backup_stream(input: str):
+    try:
+        if record_file.is_record_file(input):
+            return record_file.open_payload(input)
+        if not is_compressed(input):
+            return open(input, 'rb', buffering=1 << 20)
+        digest = raw_digest(input)
+        cached = digest and raw_cache.lookup(digest)
+        if cached:
+            print(f'Using cached raw backup {cached}')
+        elif args.keep_raw:
+            with parallel_gzip.open(input, 'rb') as zip:
+                cached = raw_cache.store_stream(digest, zip)
+            print(f'Raw backup kept at {cached}')
+        if cached:
+            return open(cached, 'rb', buffering=1 << 20)
+        return parallel_gzip.open(input, 'rb')
+    except OSError:
+        print('ERROR! No Backup to process.')
+        argp.print_help()
+        exit(1)
+
+
+def parse_backup(backup_data) -> Message:
     message = Backup()
     message.ParseFromString(backup_data)
     return message
 
 
-def write_json(message: Backup) -> None:
-    message_dict = MessageToDict(message)
+@cache
+def preference_codec(message_type: type[Message]) -> PreferenceCodec:
+    from preference_codec import PreferenceCodec
+
+    return PreferenceCodec(message_type)
+
+
+def translate_preferences(message_dict: dict) -> None:
+    print('Translating Preferences...')
+    preference_codec(Backup).decode_preferences(message_dict)
+
+
+def json_emitter() -> JSONEmitter | None:
+    if args.fast_json or args.compact:
+        from json_emitter import JSONEmitter
+
+        return JSONEmitter(args.compact)
+    return None
+
+
+def write_json(message: Message) -> None:
+    if emitter := json_emitter():
+        from backup_stream import iter_records, write_json_records
+
+        with metrics.stage('emit_json') as stage, open(args.output, 'wt', buffering=1 << 20) as file:
+            write_json_records(
+                iter_records(message),
+                file,
+                Backup,
+                translate_preferences if args.convert_preferences else None,
+                emitter,
+            )
+            stage.bytes_out = file.tell()
+        print(f'Backup decoded to "{args.output}"')
+        return
+
+    from google.protobuf.json_format import MessageToDict
+
+    with metrics.stage('to_dict'):
+        message_dict = MessageToDict(message)
 
     if args.convert_preferences:
-        print('Translating Preferences...')
-        for idx, pref in enumerate(message_dict.get('backupPreferences')):
-            message_dict['backupPreferences'][idx]['value']['truevalue'] = readable_preference(pref)
-        for source_index, source in enumerate(message_dict.get('backupSourcePreferences')):
-            for idx, pref in enumerate(source.get('prefs')):
-                message_dict['backupSourcePreferences'][source_index]['prefs'][idx]['value'][
-                    'truevalue'
-                ] = readable_preference(pref)
-
-    with open(args.output, 'wt') as file:
-        file.write(dumps(message_dict, indent=2))
+        with metrics.stage('preferences'):
+            translate_preferences(message_dict)
+
+    with metrics.stage('dumps') as stage:
+        text = dumps(message_dict, indent=2)
+        with open(args.output, 'wt') as file:
+            file.write(text)
+        stage.bytes_out = len(text)
     print(f'Backup decoded to "{args.output}"')
 
 
-def readable_preference(preference_value: dict):
-    true_value = preference_value['value']['truevalue']
-    match preference_value['value']['type'].split('.')[-1].removesuffix('PreferenceValue'):
-        case 'Boolean':
-            return bool(varint.decode_bytes(b64decode(true_value)[1:]))
-        case 'Int' | 'Long':
-            return varint.decode_bytes(b64decode(true_value)[1:])
-        case 'Float':
-            return unpack(
-                'f',
-                b64decode(true_value)[1:],
-            )[0]
-        case 'String':
-            return b64decode(true_value)[2:].decode('utf-8')
-        case 'StringSet':
-            bar = list(b64decode(true_value))
-            new_list = []
-            for byte in bar:
-                if byte == bar[0]:
-                    new_list.append([])
-                    continue
-                new_list[-1].append(byte)
-            for index, entry in enumerate(new_list):
-                new_list[index] = bytes(entry[1:]).decode('utf-8')
-            return new_list
-        case _:
-            return None
-
-
-def bytes_preference(preference_value: dict):
-    true_value = preference_value['value']['truevalue']
-    print(f'Parsing {true_value}')
-    match preference_value['value']['type'].split('.')[-1].removesuffix('PreferenceValue'):
-        case 'Boolean':
-            return b64encode(b'\x08' + int(true_value).to_bytes()).decode()
-        case 'Int' | 'Long':
-            return b64encode(b'\x08' + varint.encode(true_value)).decode()
-        case 'Float':
-            return b64encode(b'\r' + pack('f', true_value)).decode()
-        case 'String':
-            return b64encode(b'\n' + len(true_value).to_bytes() + true_value.encode()).decode()
-        case 'StringSet':
-            new_bytes = b''
-            for val in true_value:
-                new_bytes += b'\n' + len(val).to_bytes() + val.encode()
-            return b64encode(new_bytes).decode()
-        case _:
-            return ''
+def write_json_streamed(input: str) -> None:
+    from backup_stream import iter_message_spans, write_json_records
+    from chapter_store import ChapterColumns
+    from library_index import IndexBuilder
+
+    index = None if args.no_index else IndexBuilder(Backup, ChapterColumns())
+    with metrics.stage('stream_json', file_size(input)) as stage:
+        with open_backup_stream(input) as backup, open(args.output, 'wt') as file:
+            records = iter_message_spans(backup, Backup)
+            count = write_json_records(
+                index.track(records) if index else ((number, message) for number, message, _, _ in records),
+                file,
+                Backup,
+                translate_preferences if args.convert_preferences else None,
+                json_emitter(),
+            )
+            stage.bytes_out = file.tell()
+    print(f'Backup decoded to "{args.output}" ({count} manga streamed)')
+    if index:
+        with metrics.stage('index'):
+            write_index(index)
+
+
+def write_index(index: IndexBuilder) -> None:
+    from chapter_store import chapters_path
+    from library_index import index_path
+
+    path = index_path(args.output)
+    index.write(path, args.output)
+    index.chapters.write(chapters_path(args.output), args.output)
+    print(f'Library index written to "{path}"')
+
+
+def index_backup(message: Message, backup_data) -> None:
+    from chapter_store import ChapterColumns
+    from lazy_backup import LazyBackup
+    from library_index import IndexBuilder
+
+    index = IndexBuilder(Backup, ChapterColumns())
+    index.add_message(message, LazyBackup(backup_data, Backup))
+    write_index(index)
+
+
+def encode_preferences(message_dict: dict) -> None:
+    # Values converted with --convert-preferences are serialized again, raw ones are kept
+    preference_codec(Backup).encode_preferences(message_dict)
 
 
 def parse_json(input: str) -> bytes:
+    from google.protobuf.json_format import ParseError
+
+    from proto_builder import build_message
+
     try:
-        with open(input, 'r') as file:
+        with metrics.stage('read_json', file_size(input)), open(input, 'r') as file:
             message_dict = loads(file.read())
     except OSError:
         print('ERROR! Could not read the JSON file.')
         exit(1)
 
-    # Check if --convert-preferences was used
-    for idx, pref in enumerate(message_dict.get('backupPreferences', [])):
-        if 'String' not in pref['value']['type'] and isinstance(pref['value']['truevalue'], str):
-            break
-        message_dict['backupPreferences'][idx]['value']['truevalue'] = bytes_preference(pref)
-    for source_index, source in enumerate(message_dict.get('backupSourcePreferences', [])):
-        for idx, pref in enumerate(source.get('prefs')):
-            if 'String' not in pref['value']['type'] and isinstance(
-                pref['value']['truevalue'], str
-            ):
-                break
-            message_dict['backupSourcePreferences'][source_index]['prefs'][idx]['value'][
-                'truevalue'
-            ] = bytes_preference(pref)
+    with metrics.stage('preferences'):
+        encode_preferences(message_dict)
 
     try:
-        return Parse(dumps(message_dict), Backup()).SerializeToString()
+        with metrics.stage('build') as stage:
+            message = build_message(Backup, message_dict).SerializeToString()
+            stage.bytes_out = len(message)
+        return message
     except ParseError as e:
         print('The input JSON file is invalid.', e)
         exit(1)
 
 
-def write_backup(message: bytes) -> None:
-    compression = True
+def backup_output() -> tuple[str, bool]:
     output = 'encoded_backup.tachibk' if str(args.output) == 'output.json' else str(args.output)
-    if output.endswith('.proto.gz') or output.endswith('.tachibk'):
-        with gzip.open(output, 'wb') as zip:
-            zip.write(message)
-    else:
-        with open(output, 'wb') as file:
-            file.write(message)
-        compression = False
-    print(f'{"C" if compression else "Unc"}ompressed backup written to {output}')
+    return output, output.endswith('.proto.gz') or output.endswith('.tachibk')
 
 
-if __name__ == '__main__':
-    input = str(args.input)
+def open_compressed(output: str):
+    return parallel_gzip.open(output, 'wb', args.compression_level, args.threads)
+
+
+def open_output(output: str, compression: bool):
+    if record_file.is_record_file(output):
+        return record_file.open_writer(output, args.fork)
+    return open_compressed(output) if compression else open(output, 'wb')
+
+
+def output_kind(output: str, compression: bool) -> str:
+    if record_file.is_record_file(output):
+        return 'Record file'
+    return f'{"C" if compression else "Unc"}ompressed backup'
+
+
+def write_backup(message: bytes) -> None:
+    output, compression = backup_output()
+    with metrics.stage('gzip' if compression else 'write', len(message)) as stage:
+        if record_file.is_record_file(output):
+            record_file.write_records(output, args.fork, message)
+        elif compression:
+            with open_compressed(output) as zip:
+                zip.write(message)
+        else:
+            with open(output, 'wb') as file:
+                file.write(message)
+        stage.bytes_out = file_size(output)
+    print(f'{output_kind(output, compression)} written to {output}')
+
+
+def write_backup_streamed(input: str) -> None:
+    from google.protobuf.json_format import ParseError
+
+    from backup_stream import write_backup_stream
+    from json_stream import iter_json_items
+
+    output, compression = backup_output()
+    try:
+        file = open(input, 'r')
+    except OSError:
+        print('ERROR! Could not read the JSON file.')
+        exit(1)
+    try:
+        with metrics.stage('stream_backup', file_size(input)) as stage:
+            with file, open_output(output, compression) as backup:
+                count = write_backup_stream(
+                    iter_json_items(file, 'backupManga'), backup, Backup, encode_preferences
+                )
+            stage.bytes_out = file_size(output)
+    except (ParseError, JSONDecodeError) as e:
+        Path(output).unlink(missing_ok=True)
+        print('The input JSON file is invalid.', e)
+        exit(1)
+    print(f'{output_kind(output, compression)} written to {output} ({count} manga streamed)')
+
+
+def repack(input: str) -> None:
+    # Backups and record files hold the same payload, only the wrapping changes
+    with metrics.stage('read', file_size(input)) as stage:
+        payload = read_backup(input)
+        stage.bytes_out = len(payload)
+    write_backup(payload)
+
+
+def export_sqlite(input: str) -> None:
+    from lazy_backup import LazyBackup
+
+    # JSON goes through the encoder, every other input is a backup payload already
     if input.endswith('.json'):
-        write_backup(parse_json(input))
+        payload = parse_json(input)
+    else:
+        with metrics.stage('read', file_size(input)) as stage:
+            payload = read_backup(input)
+            stage.bytes_out = len(payload)
+    with metrics.stage('sqlite', len(payload)) as stage:
+        counts = sqlite_export.export_backup(LazyBackup(payload, Backup), args.output)
+        stage.bytes_out = file_size(args.output)
+    print(
+        f'Library exported to "{args.output}" ({counts.get("manga", 0)} manga, '
+        f'{counts.get("chapters", 0)} chapters)'
+    )
+
+
+def convert() -> None:
+    input, output = str(args.input), str(args.output)
+    if sqlite_export.is_sqlite_file(output):
+        export_sqlite(input)
+    elif input.endswith('.json'):
+        if args.stream:
+            write_backup_streamed(input)
+        else:
+            write_backup(parse_json(input))
+    elif record_file.is_record_file(output) or (record_file.is_record_file(input) and not output.endswith('.json')):
+        repack(input)
+    else:
+        decode(input)
+
+
+def decoded_outputs(fresh: bool = False) -> dict[str, Path]:
+    # Files of a decode, by their name in the decode cache. With fresh, only the
+    # sidecars written for the JSON as it is now, not ones an earlier run (or
+    # --no-index) left behind
+    from chapter_store import chapters_are_fresh, chapters_path
+    from library_index import index_is_fresh, index_path
+
+    outputs = {'decoded.json': Path(args.output)}
+    if not fresh or index_is_fresh(args.output):
+        outputs['decoded.idx'] = index_path(args.output)
+    if not fresh or chapters_are_fresh(args.output):
+        outputs['decoded.chapters'] = chapters_path(args.output)
+    return outputs
+
+
+def decode(input: str) -> None:
+    cache = None
+    if args.cache and args.cache_size:
+        try:
+            digest = raw_cache.file_digest(input)
+        except OSError:
+            digest = None  # read_backup reports it
+        if digest:
+            from decode_cache import DecodeCache, schema_fingerprint
+
+            cache = DecodeCache(max_bytes=args.cache_size << 20)
+            schema = schema_fingerprint(Backup)
+            options = {
+                'version': __version__,
+                'convert_preferences': args.convert_preferences,
+                'compact': args.compact,
+                'index': not args.no_index,
+            }
+            key = cache.key(digest, args.fork, schema, options)
+            with metrics.stage('cache', file_size(input)) as stage:
+                if cache.restore(key, decoded_outputs()):
+                    stage.bytes_out = file_size(args.output)
+                    print(f'Backup decoded to "{args.output}" (from the decode cache)')
+                    return
+            cache.invalidate(digest, args.fork, schema)
+
+    if args.stream:
+        write_json_streamed(input)
     else:
-        write_json(parse_backup(read_backup(input)))
+        with metrics.stage('read', file_size(input)) as stage:
+            backup_data = read_backup(input)
+            stage.bytes_out = len(backup_data)
+        with metrics.stage('parse', len(backup_data)):
+            message = parse_backup(backup_data)
+        write_json(message)
+        if not args.no_index:
+            with metrics.stage('index'):
+                index_backup(message, backup_data)
+
+    if cache is not None:
+        meta = {'sha256': digest, 'fork': args.fork, 'schema': schema, 'input': input}
+        if not cache.store(key, decoded_outputs(fresh=True), meta):
+            print(f'Not cached, the decoded backup is larger than --cache-size {args.cache_size}')
+
+
+def main(argv: list[str] | None = None) -> None:
+    global argp, args, Backup, metrics
+    argp = build_parser()
+    args = argp.parse_args(argv)
+    if args.dump_schemas:
+        dump_schemas()
+        return
+    metrics = Metrics(args.trace_memory)
+    if record_file.is_record_file(args.input or ''):
+        # Record files name the schema they were written with
+        try:
+            args.fork = record_file.read_fork(args.input)
+        except (OSError, ValueError) as e:
+            print(f'ERROR! Could not read the record file. {e}')
+            exit(1)
+    with metrics.stage('schema'):
+        Backup = load_schema(args.fork)
+
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.runcall(convert)
+        args.profile.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(args.profile)
+        print(f'Profile written to "{args.profile}"')
+    else:
+        convert()
+
+    if args.metrics_json:
+        metrics.write(args.metrics_json, version=__version__, input=str(args.input), output=str(args.output))
+        print(f'Metrics written to "{args.metrics_json}"')
+    if args.metrics_json or args.trace_memory or args.profile:
+        metrics.print_table()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic import BackupGenerator  # noqa: E402
+from schema_registry import backup_class  # noqa: E402
+
+# The scripts find the bundled schema and their caches relative to the
+# working directory, like they do when run from the repository.
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture(scope='session')
+def backup_type():
+    return backup_class('mihon')
+
+
+def synthetic_payload(message_type, manga: int = 40, chapters: int = 12, seed: int = 0) -> bytes:
+    # A decompressed backup, the same bytes for the same arguments
+    from io import BytesIO
+
+    file = BytesIO()
+    BackupGenerator(message_type, manga, chapters, seed).write(file)
+    return file.getvalue()
+
+
+@pytest.fixture(scope='session')
+def payload(backup_type) -> bytes:
+    return synthetic_payload(backup_type)
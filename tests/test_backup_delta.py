@@ -0,0 +1,47 @@
+import pytest
+
+from backup_delta import DeltaError, apply_delta, create_delta, load_delta, patch_spec, write_delta
+
+
+def newer(backup_type, payload: bytes) -> bytes:
+    # The next backup of the same library: chapters read, a manga removed and one added
+    message = backup_type.FromString(payload)
+    for chapter in message.backupManga[3].chapters:
+        chapter.read = True
+    message.backupManga[5].chapters[0].lastPageRead += 7
+    del message.backupManga[10]
+    added = message.backupManga.add()
+    added.CopyFrom(message.backupManga[0])
+    added.url = '/manga/new-one'
+    added.title = 'A New One'
+    return message.SerializeToString()
+
+
+def test_round_trip(backup_type, payload):
+    target = newer(backup_type, payload)
+    delta, metadata = create_delta(payload, target, patch_spec(backup_type.DESCRIPTOR))
+    assert apply_delta(payload, delta) == target
+    assert metadata['manga'] == 40 and metadata['added'] == 1 and len(metadata['removed']) == 1
+    # Most of the target is copied from the base
+    assert len(delta) < len(target) // 10
+
+
+def test_round_trip_through_a_file(tmp_path, backup_type, payload):
+    target = newer(backup_type, payload)
+    delta, _ = create_delta(payload, target, patch_spec(backup_type.DESCRIPTOR))
+    write_delta(tmp_path / 'next.tbkdelta', delta, 6)
+    assert apply_delta(payload, load_delta(tmp_path / 'next.tbkdelta')) == target
+
+
+def test_unchanged_backup(backup_type, payload):
+    delta, metadata = create_delta(payload, payload, patch_spec(backup_type.DESCRIPTOR))
+    assert apply_delta(payload, delta) == payload
+    assert metadata['added'] == 0 and metadata['removed'] == []
+
+
+def test_other_base_is_rejected(backup_type, payload):
+    delta, _ = create_delta(payload, newer(backup_type, payload), patch_spec(backup_type.DESCRIPTOR))
+    with pytest.raises(DeltaError, match='different base'):
+        apply_delta(payload[:-1], delta)
+    with pytest.raises(DeltaError, match='Not a backup delta'):
+        apply_delta(payload, b'TBKDLT00' + delta[8:])
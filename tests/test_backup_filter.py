@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from google.protobuf.json_format import MessageToDict
+
+import parallel_gzip
+from backup_filter import Query, filter_file
+
+QUERIES = {
+    'categories': dict(categories=['Reading', 'completed']),
+    'uncategorized': dict(categories=['Uncategorized']),
+    'excluded': dict(exclude_categories=['Dropped', 'Uncategorized']),
+    'sources': dict(sources=['MangaDex (EN)', 'Comick (EN)']),
+    'read ratio': dict(min_read_ratio=0.2, max_read_ratio=0.9),
+    'added': dict(added_after='2024-01-01', added_before='2025-01-01'),
+    'combined': dict(categories=['Reading', 'Manhwa'], sources=['MangaDex (EN)'], max_read_ratio=0.5),
+}
+
+
+@pytest.fixture
+def inputs(tmp_path, backup_type, payload):
+    backup = tmp_path / 'library.tachibk'
+    with parallel_gzip.open(backup, 'wb', 1) as file:
+        file.write(payload)
+    decoded = tmp_path / 'library.json'
+    decoded.write_text(json.dumps(MessageToDict(backup_type.FromString(payload)), indent=2))
+    return backup, decoded
+
+
+@pytest.mark.parametrize('query', QUERIES.values(), ids=QUERIES)
+def test_backup_and_json_inputs_agree(tmp_path, backup_type, inputs, query):
+    backup, decoded = inputs
+    from_backup = filter_file(backup, backup_type, Query(**query), tmp_path / 'a.json')
+    from_json = filter_file(decoded, backup_type, Query(**query), tmp_path / 'b.json')
+    assert (from_backup.total, from_backup.kept) == (from_json.total, from_json.kept) == (40, from_backup.kept)
+    assert json.loads((tmp_path / 'a.json').read_text()) == json.loads((tmp_path / 'b.json').read_text())
+
+    # Backup outputs are the same bytes, whichever input they were filtered from
+    filter_file(backup, backup_type, Query(**query), tmp_path / 'a.tachibk')
+    filter_file(decoded, backup_type, Query(**query), tmp_path / 'b.tachibk')
+    with parallel_gzip.open(tmp_path / 'a.tachibk') as a, parallel_gzip.open(tmp_path / 'b.tachibk') as b:
+        assert a.read() == b.read()
+
+
+@pytest.mark.parametrize('query', QUERIES.values(), ids=QUERIES)
+def test_kept_manga_match_the_query(tmp_path, backup_type, inputs, query):
+    backup, _ = inputs
+    result = filter_file(backup, backup_type, Query(**query), tmp_path / 'out.json')
+    output = json.loads((tmp_path / 'out.json').read_text())
+    kept = output.get('backupManga', [])
+    assert len(kept) == result.kept
+    # Re-filtering the output with the same query keeps everything
+    again = filter_file(tmp_path / 'out.json', backup_type, Query(**query), tmp_path / 'again.json')
+    assert again.kept == again.total == result.kept
+    # Only the categories kept manga use are left
+    used = {int(key) for manga in kept for key in manga.get('categories', [])}
+    assert {int(category.get('order', 0)) for category in output.get('backupCategories', [])} == used
+
+
+def test_empty_query_keeps_everything(tmp_path, backup_type, inputs, payload):
+    backup, _ = inputs
+    assert Query().empty
+    result = filter_file(backup, backup_type, Query(), tmp_path / 'all.tbkrec')
+    assert result.kept == result.total == 40
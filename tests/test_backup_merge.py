@@ -0,0 +1,47 @@
+from io import BytesIO
+
+from backup_merge import BackupMerger
+from conftest import synthetic_payload
+
+
+def merge(backup_type, *payloads: bytes) -> bytes:
+    merger = BackupMerger(backup_type)
+    for index, payload in enumerate(payloads):
+        merger.add(BytesIO(payload), f'input {index}')
+    output = BytesIO()
+    merger.write(output)
+    return output.getvalue()
+
+
+def test_merging_a_backup_with_itself(backup_type, payload):
+    once = merge(backup_type, payload)
+    assert merge(backup_type, payload, payload) == once
+    assert merge(backup_type, once) == once
+
+
+def test_merge_is_idempotent(backup_type, payload):
+    other = synthetic_payload(backup_type, manga=30, seed=1)
+    merged = merge(backup_type, payload, other)
+    # Adding the last input again changes nothing, preferences and the like
+    # already hold its values since later inputs win
+    assert merge(backup_type, merged, other) == merged
+    assert merge(backup_type, merged) == merged
+
+
+def test_later_inputs_win_for_preferences(backup_type, payload):
+    other = synthetic_payload(backup_type, manga=30, seed=1)
+    merged = backup_type.FromString(merge(backup_type, payload, other))
+    assert list(merged.backupPreferences) == list(backup_type.FromString(other).backupPreferences)
+
+
+def test_manga_are_matched_by_source_and_url(backup_type, payload):
+    other = synthetic_payload(backup_type, manga=30, seed=1)
+    keys = set()
+    for data in (payload, other):
+        keys |= {(manga.source, manga.url) for manga in backup_type.FromString(data).backupManga}
+    merged = backup_type.FromString(merge(backup_type, payload, other))
+    assert {(manga.source, manga.url) for manga in merged.backupManga} == keys
+    assert len(merged.backupManga) == len(keys)
+    # Categories are merged by name, each one once
+    names = [category.name for category in merged.backupCategories]
+    assert len(names) == len(set(names))
@@ -0,0 +1,76 @@
+import os
+
+from chapter_store import ChapterColumns, chapters_are_fresh, chapters_path
+from decode_cache import DecodeCache, schema_fingerprint
+from lazy_backup import LazyBackup
+from library_index import IndexBuilder, index_is_fresh, index_path, load_index
+
+
+def decoded(tmp_path, backup_type, payload, name: str = 'output.json') -> dict:
+    # A decoded backup with both sidecars, named like the converter's outputs
+    json_path = tmp_path / name
+    json_path.write_text('{"backupManga": []}')
+    columns = ChapterColumns()
+    builder = IndexBuilder(backup_type, columns)
+    builder.add_lazy(LazyBackup(payload, backup_type))
+    builder.write(index_path(json_path), json_path)
+    columns.write(chapters_path(json_path), json_path)
+    return {'decoded.json': json_path, 'decoded.idx': index_path(json_path), 'decoded.chapters': chapters_path(json_path)}
+
+
+def test_sidecars_are_fresh_until_the_json_changes(tmp_path, backup_type, payload):
+    json_path = decoded(tmp_path, backup_type, payload)['decoded.json']
+    assert index_is_fresh(json_path) and chapters_are_fresh(json_path)
+    json_path.write_text('{"backupManga": [{}]}')
+    assert not index_is_fresh(json_path) and not chapters_are_fresh(json_path)
+    assert load_index(json_path) is None
+
+
+def test_sidecar_of_another_kind_is_not_fresh(tmp_path, backup_type, payload):
+    outputs = decoded(tmp_path, backup_type, payload)
+    os.replace(outputs['decoded.chapters'], outputs['decoded.idx'])
+    assert not index_is_fresh(outputs['decoded.json'])
+    assert not chapters_are_fresh(outputs['decoded.json'])
+
+
+def test_restore_keeps_the_sidecars_valid(tmp_path, backup_type, payload):
+    cache = DecodeCache(tmp_path / 'cache')
+    key = cache.key('digest', 'mihon', schema_fingerprint(backup_type), {'compact': False})
+    assert cache.store(key, decoded(tmp_path, backup_type, payload), {'sha256': 'digest'})
+
+    restored = tmp_path / 'restored'
+    outputs = {name: restored / path.name for name, path in decoded(tmp_path, backup_type, payload).items()}
+    assert cache.restore(key, outputs)
+    assert index_is_fresh(outputs['decoded.json']) and chapters_are_fresh(outputs['decoded.json'])
+    assert len(load_index(outputs['decoded.json'])) == 40
+
+
+def test_only_the_given_files_are_stored(tmp_path, backup_type, payload):
+    cache = DecodeCache(tmp_path / 'cache')
+    outputs = decoded(tmp_path, backup_type, payload)
+    del outputs['decoded.idx']
+    assert cache.store('key', outputs, {})
+    assert sorted(path.name for path in cache.path('key').iterdir()) == ['decoded.chapters', 'decoded.json', 'meta.json']
+    assert not cache.restore('other key', outputs)
+
+
+def test_entries_of_another_schema_are_invalidated(tmp_path, backup_type, payload):
+    cache = DecodeCache(tmp_path / 'cache')
+    outputs = decoded(tmp_path, backup_type, payload)
+    cache.store('old', outputs, {'sha256': 'digest', 'fork': 'mihon', 'schema': 'old schema'})
+    cache.store('other', outputs, {'sha256': 'other digest', 'fork': 'mihon', 'schema': 'old schema'})
+    assert cache.invalidate('digest', 'mihon', 'new schema') == 1
+    assert [path.name for path, _ in cache.entries()] == ['other']
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, backup_type, payload):
+    outputs = decoded(tmp_path, backup_type, payload)
+    size = sum(path.stat().st_size for path in outputs.values())
+    cache = DecodeCache(tmp_path / 'cache', max_bytes=2 * size)
+    cache.store('first', outputs, {})
+    cache.store('second', outputs, {})
+    assert cache.restore('first', outputs)
+    cache.store('third', outputs, {})
+    assert sorted(path.name for path, _ in cache.entries()) == ['first', 'third']
+    # An entry alone over the limit isn't stored
+    assert not DecodeCache(tmp_path / 'small', max_bytes=size - 1).store('key', outputs, {})
@@ -0,0 +1,40 @@
+import gzip
+import random
+
+import pytest
+
+import parallel_gzip
+
+
+def test_round_trip(tmp_path):
+    data = random.Random(0).randbytes(200_000) * 3
+    path = tmp_path / 'data.gz'
+    with parallel_gzip.open(path, 'wb', threads=4) as file:
+        file.write(data)
+    # Read back by the standard library as well, it is a single gzip member
+    assert gzip.decompress(path.read_bytes()) == data
+    with parallel_gzip.open(path, 'rb') as file:
+        assert file.read() == data
+
+
+def test_concatenated_members(tmp_path):
+    path = tmp_path / 'data.gz'
+    path.write_bytes(gzip.compress(b'first ') + gzip.compress(b'second'))
+    with parallel_gzip.open(path, 'rb') as file:
+        assert file.read() == b'first second'
+
+
+def test_truncated_input(tmp_path):
+    path = tmp_path / 'data.gz'
+    path.write_bytes(gzip.compress(random.Random(0).randbytes(100_000))[:-100])
+    with pytest.raises(EOFError), parallel_gzip.open(path, 'rb') as file:
+        file.read()
+
+
+@pytest.mark.parametrize('size', [10, 1_000_000])
+def test_no_output_when_the_with_body_raises(tmp_path, size):
+    path = tmp_path / 'data.gz'
+    with pytest.raises(RuntimeError), parallel_gzip.open(path, 'wb') as file:
+        file.write(b'x' * size)
+        raise RuntimeError('interrupted')
+    assert not path.exists()
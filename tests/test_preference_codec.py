@@ -0,0 +1,52 @@
+import binascii
+import copy
+
+import pytest
+from google.protobuf.json_format import MessageToDict
+
+from preference_codec import PreferenceCodec
+
+PREFIX = 'eu.kanade.tachiyomi.data.backup.models.'
+
+
+@pytest.fixture(scope='module')
+def codec(backup_type):
+    return PreferenceCodec(backup_type)
+
+
+def test_round_trip(backup_type, payload, codec):
+    backup = MessageToDict(backup_type.FromString(payload))
+    converted = copy.deepcopy(backup)
+    codec.decode_preferences(converted)
+    assert converted != backup
+    codec.encode_preferences(converted)
+    assert converted == backup
+
+
+@pytest.mark.parametrize(
+    'type_name, value',
+    [('Int', 5), ('Long', -3), ('Boolean', True), ('Float', 0.5), ('String', 'auto'), ('String', ''), ('StringSet', ['a', 'b'])],
+)
+def test_bare_values(codec, type_name, value):
+    # Older --convert-preferences output, the value without the JSON form
+    entry = {'type': f'{PREFIX}{type_name}PreferenceValue', 'truevalue': value}
+    assert not codec.is_raw(entry['type'], value)
+    data = {'backupPreferences': [{'key': 'pref', 'value': entry}]}
+    codec.encode_preferences(data)
+    encoded = binascii.a2b_base64(entry['truevalue'])
+    assert encoded == codec.encode(entry['type'], {'value': value})
+    # Decoded again, it is the JSON form of the same bytes
+    assert codec.encode(entry['type'], codec.decode(entry['type'], encoded)) == encoded
+
+
+def test_empty_string_is_not_base64(codec):
+    # The base64 of no bytes, but as a String value it is the empty string
+    type_name = f'{PREFIX}StringPreferenceValue'
+    assert not codec.is_raw(type_name, '')
+    assert codec.encode(type_name, '') == b'\n\x00'
+
+
+def test_base64_string_value_is_kept(codec):
+    type_name = f'{PREFIX}StringPreferenceValue'
+    raw = binascii.b2a_base64(codec.encode(type_name, 'auto'), newline=False).decode()
+    assert codec.is_raw(type_name, raw)
@@ -0,0 +1,43 @@
+import pytest
+
+import record_file
+from lazy_backup import open_backup
+
+
+def test_header_names_the_fork(tmp_path, payload):
+    path = tmp_path / 'library.tbkrec'
+    with record_file.open_writer(path, 'sy') as file:
+        file.write(payload)
+    data = path.read_bytes()
+    assert data.startswith(record_file.MAGIC)
+    assert record_file.read_fork(path) == 'sy'
+    assert record_file.read_header(data) == ('sy', record_file.HEADER.size + 2)
+    assert bytes(record_file.map_payload(path)) == payload
+    with record_file.open_payload(path) as file:
+        assert file.read() == payload
+
+
+@pytest.mark.parametrize('data', [b'', b'TBKREC', b'TBKREC02\x02\x00sy', b'\x1f\x8b\x08\x00' + b'\x00' * 16])
+def test_other_files_are_rejected(tmp_path, data):
+    path = tmp_path / 'other.tbkrec'
+    path.write_bytes(data)
+    with pytest.raises(ValueError, match='Not a record file'):
+        record_file.read_header(data)
+    with pytest.raises(ValueError, match='Not a record file'):
+        record_file.read_fork(path)
+    with pytest.raises(ValueError, match='Not a record file'):
+        record_file.open_payload(path)
+
+
+def test_records_read_like_the_backup(tmp_path, backup_type, payload):
+    path = tmp_path / 'library.tbkrec'
+    with record_file.open_writer(path, 'mihon') as file:
+        file.write(payload)
+    backup = open_backup(path, backup_type)
+    assert len(backup) == 40
+    assert bytes(backup.data) == payload
+
+
+def test_suffix():
+    assert record_file.is_record_file('output/library.tbkrec')
+    assert not record_file.is_record_file('output/output.json')
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+
+import schema_fetch
+from schema_fetch import MODELS_PATH, SchemaCacheMiss, SchemaFetcher
+from schema_registry import SchemaNotCached
+
+# A stand-in for the parts of the GitHub API the fetcher uses, served from
+# localhost: the HEAD commit (with an ETag), the contents listing of the
+# models directory and a subdirectory, and the raw model files.
+
+REPO = 'owner/fork'
+SHA = '0123456789abcdef0123456789abcdef01234567'
+ETAG = '"head-v1"'
+MODELS = {
+    'Backup.kt': 'class Backup(@ProtoNumber(1) val backupManga: List<BackupManga>)',
+    'BackupManga.kt': 'class BackupManga(@ProtoNumber(1) var source: Long)',
+    'sub/BackupManga.kt': 'class BackupSubManga(@ProtoNumber(1) var url: String)',
+}
+
+
+class GitHub:
+    def __init__(self):
+        self.requests: list[tuple[str, str | None]] = []
+        self.head_status: int | None = None
+        self.delay = 0.0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def listing(self, directory: str) -> list[dict]:
+        entries, subdirectories = [], set()
+        for path in MODELS:
+            parent, _, name = path.rpartition('/')
+            if parent == directory:
+                entries.append({
+                    'type': 'file',
+                    'name': name,
+                    'download_url': f'{self.url}/raw/{REPO}/{SHA}/{MODELS_PATH}/{path}',
+                })
+            elif not directory and parent:
+                subdirectories.add(parent)
+        for name in sorted(subdirectories):
+            entries.append({'type': 'dir', 'name': name, 'url': f'{self.url}/repos/{REPO}/contents/{MODELS_PATH}/{name}?ref={SHA}'})
+        return entries
+
+    def respond(self, path: str, headers) -> tuple[int, dict, bytes]:
+        time.sleep(self.delay)
+        if path == f'/repos/{REPO}/commits/HEAD':
+            if self.head_status is not None:
+                return self.head_status, {}, b''
+            if headers.get('If-None-Match') == ETAG:
+                return 304, {'ETag': ETAG}, b''
+            return 200, {'ETag': ETAG}, SHA.encode()
+        contents = f'/repos/{REPO}/contents/{MODELS_PATH}'
+        if path == contents or path.startswith(contents + '/'):
+            return 200, {}, json.dumps(self.listing(path[len(contents) + 1 :])).encode()
+        raw = f'/raw/{REPO}/{SHA}/{MODELS_PATH}/'
+        if path.startswith(raw) and path[len(raw) :] in MODELS:
+            return 200, {}, MODELS[path[len(raw) :]].encode()
+        return 404, {}, b'{"message": "Not Found"}'
+
+    def handler(self):
+        github = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                github.requests.append((path, self.headers.get('If-None-Match')))
+                status, headers, body = github.respond(path, self.headers)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def github():
+    server = GitHub()
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def fetcher(github: GitHub, cache_dir, offline: bool = False) -> SchemaFetcher:
+    return SchemaFetcher(cache_dir, offline=offline, workers=2, api_url=github.url)
+
+
+def expected() -> list[tuple[str, str]]:
+    # Listing order: the files of the models directory, then the subdirectory's
+    return [(path.rpartition('/')[2], source) for path, source in MODELS.items()]
+
+
+def test_first_fetch_downloads_and_caches(github, tmp_path):
+    assert fetcher(github, tmp_path).fetch_models(REPO) == expected()
+    repo_dir = tmp_path / 'owner_fork'
+    assert (repo_dir / 'HEAD').read_text() == SHA
+    assert (repo_dir / SHA / 'models' / 'BackupManga.kt').read_text() == MODELS['BackupManga.kt']
+    # The subdirectory's file doesn't overwrite the top-level one of the same name
+    assert (repo_dir / SHA / 'models' / 'sub' / 'BackupManga.kt').read_text() == MODELS['sub/BackupManga.kt']
+
+
+def test_second_fetch_revalidates_with_the_stored_etag(github, tmp_path):
+    fetcher(github, tmp_path).fetch_models(REPO)
+    github.requests.clear()
+    assert fetcher(github, tmp_path).fetch_models(REPO) == expected()
+    # Only the HEAD lookup goes out, answered 304, everything else is cached by SHA
+    assert github.requests == [(f'/repos/{REPO}/commits/HEAD', ETAG)]
+
+
+def test_offline_hit_makes_no_requests(github, tmp_path):
+    fetcher(github, tmp_path).fetch_models(REPO)
+    github.requests.clear()
+    assert fetcher(github, tmp_path, offline=True).fetch_models(REPO) == expected()
+    assert github.requests == []
+
+
+def test_offline_miss_raises_schema_not_cached(github, tmp_path):
+    with pytest.raises(SchemaNotCached):
+        fetcher(github, tmp_path, offline=True).fetch_models(REPO)
+    assert github.requests == []
+
+
+def test_offline_miss_of_a_model(github, tmp_path):
+    fetcher(github, tmp_path).fetch_models(REPO)
+    (tmp_path / 'owner_fork' / SHA / 'models' / 'Backup.kt').unlink()
+    with pytest.raises(SchemaCacheMiss, match='Backup.kt'):
+        fetcher(github, tmp_path, offline=True).fetch_models(REPO)
+
+
+def test_unknown_repository_is_an_http_error(github, tmp_path):
+    with pytest.raises(requests.HTTPError) as error:
+        fetcher(github, tmp_path).fetch_models('owner/missing')
+    assert error.value.response.status_code == 404
+    assert not (tmp_path / 'owner_missing' / 'HEAD').exists()
+
+
+def test_timeout_without_a_cache(github, tmp_path, monkeypatch):
+    monkeypatch.setattr(schema_fetch, 'TIMEOUT', 0.2)
+    github.delay = 1.0
+    with pytest.raises(requests.Timeout):
+        fetcher(github, tmp_path).fetch_models(REPO)
+
+
+def test_cached_schema_is_used_when_the_head_lookup_fails(github, tmp_path, monkeypatch):
+    fetcher(github, tmp_path).fetch_models(REPO)
+    github.head_status = 503
+    assert fetcher(github, tmp_path).fetch_models(REPO) == expected()
+
+    monkeypatch.setattr(schema_fetch, 'TIMEOUT', 0.2)
+    github.head_status = None
+    github.delay = 1.0
+    assert fetcher(github, tmp_path).fetch_models(REPO) == expected()